@@ -45,6 +45,7 @@ setup(
 
     extras_require={
         ':python_version<"3.2"': ['futures'],
+        'fastjson': ['orjson'],
     },
 
     # See https://pypi.python.org/pypi?%3Aaction=list_classifiers
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""基于 :mod:`asyncio` 的 NET 客户端
+
+C 库回调线程中的事件，直接通过 :meth:`asyncio.AbstractEventLoop.call_soon_threadsafe` 转到指定的事件循环中执行，
+不再经过事件执行器（线程池）的中转。
+
+.. attention:: 该模块需要 Python 3.6 以上版本
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import inspect
+from time import perf_counter
+
+from .client import Client
+from .dispatch import KeyedExecutor
+
+__all__ = ['AsyncClient']
+
+
+class AsyncClient(Client):
+    """:mod:`asyncio` 样式的 NET 客户端
+
+    所有的 `on_xxx` 事件函数都在 :attr:`loop` 中执行，且可以是协程函数（ `async def` ）。
+    使用 `batch_dispatch` 时，默认的 :meth:`on_data_batch` 依次等待每个协程 :meth:`on_data` 执行完毕；
+    使用 `buffer_pool` 时，接收缓冲区在协程执行完毕后才归还。
+
+    .. note::
+        重写 :meth:`on_connect` 、 :meth:`on_disconnect` 、 :meth:`on_data` 时，
+        须调用父类的同名方法，否则 :meth:`wait_connected` 与 :meth:`incoming` 将无法工作。
+
+    例如::
+
+        client = AsyncClient.create(client_id, client_type, host, port, loop=loop)
+        client.activate()
+        await client.wait_connected()
+        params = await client.launch_flow(server_unit_id, 0, 'project', 'flow', 0, 30, [])
+        async for head, data in client.incoming():
+            ...
+    """
+
+    def __init__(self, client_id, client_type, master_ip, master_port, slave_ip=None, slave_port=None, user=None,
+                 password=None, info=None, loop=None, incoming_maxsize=0, **kwargs):
+        """
+        参数 `client_id` ~ `info` 与 :class:`Client` 构造函数相同
+
+        :param asyncio.AbstractEventLoop loop: 事件循环。默认是 :func:`asyncio.get_event_loop` 的返回值
+        :param int incoming_maxsize: :meth:`incoming` 数据队列的最大长度。队列满时，新收到的数据被丢弃。默认 `0` ，即无限制
+
+        .. note:: 事件在事件循环中执行，不使用 `event_executor` ，因而它不能是 :class:`KeyedExecutor`
+        """
+        if isinstance(kwargs.get('event_executor'), KeyedExecutor):
+            raise ValueError('AsyncClient runs events in its event loop, KeyedExecutor is not supported')
+        super(AsyncClient, self).__init__(client_id, client_type, master_ip, master_port, slave_ip, slave_port, user,
+                                          password, info, **kwargs)
+        self._loop = loop or asyncio.get_event_loop()
+        self._incoming_maxsize = incoming_maxsize
+        self._incoming = None
+        self._connected = None  # 在事件循环中创建，见 :meth:`_connected_event`
+
+    @property
+    def loop(self):
+        """事件循环"""
+        return self._loop
+
+    @property
+    def connected(self):
+        """是否已连接"""
+        return self._connected is not None and self._connected.is_set()
+
+    def _connected_event(self):
+        # 须在事件循环中调用：早于 Python 3.10 的 asyncio.Event 在构造时绑定当前线程的事件循环
+        if self._connected is None:
+            self._connected = asyncio.Event()
+        return self._connected
+
+    def _dispatch(self, fn, *args):
+        if self._metrics is not None:
+            fn, args = self._run_timed, (perf_counter(), fn, args)
+        try:
+            self._loop.call_soon_threadsafe(self._run_handler, fn, args)
+        except RuntimeError:  # 事件循环已关闭
+            self.logger.warning('event loop closed, drop: %s', fn)
+
+    def _run_handler(self, fn, args):
+        try:
+            result = fn(*args)
+            if inspect.isawaitable(result):
+                self._loop.create_task(result)
+        except Exception:
+            self.logger.exception('%s', fn)
+
+    def _run_pooled(self, handler, head, data):
+        try:
+            result = handler(head, data)
+        except BaseException:
+            self.release_data(data)
+            raise
+        if inspect.isawaitable(result):
+            return self._release_after(result, (data,))
+        self.release_data(data)
+
+    def _on_pooled_data_batch(self, items):
+        try:
+            result = self.on_data_batch(items)
+        except BaseException:
+            self._release_items(items)
+            raise
+        if inspect.isawaitable(result):
+            return self._release_after(result, [data for _, data in items])
+        self._release_items(items)
+
+    def _release_items(self, items):
+        for _, data in items:
+            self.release_data(data)
+
+    async def _release_after(self, awaitable, buffers):
+        """等待协程事件函数执行完毕，然后归还接收缓冲区"""
+        try:
+            return await awaitable
+        finally:
+            for data in buffers:
+                self.release_data(data)
+
+    @staticmethod
+    async def _await_all(awaitables):
+        for awaitable in awaitables:
+            await awaitable
+
+    async def wait_connected(self):
+        """等待，直到连接成功"""
+        await self._connected_event().wait()
+
+    async def launch_flow(self, server_unit_id, process_index, project_id, flow_id, mode, timeout, params):
+        """调用流程，并等待结果
+
+        参数同 :meth:`Client.launch_flow`
+
+        :return: 有流程返回 (`mode` 为 `0`) 时，返回流程返回值列表；否则返回 `None`
+        :rtype: list
+        :raises SmartBusError: 流程启动失败、执行超时或者执行错误
+        """
+        fut = self.launch_flow_async(server_unit_id, process_index, project_id, flow_id, mode, timeout, params)
+        return await asyncio.wrap_future(fut, loop=self._loop)
+
+    async def incoming(self):
+        """接收数据的异步迭代器
+
+        每次迭代产生 `(head, data)` 元组，参数的意义与 :meth:`Client.on_data` 相同。
+
+        只有在第一次调用该方法之后收到的数据，才会进入迭代队列。
+        """
+        if self._incoming is None:
+            self._incoming = asyncio.Queue(self._incoming_maxsize)
+        queue = self._incoming
+        while True:
+            yield await queue.get()
+
+    def on_connect(self):
+        self._connected_event().set()
+
+    def on_disconnect(self):
+        self._connected_event().clear()
+
+    def on_data_batch(self, items):
+        pending = []
+        for head, data in items:
+            result = self.on_data(head, data)
+            if inspect.isawaitable(result):
+                pending.append(result)
+        if pending:
+            return self._await_all(pending)
+
+    def on_data(self, head, data):
+        if self._incoming is not None:
+            if isinstance(data, memoryview):
+                data = data.tobytes()  # 接收缓冲区在该函数返回后即被回收
+            try:
+                self._incoming.put_nowait((head, data))
+            except asyncio.QueueFull:
+                self.logger.warning('incoming queue full, drop: %s', head)
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+"""IPSC 进程之间的负载均衡
+
+:class:`Balancer` 管理一组 `(server_unit_id, process_index)` 目标，为每次调用选择一个目标：
+
+* :data:`STRATEGY_LEAST_OUTSTANDING` ：未完成调用数最少的目标；
+* :data:`STRATEGY_EWMA` ：以调用耗时的指数加权移动平均（EWMA）乘以（未完成调用数 + 1）为代价，选择代价最小的目标。
+  尚无耗时样本、也没有未完成调用的目标优先；尚无样本但有未完成调用的，按其它目标的平均耗时估计。
+
+在构造 :class:`Client` 时，通过 `balancer` 参数使用。此后，调用 :meth:`Client.launch_flow` 、
+:meth:`Client.launch_flow_async` 与 :meth:`Client.notify` 时，如果 `server_unit_id` 与 `process_index` 参数是 `None` ，
+由均衡器选择目标::
+
+    balancer = Balancer([(0, 0), (0, 1), (1, 0)], strategy=STRATEGY_EWMA)
+    client = MyClient(..., balancer=balancer)
+    client.launch_flow_async(None, None, 'ivr', 'route', 0, 5, [caller])
+
+客户端按 `invoke_id` 跟踪发往池中目标的每一次流程调用（无论目标是否由均衡器选择），在启动确认失败、结果返回、超时时更新目标的统计。
+超过超时值（再加上 `expire_grace` ）仍无结果的调用，由客户端的后台清理线程按超时计入统计，不再占用目标的未完成调用数。
+
+均衡器通过全局连接事件（见 :meth:`Client.add_global_connect_listener` ）得知目标的断开与重新连接：
+断开的目标不再被选择，直到它重新连接。目标断开或重新连接时，它的未完成调用与耗时 EWMA 被清零。
+"""
+
+from __future__ import absolute_import
+
+import heapq
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ._c.mutual import SMARTBUS_ERR_DEST_NONEXIST, SMARTBUS_ERR_TIMEOUT, SMARTBUS_NODECLI_TYPE_IPSC
+from .errors import check
+from .invocation import DEFAULT_EXPIRE_GRACE, DEFAULT_MAX_LIFETIME
+from .utils import perf_counter
+
+__all__ = ['Balancer', 'STRATEGY_LEAST_OUTSTANDING', 'STRATEGY_EWMA']
+
+#: 策略：选择未完成调用数最少的目标
+STRATEGY_LEAST_OUTSTANDING = 'least_outstanding'
+
+#: 策略：选择调用耗时 EWMA 乘以（未完成调用数 + 1）最小的目标
+STRATEGY_EWMA = 'ewma'
+
+#: 默认的 EWMA 平滑系数
+DEFAULT_EWMA_ALPHA = 0.3
+
+#: 默认的失败调用的耗时下限（秒）。失败的调用按不短于这个值的耗时计入 EWMA，以免快速失败的目标吸引更多调用
+DEFAULT_ERROR_PENALTY = 1.0
+
+#: 最多跟踪的未完成调用数。超过时，最早的调用不再跟踪
+DEFAULT_MAX_PENDING = 65536
+
+#: 最多暂存多少个“早到”的事件（事件回调比 `RemoteInvokeFlow` 返回 `invoke_id` 更早到达）
+DEFAULT_ORPHAN_CAPACITY = 1024
+
+
+class Target(object):
+    """均衡器中的一个目标
+    """
+
+    __slots__ = ('unit_id', 'process_index', 'up', 'outstanding', 'ewma', 'completed', 'failed')
+
+    def __init__(self, unit_id, process_index):
+        self.unit_id = unit_id
+        self.process_index = process_index
+        #: 是否可用（未断开）
+        self.up = True
+        #: 未完成调用数
+        self.outstanding = 0
+        #: 调用耗时的 EWMA（秒）。尚无样本时是 `None`
+        self.ewma = None
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def address(self):
+        """`(unit_id, process_index)` 元组"""
+        return self.unit_id, self.process_index
+
+
+class Balancer(object):
+    """线程安全的 IPSC 进程负载均衡器
+
+    可以由多个客户端共用：未完成调用数是它们的合计。
+
+    :param targets: `(server_unit_id, process_index)` 目标序列
+    :param str strategy: 选择策略： :data:`STRATEGY_LEAST_OUTSTANDING` 或 :data:`STRATEGY_EWMA`
+    :param float ewma_alpha: EWMA 平滑系数，`0` ~ `1` 。越大，越偏重最近的样本
+    :param float error_penalty: 失败调用的耗时下限（秒）
+    :param bool discover: 是否将全局连接事件中新连接的 IPSC 进程自动加入目标
+    :param float expire_grace: 调用超过超时值后，再等待多少秒仍无结果的，按超时计入统计
+    """
+
+    def __init__(self, targets=(), strategy=STRATEGY_LEAST_OUTSTANDING, ewma_alpha=DEFAULT_EWMA_ALPHA,
+                 error_penalty=DEFAULT_ERROR_PENALTY, discover=False, expire_grace=DEFAULT_EXPIRE_GRACE):
+        if strategy not in (STRATEGY_LEAST_OUTSTANDING, STRATEGY_EWMA):
+            raise ValueError('invalid balance strategy {!r}'.format(strategy))
+        self._strategy = strategy
+        self._alpha = float(ewma_alpha)
+        self._error_penalty = float(error_penalty)
+        self._discover = bool(discover)
+        self._expire_grace = float(expire_grace)
+        self._lock = threading.Lock()
+        self._targets = OrderedDict()
+        self._cursor = 0
+        self._invocations = OrderedDict()
+        self._deadlines = []
+        self._orphans = OrderedDict()
+        self._launching = 0
+        for unit_id, process_index in targets:
+            self.add_target(unit_id, process_index)
+
+    @property
+    def strategy(self):
+        """选择策略"""
+        return self._strategy
+
+    def add_target(self, unit_id, process_index):
+        """加入一个目标。已经存在的，标记为可用
+
+        :param int unit_id: `IPSC` 服务器 `smartbus` 单元ID
+        :param int process_index: `IPSC` 进程ID
+        """
+        with self._lock:
+            target = self._targets.get((unit_id, process_index))
+            if target is None:
+                self._targets[(unit_id, process_index)] = Target(unit_id, process_index)
+            else:
+                target.up = True
+
+    def remove_target(self, unit_id, process_index):
+        """移除一个目标
+
+        :param int unit_id: `IPSC` 服务器 `smartbus` 单元ID
+        :param int process_index: `IPSC` 进程ID
+        """
+        with self._lock:
+            self._targets.pop((unit_id, process_index), None)
+
+    def targets(self):
+        """全部目标的地址
+
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._targets)
+
+    def on_global_connect(self, unit_id, client_id, client_type, access_unit_id, status, info):
+        """全局连接事件监听函数。参数见 :meth:`Client.initialize` 的 `global_connect_callback`
+
+        由 :class:`Client` 在构造时通过 :meth:`Client.add_global_connect_listener` 登记
+        """
+        with self._lock:
+            target = self._targets.get((unit_id, client_id))
+            if target is None:
+                if status and self._discover and client_type == SMARTBUS_NODECLI_TYPE_IPSC:
+                    self._targets[(unit_id, client_id)] = Target(unit_id, client_id)
+                return
+            if target.up != bool(status):
+                self._reset(target)
+            target.up = bool(status)
+
+    def _reset(self, target):
+        # 须在持有锁时调用。断开的进程不会再返回结果；重新连接的进程，以前的耗时样本不再有参考意义
+        for key in [key for key, item in self._invocations.items() if item[0] is target]:
+            del self._invocations[key]
+        target.outstanding = 0
+        target.ewma = None
+
+    def _select(self):
+        # 须在持有锁时调用
+        targets = [target for target in self._targets.values() if target.up]
+        if not targets:
+            raise check(SMARTBUS_ERR_DEST_NONEXIST, False)
+        # 代价相同的目标轮流选择
+        self._cursor = (self._cursor + 1) % len(targets)
+        targets = targets[self._cursor:] + targets[:self._cursor]
+        if self._strategy == STRATEGY_LEAST_OUTSTANDING:
+            return min(targets, key=lambda target: target.outstanding)
+        # 尚无样本的目标：没有未完成调用的，优先选择，以取得样本；否则按已有样本的平均值估计
+        sampled = [target.ewma for target in targets if target.ewma is not None]
+        default = sum(sampled) / len(sampled) if sampled else 0.0
+        return min(targets, key=lambda target: (
+            target.ewma is not None or target.outstanding > 0,
+            (default if target.ewma is None else target.ewma) * (target.outstanding + 1)
+        ))
+
+    def choose(self):
+        """选择一个目标，但不计入未完成调用。用于没有结果返回的调用，如 :meth:`Client.notify`
+
+        :return: `(server_unit_id, process_index)`
+        :rtype: tuple
+        :raises SmartBusError: 没有可用的目标（ :data:`SMARTBUS_ERR_DEST_NONEXIST` ）
+        """
+        with self._lock:
+            return self._select().address
+
+    def acquire(self):
+        """选择一个目标，并计入一个未完成调用
+
+        之后须调用 :meth:`launched` 或者 :meth:`release`
+
+        :return: `(server_unit_id, process_index)`
+        :rtype: tuple
+        :raises SmartBusError: 没有可用的目标（ :data:`SMARTBUS_ERR_DEST_NONEXIST` ）
+        """
+        with self._lock:
+            target = self._select()
+            target.outstanding += 1
+            return target.address
+
+    def release(self, address):
+        """撤销 :meth:`acquire` 计入的未完成调用（调用没有发出）
+
+        :param tuple address: :meth:`acquire` 返回的目标
+        """
+        with self._lock:
+            target = self._targets.get(address)
+            if target is not None and target.outstanding > 0:
+                target.outstanding -= 1
+
+    @contextmanager
+    def launching(self):
+        """在发起调用的 C-API 期间使用的上下文管理器
+
+        在此期间到达的、尚不能匹配的事件，会被暂存，以便随后的 :meth:`launched` 取用。
+        """
+        with self._lock:
+            self._launching += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._launching -= 1
+                if not self._launching:
+                    self._orphans.clear()
+
+    def launched(self, client_id, invoke_id, address, mode, start, acquired=False, timeout=None):
+        """登记一个发往目标的调用。应在 :meth:`launching` 上下文中，在得到 `invoke_id` 之后立即调用
+
+        :param int client_id: 发起调用的客户端的 client id
+        :param int invoke_id: 调用ID
+        :param tuple address: 目标 `(server_unit_id, process_index)` 。不在池中的，忽略
+        :param int mode: 调用模式
+        :param float start: 开始调用的时刻（ :func:`time.perf_counter` ）
+        :param bool acquired: 目标是否由 :meth:`acquire` 选择（已经计入未完成调用）
+        :param float timeout: 调用超时值（秒）。没有的（或者为 `0` ），最多跟踪 :data:`DEFAULT_MAX_LIFETIME` 秒
+        """
+        key = (client_id, invoke_id)
+        deadline = start + (timeout + self._expire_grace if timeout else DEFAULT_MAX_LIFETIME)
+        with self._lock:
+            target = self._targets.get(address)
+            if target is None:
+                return
+            if not acquired:
+                target.outstanding += 1
+            item = self._invocations[key] = (target, mode, start)
+            heapq.heappush(self._deadlines, (deadline, key, item))
+            if len(self._invocations) > DEFAULT_MAX_PENDING:
+                evicted = self._invocations.popitem(last=False)[1][0]
+                if evicted.outstanding > 0:
+                    evicted.outstanding -= 1
+            for kind, code, now in self._orphans.pop(key, ()):
+                self._on_event(key, kind, code, now)
+
+    def _on_event(self, key, kind, code, now):
+        # 须在持有锁时调用
+        item = self._invocations.get(key)
+        if item is None:
+            if self._launching:
+                self._orphans.setdefault(key, []).append((kind, code, now))
+                while len(self._orphans) > DEFAULT_ORPHAN_CAPACITY:
+                    self._orphans.popitem(last=False)
+            return
+        target, mode, start = item
+        if kind == 'ack' and code == 1 and mode == 0:
+            return  # 有流程返回的调用，等待结果
+        del self._invocations[key]
+        if target.outstanding > 0:  # 目标断开或重新连接时已经清零
+            target.outstanding -= 1
+        latency = now - start
+        if code != 1:
+            target.failed += 1
+            latency = max(latency, self._error_penalty)
+        else:
+            target.completed += 1
+        if target.ewma is None:
+            target.ewma = latency
+        else:
+            target.ewma += self._alpha * (latency - target.ewma)
+
+    def acked(self, client_id, invoke_id, ack, now):
+        """流程启动确认。启动失败，或者无流程返回的调用，在此结束
+
+        :param int client_id: 客户端的 client id
+        :param int invoke_id: 调用ID
+        :param int ack: 状态码
+        :param float now: 回调的时刻（ :func:`time.perf_counter` ）
+        """
+        with self._lock:
+            self._on_event((client_id, invoke_id), 'ack', ack, now)
+
+    def returned(self, client_id, invoke_id, status_code, now):
+        """流程结果返回（含超时）
+
+        :param int client_id: 客户端的 client id
+        :param int invoke_id: 调用ID
+        :param int status_code: 返回值
+        :param float now: 回调的时刻（ :func:`time.perf_counter` ）
+        """
+        with self._lock:
+            self._on_event((client_id, invoke_id), 'return', status_code, now)
+
+    def expire(self, now=None):
+        """将超过期限仍无结果的调用按超时（ :data:`SMARTBUS_ERR_TIMEOUT` ）结束
+
+        由 :class:`Client` 的后台清理线程定期调用
+
+        :param float now: 当前时刻（ :func:`time.perf_counter` ）。默认取当前时刻
+        :return: 结束的调用数量
+        :rtype: int
+        """
+        if now is None:
+            now = perf_counter()
+        expired = 0
+        with self._lock:
+            deadlines = self._deadlines
+            while deadlines and deadlines[0][0] < now:
+                _, key, item = heapq.heappop(deadlines)
+                if self._invocations.get(key) is item:
+                    self._on_event(key, 'return', SMARTBUS_ERR_TIMEOUT, now)
+                    expired += 1
+            if len(deadlines) > 2 * len(self._invocations) + 64:
+                # 已结束的调用仍留在堆中，定期清理
+                self._deadlines = [entry for entry in deadlines if self._invocations.get(entry[1]) is entry[2]]
+                heapq.heapify(self._deadlines)
+        return expired
+
+    def stats(self):
+        """各个目标的状态
+
+        :return: 字典列表。每个字典包含 ``unit_id`` 、 ``process_index`` 、 ``up`` 、 ``outstanding`` 、
+            ``ewma_ms`` （尚无样本时是 `None` ）、 ``completed`` 与 ``failed``
+        :rtype: list
+        """
+        with self._lock:
+            return [
+                {
+                    'unit_id': target.unit_id,
+                    'process_index': target.process_index,
+                    'up': target.up,
+                    'outstanding': target.outstanding,
+                    'ewma_ms': None if target.ewma is None else target.ewma * 1000,
+                    'completed': target.completed,
+                    'failed': target.failed,
+                }
+                for target in self._targets.values()
+            ]
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+"""性能基准测试
+
+在 :mod:`yunhuni.cti.busnetcli.sim` 模拟库上测量客户端自身（Python 一侧）的开销，不需要真实的 SmartBus 与 IPSC：
+
+* ``send`` : 不同包体大小下 :meth:`Client.send_data` 的每秒发送次数。模拟库收到数据后直接返回成功；
+* ``receive`` : 从 C 回调函数 `_cb_rcv` 被调用到 :meth:`Client.on_data` 开始执行的延迟分布，以及突发接收的吞吐量。
+  分别测试默认方式、批量分派（ `batch_dispatch` ）与接收缓冲区池（ `buffer_pool` ）；
+* ``flow`` : 从 :meth:`Client.launch_flow` 到 :meth:`Client.on_flow_resp` 的往返时间分布，以及并发调用的吞吐量；
+* ``memory`` : 每个未完成的流程调用（ :meth:`Client.launch_flow_async` ）占用的内存。
+
+运行::
+
+    python -m yunhuni.cti.busnetcli.bench -o result.json
+
+结果以 JSON 格式写出，可用于比较不同版本。时间单位是微秒。
+
+.. attention:: 该模块需要 Python 3.5 以上版本
+
+.. note:: 由于 :meth:`Client.initialize` 是进程全局的，基准测试应在单独的进程中运行
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import json
+import platform
+import struct
+import sys
+import threading
+import tracemalloc
+from ctypes import addressof, create_string_buffer
+from datetime import datetime
+from time import perf_counter
+
+from . import __version__
+from . import sim
+from ._c.mutual import *
+from .buffers import BufferPool
+from .client import Client
+from .sim import FakeLibrary, FlowBehavior, SimBus
+
+__all__ = ['run', 'main', 'percentiles']
+
+#: 默认的发送测试包体大小（字节）
+DEFAULT_SIZES = (0, 64, 256, 1024, 4096, 16384)
+
+#: 各项测试的名称
+BENCHMARKS = ('send', 'receive', 'flow', 'memory')
+
+_SEQ_STRUCT = struct.Struct('<I')
+
+_PROJECT_ID = 'bench'
+_FLOW_ID = 'echo'
+_IDLE_FLOW_ID = 'idle'
+
+
+class _BenchLibrary(FakeLibrary):
+    """发送数据时不经过总线，直接返回成功的模拟库"""
+
+    def _SendData(self, client_id, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data, size):
+        return SMARTBUS_ERR_OK
+
+
+class _BenchClient(Client):
+
+    def __init__(self, *args, **kwargs):
+        super(_BenchClient, self).__init__(*args, **kwargs)
+        self.connected = threading.Event()
+        self.done = threading.Event()
+        self.expected = 0
+        self.starts = None
+        self.latencies = []
+        self.flow_end = None
+
+    def on_connect(self):
+        self.connected.set()
+
+    def on_data(self, head, data):
+        t = perf_counter()
+        seq, = _SEQ_STRUCT.unpack_from(data)
+        self.latencies.append(t - self.starts[seq])
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    def on_data_batch(self, items):
+        t = perf_counter()
+        starts = self.starts
+        latencies = self.latencies
+        unpack_from = _SEQ_STRUCT.unpack_from
+        for _, data in items:
+            latencies.append(t - starts[unpack_from(data)[0]])
+        if len(latencies) >= self.expected:
+            self.done.set()
+
+    def on_flow_resp(self, head, project_id, invoke_id, params):
+        self.flow_end = perf_counter()
+        self.done.set()
+
+
+def percentiles(samples):
+    """计算延迟分布
+
+    :param list samples: 样本（秒）
+    :return: 以微秒为单位的 `mean` 、 `p50` 、 `p90` 、 `p99` 、 `p999` 、 `max`
+    :rtype: dict
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    n = len(ordered)
+
+    def at(q):
+        return round(ordered[min(n - 1, int(q * n))] * 1e6, 3)
+
+    return {
+        'count': n,
+        'mean': round(sum(ordered) / n * 1e6, 3),
+        'p50': at(0.5),
+        'p90': at(0.9),
+        'p99': at(0.99),
+        'p999': at(0.999),
+        'max': round(ordered[-1] * 1e6, 3),
+    }
+
+
+class _Bench(object):
+
+    def __init__(self, count, sizes):
+        self.count = count
+        self.sizes = sizes
+        self.bus = SimBus(unit_id=0)
+        self.bus.set_flow(_PROJECT_ID, _FLOW_ID, FlowBehavior(result=lambda params: params))
+        self.bus.set_flow(_PROJECT_ID, _IDLE_FLOW_ID, FlowBehavior(ack_delay=3600, delay=3600))
+        self.bus.add_ipsc(0, 0)
+        self.bus.start()
+        self.lib = _BenchLibrary(self.bus)
+        Client.initialize(16, lib=self.lib)
+        self._client_ids = iter(range(1, 256))
+
+    def close(self):
+        self.bus.stop()
+
+    def client(self, **kwargs):
+        client = _BenchClient(next(self._client_ids), 11, '127.0.0.1', 8000, **kwargs)
+        client.activate()
+        if not client.connected.wait(5):
+            raise RuntimeError('client {} failed to connect'.format(client.client_id))
+        return client
+
+    def send(self):
+        client = self.client()
+        results = []
+        for size in self.sizes:
+            data = b'\x00' * size
+            n = self.count
+            send_data = client.send_data
+            for _ in range(min(n, 1000)):  # 预热
+                send_data(1, SMARTBUS_CMDTYPE_USER, 0, 0, SMARTBUS_NODECLI_TYPE_NODE, data)
+            t0 = perf_counter()
+            for _ in range(n):
+                send_data(1, SMARTBUS_CMDTYPE_USER, 0, 0, SMARTBUS_NODECLI_TYPE_NODE, data)
+            seconds = perf_counter() - t0
+            results.append({
+                'size': size,
+                'count': n,
+                'seconds': round(seconds, 6),
+                'msgs_per_sec': round(n / seconds, 1),
+                'mb_per_sec': round(n * size / seconds / 1e6, 3),
+            })
+        return results
+
+    def _receive(self, client, burst):
+        callback = Client._c_cbs['recvdata']
+        n = self.count
+        head = sim._c_head((1, SMARTBUS_CMDTYPE_USER, SMARTBUS_NODECLI_TYPE_NODE, 0, 0,
+                            SMARTBUS_NODECLI_TYPE_NODE, 16, client.client_id, 0, _SEQ_STRUCT.size))
+        buffers = [create_string_buffer(_SEQ_STRUCT.pack(i), _SEQ_STRUCT.size) for i in range(n)]
+        addresses = [addressof(buffer) for buffer in buffers]
+        starts = client.starts = [0.0] * n
+        client.latencies = []
+        client.expected = n
+        client.done.clear()
+        client_id = client.client_id
+        size = _SEQ_STRUCT.size
+        t0 = perf_counter()
+        if burst:
+            for i in range(n):
+                starts[i] = perf_counter()
+                callback(None, client_id, head, addresses[i], size)
+            if not client.done.wait(60):
+                raise RuntimeError('receive timeout')
+        else:
+            for i in range(n):
+                client.expected = i + 1
+                client.done.clear()
+                starts[i] = perf_counter()
+                callback(None, client_id, head, addresses[i], size)
+                if not client.done.wait(5):
+                    raise RuntimeError('receive timeout')
+        seconds = perf_counter() - t0
+        return {
+            'seconds': round(seconds, 6),
+            'msgs_per_sec': round(n / seconds, 1),
+            'latency_us': percentiles(client.latencies),
+        }
+
+    def receive(self):
+        results = {}
+        for name, kwargs in (
+                ('default', {}),
+                ('batch', {'batch_dispatch': True}),
+                ('pooled', {'buffer_pool': BufferPool()}),
+        ):
+            client = self.client(**kwargs)
+            results[name] = {
+                'idle': self._receive(client, False),
+                'burst': self._receive(client, True),
+            }
+        return results
+
+    def flow(self):
+        client = self.client()
+        n = self.count
+        rtts = []
+        for _ in range(n):
+            client.done.clear()
+            t0 = perf_counter()
+            client.launch_flow(0, 0, _PROJECT_ID, _FLOW_ID, 0, 5, [1])
+            if not client.done.wait(5):
+                raise RuntimeError('flow timeout')
+            rtts.append(client.flow_end - t0)
+        t0 = perf_counter()
+        futures = [client.launch_flow_async(0, 0, _PROJECT_ID, _FLOW_ID, 0, 60, [i]) for i in range(n)]
+        for future in futures:
+            future.result(60)
+        seconds = perf_counter() - t0
+        return {
+            'rtt_us': percentiles(rtts),
+            'concurrent': {
+                'count': n,
+                'seconds': round(seconds, 6),
+                'flows_per_sec': round(n / seconds, 1),
+            },
+        }
+
+    def memory(self):
+        client = self.client()
+        n = self.count
+        client.launch_flow_async(0, 0, _PROJECT_ID, _IDLE_FLOW_ID, 0, 3600, [])  # 预热
+        # 总线（模拟的 IPSC）一侧的内存不计入
+        filters = [tracemalloc.Filter(False, sim.__file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot().filter_traces(filters)
+            futures = [client.launch_flow_async(0, 0, _PROJECT_ID, _IDLE_FLOW_ID, 0, 3600, [])
+                       for _ in range(n)]
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+        finally:
+            tracemalloc.stop()
+        total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        in_flight = len(client._invocations)
+        del futures
+        return {
+            'in_flight': in_flight,
+            'bytes_total': total,
+            'bytes_per_invocation': round(total / float(n), 1),
+        }
+
+
+def run(benchmarks=BENCHMARKS, count=10000, sizes=DEFAULT_SIZES):
+    """运行基准测试
+
+    :param benchmarks: 要运行的测试名称，见 :data:`BENCHMARKS`
+    :param int count: 每项测试的次数
+    :param sizes: 发送测试的包体大小（字节）
+    :return: 测试结果
+    :rtype: dict
+    """
+    bench = _Bench(count, sizes)
+    try:
+        results = {}
+        for name in BENCHMARKS:
+            if name in benchmarks:
+                results[name] = getattr(bench, name)()
+    finally:
+        bench.close()
+    return {
+        'meta': {
+            'version': __version__,
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'time': datetime.now().isoformat(),
+            'count': count,
+        },
+        'results': results,
+    }
+
+
+def _print_summary(report, out):
+    results = report['results']
+    for item in results.get('send', ()):
+        out.write('send     size={size:<6} {msgs_per_sec:>12.1f} msg/s {mb_per_sec:>10.3f} MB/s\n'.format(**item))
+    for name, item in sorted(results.get('receive', {}).items()):
+        for mode in ('idle', 'burst'):
+            latency = item[mode]['latency_us']
+            out.write('receive  {:<8} {:<5} {:>12.1f} msg/s  p50={}us p99={}us max={}us\n'.format(
+                name, mode, item[mode]['msgs_per_sec'], latency['p50'], latency['p99'], latency['max']))
+    if 'flow' in results:
+        rtt = results['flow']['rtt_us']
+        out.write('flow     rtt p50={}us p99={}us max={}us; concurrent {} flow/s\n'.format(
+            rtt['p50'], rtt['p99'], rtt['max'], results['flow']['concurrent']['flows_per_sec']))
+    if 'memory' in results:
+        out.write('memory   {bytes_per_invocation} bytes per in-flight invocation\n'.format(**results['memory']))
+
+
+def main(args=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(prog='python -m yunhuni.cti.busnetcli.bench', description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='write JSON results to this file ("-" for stdout)')
+    parser.add_argument('-n', '--count', type=int, default=10000, help='iterations per benchmark (default: %(default)s)')
+    parser.add_argument('-s', '--sizes', type=lambda s: tuple(int(x) for x in s.split(',')), default=DEFAULT_SIZES,
+                        help='comma separated payload sizes of the send benchmark')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='benchmarks to run: {} (default: all)'.format(', '.join(BENCHMARKS)))
+    ns = parser.parse_args(args)
+    unknown = set(ns.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmark(s): {}'.format(', '.join(sorted(unknown))))
+    report = run(ns.benchmarks or BENCHMARKS, ns.count, ns.sizes)
+    if ns.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        _print_summary(report, sys.stdout)
+        if ns.output:
+            with open(ns.output, 'w') as fp:
+                json.dump(report, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
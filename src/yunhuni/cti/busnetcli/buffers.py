@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""接收缓冲区池
+
+按大小分级的 :class:`bytearray` 缓冲区池。
+接收到的数据包体只被复制一次，复制到池中的缓冲区里，以 :class:`memoryview` 的形式交给事件函数。
+"""
+
+from __future__ import absolute_import
+
+from ctypes import c_char, addressof, memmove
+
+__all__ = ['BufferPool']
+
+#: 默认的最小缓冲区大小（字节）
+DEFAULT_MIN_SIZE = 256
+
+#: 默认的最大缓冲区大小（字节）。超过这个大小的数据不使用缓冲池。
+DEFAULT_MAX_SIZE = 1 << 20
+
+#: 默认的每个大小级别最多保留的空闲缓冲区数量
+DEFAULT_MAX_FREE = 64
+
+
+class _Slot(object):
+    __slots__ = ('buffer', 'c_array', 'address', 'free_list')
+
+    def __init__(self, size, free_list):
+        self.buffer = bytearray(size)
+        # 保留 ctypes 数组对象：它持有对 bytearray 的导出，bytearray 因而不能改变大小，地址保持不变
+        self.c_array = (c_char * size).from_buffer(self.buffer)
+        self.address = addressof(self.c_array)
+        self.free_list = free_list
+
+
+class BufferPool(object):
+    """按大小分级的缓冲区池
+
+    缓冲区大小是从 `min_size` 到 `max_size` 之间的 2 的整数次幂。
+
+    :param int min_size: 最小缓冲区大小（字节）
+    :param int max_size: 最大缓冲区大小（字节）
+    :param int max_free: 每个大小级别最多保留的空闲缓冲区数量
+
+    .. warning::
+        :meth:`release` 之后，缓冲区会被重新使用。
+        不得在释放之后继续使用该 :class:`memoryview` 以及从它派生的任何对象；需要保留数据的，应复制一份，如 ``bytes(data)``
+    """
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, max_size=DEFAULT_MAX_SIZE, max_free=DEFAULT_MAX_FREE):
+        self._min_bits = max(int(min_size) - 1, 1).bit_length()
+        self._max_bits = max(int(max_size) - 1, 1).bit_length()
+        self._max_free = int(max_free)
+        self._free_lists = [[] for _ in range(self._max_bits + 1)]
+        self._slots = {}
+        # 借出的 memoryview 的 id -> (memoryview, _Slot)。保存 memoryview 本身，使其 id 在归还之前不会被复用
+        self._lent = {}
+
+    @property
+    def min_size(self):
+        """最小缓冲区大小"""
+        return 1 << self._min_bits
+
+    @property
+    def max_size(self):
+        """最大缓冲区大小"""
+        return 1 << self._max_bits
+
+    def copy_from(self, address, size):
+        """从 C 内存地址复制数据到一个池中的缓冲区
+
+        :param int address: 数据的内存地址
+        :param int size: 数据长度
+        :return: 数据的 :class:`memoryview` ，用完后应调用 :meth:`release`
+        :rtype: memoryview
+        """
+        bits = max(self._min_bits, (size - 1).bit_length())
+        if bits > self._max_bits:
+            buffer = bytearray(size)
+            memmove(addressof(c_char.from_buffer(buffer)), address, size)
+            return memoryview(buffer)
+        free_list = self._free_lists[bits]
+        try:
+            slot = free_list.pop()
+        except IndexError:
+            slot = _Slot(1 << bits, free_list)
+            self._slots[id(slot.buffer)] = slot
+        memmove(slot.address, address, size)
+        return self._lend(slot, size)
+
+    def copy(self, data):
+        """复制缓冲区对象中的数据到一个池中的缓冲区
+
+        :param data: :class:`bytes` 、 :class:`memoryview` 等支持缓冲区协议的对象
+        :return: 数据的 :class:`memoryview` ，用完后应调用 :meth:`release`
+        :rtype: memoryview
+        """
+        size = len(data)
+        bits = max(self._min_bits, (size - 1).bit_length())
+        if bits > self._max_bits:
+            return memoryview(bytearray(data))
+        free_list = self._free_lists[bits]
+        try:
+            slot = free_list.pop()
+        except IndexError:
+            slot = _Slot(1 << bits, free_list)
+            self._slots[id(slot.buffer)] = slot
+        slot.buffer[:size] = data
+        return self._lend(slot, size)
+
+    def _lend(self, slot, size):
+        view = memoryview(slot.buffer)[:size]
+        self._lent[id(view)] = view, slot
+        return view
+
+    def release(self, view):
+        """将 :meth:`copy_from` 返回的 :class:`memoryview` 所使用的缓冲区归还给池
+
+        重复释放是无害的。
+
+        :param memoryview view: :meth:`copy_from` 的返回值
+        """
+        # 按返回的 memoryview 对象查找缓冲区：Python 2 的 memoryview 没有 ``obj`` 属性和 ``release()`` 方法
+        slot = self._lent.pop(id(view), (None, None))[1]
+        if slot is None:  # 已经释放过，或者不是池中的缓冲区
+            return
+        try:
+            release = view.release
+        except AttributeError:  # Python 2
+            pass
+        else:
+            try:
+                release()
+            except BufferError:  # 仍有对象在使用这块内存，放弃回收
+                self._slots.pop(id(slot.buffer), None)
+                return
+        if len(slot.free_list) < self._max_free:
+            slot.free_list.append(slot)
+        else:
+            self._slots.pop(id(slot.buffer), None)
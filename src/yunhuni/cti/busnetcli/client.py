@@ -6,19 +6,71 @@
 
 from __future__ import absolute_import
 
-from ctypes import CDLL, byref, create_string_buffer, string_at, c_void_p, c_char_p, c_int, c_byte, c_size_t
+import threading
+from array import array
+from ctypes import CDLL, addressof, string_at, c_void_p, c_char, c_char_p, c_int, c_byte, c_size_t
 from ctypes.util import find_library
-from concurrent.futures import ThreadPoolExecutor
-import json
+from concurrent.futures import ThreadPoolExecutor, Future
+from itertools import count
+from logging import DEBUG
+from numbers import Integral
+from time import sleep
 
 from ._c.netapi import *
-from .errors import check
+from .errors import SmartBusError, OutboundQueueFullError, RateLimitedError, check, error_code_message
+from .dispatch import BatchDispatcher, KeyedBatchDispatcher, KeyedExecutor, DEFAULT_MAX_BATCH_SIZE
 from .head import *
+from .jsoncodec import default_codec, MAX_FLOW_PARAMS_SIZE
+from .messages import StructMessage
+from .invocation import InvocationTable, DEFAULT_MAX_PENDING, _settle, next_synthetic_invoke_id
+from .metrics import Metrics
+from .prepared import PreparedFlow
+from .ratelimit import OP_SEND_DATA, OP_NOTIFY, OP_LAUNCH_FLOW, POLICY_QUEUE
+from .routing import Router, ANY
+from .topology import Topology
+from .tracing import EVENT_ACK, EVENT_RETURN
 from .utils import *
+from .utils import perf_counter
 
 __all__ = ['Client']
 
 
+def _buffer_arg(data):
+    """将待发送数据转换为 C 函数的 `void*` 参数，尽量不复制
+
+    :param data: :class:`bytes` , :class:`bytearray` , :class:`memoryview` 或其它支持缓冲区协议的对象
+    :return: `(arg, length)`
+    """
+    if not data:
+        return None, 0
+    if isinstance(data, bytes):
+        return data, len(data)
+    view = memoryview(data)
+    length = view.nbytes
+    if view.readonly or not view.c_contiguous:
+        return view.tobytes(), length
+    return (c_char * length).from_buffer(view), length
+
+
+def _executor_depth(executor):
+    """事件执行器中等待执行的任务数。无法获得时返回 `None`"""
+    qsize = getattr(executor, 'qsize', None)
+    if qsize is not None:
+        return qsize()
+    work_queue = getattr(executor, '_work_queue', None)
+    return None if work_queue is None else work_queue.qsize()
+
+
+def _source_key(item):
+    """接收数据 `(head, data)` 的来源键。
+
+    由 `src_unit_id` 与 `src_unit_client_id` 合成的整数。
+    乘以 257 而不是 256 ，使得对 2 的整数次幂的通道数取模时，单元ID与客户端ID都起作用。
+    """
+    head = item[0]
+    return head[3] * 257 + head[4]
+
+
 class Client(LoggerMixin):
     """NET 客户端
 
@@ -32,9 +84,32 @@ class Client(LoggerMixin):
     _instances = {}
     _c_cbs = {}
     _global_connect_callback = None
+    _global_connect_listeners = []
+    _topology = Topology()
+    _project_id_cache = DecodeCache('cp936')
+    _packet_log_counter = count()
+
+    #: 数据包调试日志中，数据内容的记录方式：
+    #:
+    #: * ``'full'`` : 记录完整的数据
+    #: * ``'preview'`` : 只记录开头 :attr:`packet_log_preview_size` 字节的十六进制预览
+    #: * ``'size'`` : 只记录数据长度
+    packet_log_mode = 'preview'
+
+    #: ``'preview'`` 模式下，数据预览的最大字节数
+    packet_log_preview_size = 32
+
+    #: 数据包调试日志的采样间隔：每 `N` 个数据包（含发送、接收、流程调用与通知）记录一次。 `1` 表示全部记录
+    packet_log_sample_rate = 1
+
+    #: 清理过期的流程调用记录的间隔（秒）。见 :meth:`launch_flow_async`
+    sweep_interval = 1.0
 
     def __init__(self, client_id, client_type, master_ip, master_port, slave_ip=None, slave_port=None, user=None,
-                 password=None, info=None, event_executor=None):
+                 password=None, info=None, event_executor=None, max_pending_invocations=DEFAULT_MAX_PENDING,
+                 batch_dispatch=False, max_batch_size=DEFAULT_MAX_BATCH_SIZE, buffer_pool=None, outbound_queue=None,
+                 fanout=None, metrics=False, flow_tracer=None, flow_cache=None, flow_coalescer=None,
+                 rate_limiter=None, balancer=None, json_codec=None, message_registry=None):
         """
         :param int client_id: 本地 client id, >= 0 and <= 255
         :param int client_type: 本地 client type
@@ -45,17 +120,41 @@ class Client(LoggerMixin):
         :param str user: 用户名
         :param int password: 密码
         :param str info: 附加信息
-        :param ThreadPoolExecutor event_executor: 事件执行器。在此执行器中回调事件执行函数。默认执行器的线程池数量是 `1`
+        :param ThreadPoolExecutor event_executor: 事件执行器。在此执行器中回调事件执行函数。默认执行器的线程池数量是 `1` 。
+            可以是 :class:`KeyedExecutor` ：同一来源的数据、同一流程调用的事件按顺序执行，不同来源之间并行执行
+        :param int max_pending_invocations: :meth:`launch_flow_async` 最大未完成调用数
+        :param bool batch_dispatch: 是否批量分派接收到的数据。
+            为真时，接收到的数据先进入队列，再分批交给 :meth:`on_data_batch` ，而不是每个数据包都向事件执行器提交一次任务
+        :param int max_batch_size: 批量分派时，每批次最大数据包数
+        :param BufferPool buffer_pool: 接收缓冲区池。
+            指定时，接收到的数据包体被复制到池中的缓冲区，以 :class:`memoryview` 的形式交给 :meth:`on_data` ，
+            并在 :meth:`on_data` （或 :meth:`on_data_batch` ）返回后归还给池。见 :meth:`release_data`
+        :param OutboundQueue outbound_queue: 发送队列。
+            指定时， :meth:`send_data` 遇到 :data:`SMARTBUS_ERR_BUFF_FULL` 不再抛出异常，而是将数据放入队列，在后台重试发送。
+            队列中的数据发送失败时，触发 :meth:`on_send_fail`
+        :param FanOut fanout: 多进程接收数据分发器。
+            指定时，接收到的数据被复制到共享内存，交给工作进程处理，不再触发 :meth:`on_data` 。工作进程在构造时启动
+        :param bool metrics: 是否记录运行指标，见 :meth:`stats` 与 :mod:`yunhuni.cti.busnetcli.metrics`
+        :param FlowTracer flow_tracer: 流程调用追踪器。指定时，记录每次流程调用各个环节的时刻，
+            见 :mod:`yunhuni.cti.busnetcli.tracing`
+        :param FlowCache flow_cache: 流程调用结果缓存。指定时，已登记流程的相同调用在有效期内直接返回缓存的结果，
+            见 :mod:`yunhuni.cti.busnetcli.flowcache`
+        :param FlowCoalescer flow_coalescer: 相同流程调用合并器。指定时，已登记流程的相同调用合并到进行中的调用，
+            见 :mod:`yunhuni.cti.busnetcli.coalesce`
+        :param RateLimiter rate_limiter: 速率限制器。指定时， :meth:`send_data` 、 :meth:`notify` 与流程调用在调用 C-API 之前取得令牌，
+            见 :mod:`yunhuni.cti.busnetcli.ratelimit`
+        :param Balancer balancer: 负载均衡器。指定时，流程调用与通知的 `server_unit_id` 与 `process_index` 参数可以是 `None` ，
+            由均衡器选择目标，见 :mod:`yunhuni.cti.busnetcli.balance`
+        :param JsonCodec json_codec: 流程参数与返回值的 JSON 编解码器。默认为 :data:`default_codec` ，
+            见 :mod:`yunhuni.cti.busnetcli.jsoncodec`
+        :param MessageRegistry message_registry: 消息类型登记表。指定时，接收到的、登记了类型的数据包被解码为消息对象，
+            再交给 :meth:`on_data` 等事件函数，见 :mod:`yunhuni.cti.busnetcli.messages`
         """
-        if not self._lib:
-            raise RuntimeError('Library not been loaded')
         client_id = int(client_id)
         if not (0 <= client_id <= 255):
             raise ValueError('argument "local_client_id" must between 0 and 255')
-        if client_id in self._instances:
-            raise KeyError('Duplicated local client id "{}"'.format(client_id))
+        self._register(client_id)
         self._client_id = client_id
-        self._instances[self._client_id] = self
         self._unit_id = self.__class__._unit_id
         self._client_type = client_type
         self._master_ip = str(master_ip)
@@ -68,15 +167,59 @@ class Client(LoggerMixin):
         if not event_executor:
             event_executor = ThreadPoolExecutor(max_workers=1)
         self._event_executor = event_executor
+        self._metrics = Metrics() if metrics else None
+        self._flow_tracer = flow_tracer
+        self._flow_cache = flow_cache
+        self._flow_coalescer = flow_coalescer
+        self._rate_limiter = rate_limiter
+        self._balancer = balancer
+        self._json_codec = default_codec if json_codec is None else json_codec
+        self._router = None
+        self._message_registry = message_registry
+        if balancer is not None:
+            self.add_global_connect_listener(balancer.on_global_connect)
+        self._keyed_executor = event_executor if isinstance(event_executor, KeyedExecutor) else None
+        self._invocations = InvocationTable(max_pending_invocations)
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+        self._sweeper_stopped = threading.Event()
+        self._buffer_pool = buffer_pool
+        if not batch_dispatch:
+            self._data_batcher = None
+        else:
+            handler = self.on_data_batch if buffer_pool is None else self._on_pooled_data_batch
+            if self._keyed_executor is None:
+                self._data_batcher = BatchDispatcher(self._dispatch, handler, max_batch_size)
+            else:
+                self._data_batcher = KeyedBatchDispatcher(self._keyed_executor, handler, _source_key, max_batch_size)
+        self._outbound_queue = outbound_queue
+        if outbound_queue is not None:
+            outbound_queue.bind(self._send_queued, self._on_outbound_fail)
+        self._fanout = fanout
+        if fanout is not None:
+            fanout.bind(self.send_data)
+
+    def _register(self, client_id):
+        """在全局实例表中登记本实例
+
+        C 库的回调函数按照 `client_id` 在全局实例表中查找实例
+        """
+        if not self._lib:
+            raise RuntimeError('Library not been loaded')
+        if client_id in self._instances:
+            raise KeyError('Duplicated local client id "{}"'.format(client_id))
+        self._instances[client_id] = self
 
     @classmethod
-    def initialize(cls, unit_id, global_connect_callback=None, lib_path=''):
+    def initialize(cls, unit_id, global_connect_callback=None, lib_path='', lib=None):
         """初始化
 
         :param int unit_id: 在连接到 `Smartbus` 后，本节点的单元ID。
         :param callable global_connect_callback: 全局连接事件回调函数
         :param str lib_path: SO/DLL 文件路径名。
             默认值是 `None` : 将按照 :data:`DLL_NAME` 查找库文件，需确保库文件在 Python 运行时的搜索路径中。
+        :param lib: 已加载的库对象。指定时，忽略 `lib_path` 。
+            可以是 :class:`ctypes.CDLL` 对象，也可以是 :class:`yunhuni.cti.busnetcli.sim.FakeLibrary` 等模拟对象
 
         .. warning:: `unit_id >= 16` ，且全局唯一，不得重复
 
@@ -99,13 +242,16 @@ class Client(LoggerMixin):
         logger.info('initialize: >>> lib_path=%s', lib_path)
         if cls._lib:
             raise RuntimeError('Library already loaded')
-        if not lib_path:
-            logger.debug('initialize: find_library "%s"', DLL_NAME)
-            lib_path = find_library(DLL_NAME)
+        if lib is not None:
+            cls._lib = lib
+        else:
             if not lib_path:
-                raise RuntimeError('Failed to find library {}'.format(DLL_NAME))
-        logger.debug('initialize: CDLL %s', lib_path)
-        cls._lib = CDLL(lib_path)
+                logger.debug('initialize: find_library "%s"', DLL_NAME)
+                lib_path = find_library(DLL_NAME)
+                if not lib_path:
+                    raise RuntimeError('Failed to find library {}'.format(DLL_NAME))
+            logger.debug('initialize: CDLL %s', lib_path)
+            cls._lib = CDLL(lib_path)
         if not cls._lib:
             raise RuntimeError('Failed to load library {}'.format(lib_path))
         logger.debug('initialize: %s', cls._lib)
@@ -123,7 +269,7 @@ class Client(LoggerMixin):
         cls._c_cbs['connection'] = fntyp_connection_cb(cls._cb_cnx)
         cls._c_cbs['recvdata'] = fntyp_recvdata_cb(cls._cb_rcv)
         cls._c_cbs['disconnect'] = fntyp_disconnect_cb(cls._cb_dnx)
-        cls._c_cbs['invokeflow_ret'] = fntyp_invokeflow_ret_cb(cls._cb_dnx)
+        cls._c_cbs['invokeflow_ret'] = fntyp_invokeflow_ret_cb(cls._cb_flow_ret)
         cls._c_cbs['global_connect'] = fntyp_global_connect_cb(cls._cb_g_cnx)
         SetCallBackFn.c_func(
             cls._c_cbs['connection'],
@@ -142,6 +288,29 @@ class Client(LoggerMixin):
         # Load and init OK!!!
         logger.info('initialize: <<<')
 
+    @classmethod
+    def finalize(cls):
+        """释放
+
+        所有实例未完成的 :meth:`launch_flow_async` 调用以 :data:`SMARTBUS_ERR_NON_INIT` 错误结束，
+        然后释放共享库，并清空 :meth:`topology` 。之后可以再次调用 :meth:`initialize` ，并重新建立实例。
+        """
+        logger = cls.get_logger()
+        logger.info('finalize: >>>')
+        if not cls._lib:
+            raise RuntimeError('Library not been loaded')
+        exception = check(SMARTBUS_ERR_NON_INIT, False)
+        for inst in list(cls._instances.values()):
+            inst._shutdown(exception)
+        logger.debug('finalize: Release')
+        Release.c_func()
+        cls._instances.clear()
+        cls._c_cbs.clear()
+        cls._global_connect_callback = None
+        cls._lib = None
+        cls._topology.clear()
+        logger.info('finalize: <<<')
+
     @classmethod
     def _cb_cnx(cls, arg, local_client_id, access_point_unit_id, ack):
         """客户端连接成功回调函数类型
@@ -151,18 +320,16 @@ class Client(LoggerMixin):
         :param c_int access_point_unit_id: int 连接点的 UnitID
         :param c_int ack: int 连接注册结果： 0 建立连接成功、< 0 连接失败
         """
-        cls.get_logger().debug(
-            'connect: '
-            'arg=%s, local_client_id=%s, access_point_unit_id=%s, ack=%s',
-            arg, local_client_id, access_point_unit_id, ack
-        )
+        logger = cls.get_logger()
+        if logger.isEnabledFor(DEBUG):
+            logger.debug(
+                'connect: '
+                'arg=%s, local_client_id=%s, access_point_unit_id=%s, ack=%s',
+                arg, local_client_id, access_point_unit_id, ack
+            )
         inst = cls.find(local_client_id)
         if inst:
-            if ack == 0:  # 建立连接成功
-                inst._unit_id = access_point_unit_id
-                inst._event_executor.submit(inst.on_connect)
-            else:  # 连接失败
-                inst._event_executor.submit(inst.on_connect_fail, ack)
+            inst._deliver_connect(access_point_unit_id, ack)
 
     @classmethod
     def _cb_rcv(cls, param, local_client_id, head, data, size):
@@ -174,14 +341,23 @@ class Client(LoggerMixin):
         :param c_void_p data: 数据包体
         :param c_size_t size: 包体字节长度
         """
-        cls.get_logger().debug(
-            'receive-data: '
-            'param=%s, local_client_id=%s, head=%s, data=%s, size=%s',
-            param, local_client_id, head, data, size
-        )
+        logger = cls._packet_logger()
+        if logger:
+            logger.debug(
+                'receive-data: '
+                'param=%s, local_client_id=%s, head=%s, size=%s, data=%s',
+                param, local_client_id, Head(head), size, cls._format_payload(data, size)
+            )
         inst = cls.find(local_client_id)
         if inst:
-            inst._event_executor.submit(inst.on_data, Head(head), string_at(data, size) if data else None)
+            if inst._fanout is not None:
+                if inst._metrics is not None:
+                    inst._metrics.received(head.contents.cmd, head.contents.cmdtype, size)
+                inst._fanout.put_from(addressof(head.contents), data, size if data else 0)
+            elif inst._buffer_pool is None:
+                inst._deliver_data(Head(head), string_at(data, size) if data else None)
+            else:
+                inst._deliver_data(Head(head), inst._buffer_pool.copy_from(data, size) if data else None)
 
     @classmethod
     def _cb_dnx(cls, param, local_client_id):
@@ -190,14 +366,16 @@ class Client(LoggerMixin):
         :param c_void_p param: 自定义数据
         :param c_byte local_client_id: 连接断开的本地 ClientId
         """
-        cls.get_logger().debug(
-            'disconnect: '
-            'param=%s, local_client_id=%s',
-            param, local_client_id
-        )
+        logger = cls.get_logger()
+        if logger.isEnabledFor(DEBUG):
+            logger.debug(
+                'disconnect: '
+                'param=%s, local_client_id=%s',
+                param, local_client_id
+            )
         inst = cls.find(local_client_id)
         if inst:
-            inst._event_executor.submit(inst.on_disconnect)
+            inst._deliver_disconnect()
 
     @classmethod
     def _cb_flow_ack(cls, arg, local_client_id, head, project_id, invoke_id, ack, msg):
@@ -213,18 +391,19 @@ class Client(LoggerMixin):
 
         在调用流程之后，通过该回调函数类型获知流程调用是否成功
         """
-        cls.get_logger().debug(
-            'flow-ack: '
-            'arg=%s, local_client_id=%s, head=%s, project_id=%s, invoke_id=%s, ack=%s, msg=%s',
-            arg, local_client_id, head, project_id, invoke_id, ack, msg
-        )
+        logger = cls._packet_logger()
+        if logger:
+            logger.debug(
+                'flow-ack: '
+                'arg=%s, local_client_id=%s, head=%s, project_id=%s, invoke_id=%s, ack=%s, msg=%s',
+                arg, local_client_id, head, project_id, invoke_id, ack, msg
+            )
         _head = Head(head)
         inst = cls.find(local_client_id)
         if inst:
-            inst._event_executor.submit(
-                inst.on_flow_ack,
+            inst._deliver_flow_ack(
                 _head,
-                b2s_recode(string_at(project_id).strip(b'\x00'), 'cp936', 'utf-8').strip(),
+                cls._project_id_cache(project_id),
                 invoke_id,
                 ack,
                 b2s_recode(string_at(msg).strip(b'\x00'), 'cp936', 'utf-8').strip() if msg else ''
@@ -244,28 +423,22 @@ class Client(LoggerMixin):
 
         通过类类型的回调函数，获取被调用流程的“子项目结束”节点的返回值列表
         """
-        cls.get_logger().debug(
-            'flow-ret: '
-            'arg=%s, local_client_id=%s, head=%s, project_id=%s, invoke_id=%s, ret=%s, param=%s',
-            arg, local_client_id, head, project_id, invoke_id, ret, param
-        )
+        logger = cls._packet_logger()
+        if logger:
+            logger.debug(
+                'flow-ret: '
+                'arg=%s, local_client_id=%s, head=%s, project_id=%s, invoke_id=%s, ret=%s, param=%s',
+                arg, local_client_id, head, project_id, invoke_id, ret,
+                cls._format_payload(param, len(param)) if param else param
+            )
         _head = Head(head)
         inst = cls.find(local_client_id)
         if inst:
-            _project_id = to_str(string_at(project_id).strip(b'\x00')).strip()
-            _invoke_id = invoke_id
-            _status_code = ret
-            if _status_code == 1:
-                py_params = []
-                if param:
-                    _params = b2s_recode(string_at(param).strip(b'\x00'), 'cp936', 'utf-8').strip()
-                    if _params:
-                        py_params = json.loads(_params)
-                inst._event_executor.submit(inst.on_flow_resp, _head, _project_id, _invoke_id, py_params)
-            elif _status_code == SMARTBUS_ERR_TIMEOUT:
-                inst._event_executor.submit(inst.on_flow_timeout, _head, _project_id, _invoke_id)
-            else:
-                inst._event_executor.submit(inst.on_flow_error, _head, _project_id, _invoke_id, _status_code)
+            _project_id = cls._project_id_cache(project_id)
+            py_params = None
+            if ret == 1:
+                py_params = inst._json_codec.decode(string_at(param)) if param else []
+            inst._deliver_flow_ret(_head, _project_id, invoke_id, ret, py_params)
 
     @classmethod
     def _cb_g_cnx(cls, arg, unit_id, client_id, client_type, access_unit, status, add_info):
@@ -281,20 +454,72 @@ class Client(LoggerMixin):
 
         当smartbus上某个节点发生连接或者断开时，该类型回调函数被调用。
         """
-        cls.get_logger().debug(
-            'global-connection: '
-            'arg=%s, unit_id=%s, client_id=%s, client_type=%s, access_unit=%s, status=%s, add_info=%s',
-            arg, unit_id, client_id, client_type, access_unit, status, add_info
-        )
-        if callable(cls._global_connect_callback):
-            cls._global_connect_callback(
-                ord(unit_id),
-                ord(client_id),
-                ord(client_type),
-                ord(access_unit),
-                ord(status),
-                to_str(string_at(add_info)) if add_info else ''
+        logger = cls.get_logger()
+        if logger.isEnabledFor(DEBUG):
+            logger.debug(
+                'global-connection: '
+                'arg=%s, unit_id=%s, client_id=%s, client_type=%s, access_unit=%s, status=%s, add_info=%s',
+                arg, unit_id, client_id, client_type, access_unit, status, add_info
             )
+        cls._deliver_global_connect(
+            cls._global_connect_callback,
+            ord(unit_id),
+            ord(client_id),
+            ord(client_type),
+            ord(access_unit),
+            ord(status),
+            to_str(string_at(add_info)) if add_info else ''
+        )
+
+    @classmethod
+    def _deliver_global_connect(cls, callback, unit_id, client_id, client_type, access_unit_id, status, info):
+        cls._apply_global_connect(cls, callback, unit_id, client_id, client_type, access_unit_id, status, info)
+
+    @staticmethod
+    def _apply_global_connect(owner, callback, unit_id, client_id, client_type, access_unit_id, status, info):
+        """以全局连接事件更新 `owner` （类或者实例）的拓扑登记表，然后调用回调函数与监听函数"""
+        owner._topology.on_global_connect(unit_id, client_id, client_type, access_unit_id, status, info)
+        if callable(callback):
+            callback(unit_id, client_id, client_type, access_unit_id, status, info)
+        for listener in list(owner._global_connect_listeners):
+            try:
+                listener(unit_id, client_id, client_type, access_unit_id, status, info)
+            except Exception:
+                owner.get_logger().exception('global-connect listener %s', listener)
+
+    @classmethod
+    def topology(cls):
+        """内置的 `smartbus` 拓扑登记表
+
+        它接收所有的全局连接事件，先于 `global_connect_callback` 与 :meth:`add_global_connect_listener` 登记的监听函数更新。
+        见 :mod:`yunhuni.cti.busnetcli.topology`
+
+        :rtype: Topology
+        """
+        return cls._topology
+
+    @classmethod
+    def add_global_connect_listener(cls, listener):
+        """登记一个全局连接事件监听函数
+
+        与 :meth:`initialize` 的 `global_connect_callback` 参数不同，可以登记多个监听函数。
+        它们在 `global_connect_callback` 之后，以相同的参数被依次调用；其异常被记录到日志。
+
+        :param callable listener: 监听函数，形式同 `global_connect_callback`
+        """
+        if listener not in cls._global_connect_listeners:
+            cls._global_connect_listeners.append(listener)
+
+    @classmethod
+    def remove_global_connect_listener(cls, listener):
+        """取消 :meth:`add_global_connect_listener` 登记的监听函数
+
+        :param callable listener: 监听函数
+        """
+        try:
+            cls._global_connect_listeners.remove(listener)
+        except ValueError:
+            pass
 
     @classmethod
     def _cb_trace(cls, msg):
@@ -310,6 +535,63 @@ class Client(LoggerMixin):
         """
         cls.get_logger().error(to_str(string_at(msg))) if msg else ''
 
+    @classmethod
+    def _packet_logger(cls):
+        """需要记录数据包调试日志时，返回 logger ；否则返回 `None`
+
+        按照 :attr:`packet_log_sample_rate` 采样
+        """
+        logger = cls.get_logger()
+        if not logger.isEnabledFor(DEBUG):
+            return None
+        if cls.packet_log_sample_rate > 1 and next(cls._packet_log_counter) % cls.packet_log_sample_rate:
+            return None
+        return logger
+
+    @classmethod
+    def _format_payload(cls, data, size=None):
+        """按照 :attr:`packet_log_mode` 格式化数据包内容，用于调试日志
+
+        :param data: 数据。 :class:`bytes` 等缓冲区对象，或者 C 内存地址
+        :param int size: 数据长度
+        """
+        if data is None:
+            return data
+        if size is None:
+            size = len(data)
+        mode = cls.packet_log_mode
+        if mode == 'size':
+            return '<{} bytes>'.format(size)
+        if mode == 'full':
+            limit = size
+        else:
+            limit = min(size, cls.packet_log_preview_size)
+        if isinstance(data, Integral):
+            data = string_at(data, limit)
+        if mode == 'full':
+            return data
+        return hex_preview(data, limit, size)
+
+    @classmethod
+    def configure_packet_logging(cls, mode=None, preview_size=None, sample_rate=None):
+        """设置数据包调试日志的记录方式
+
+        :param str mode: 见 :attr:`packet_log_mode`
+        :param int preview_size: 见 :attr:`packet_log_preview_size`
+        :param int sample_rate: 见 :attr:`packet_log_sample_rate`
+        """
+        if mode is not None:
+            if mode not in ('full', 'preview', 'size'):
+                raise ValueError('Invalid packet logging mode "{}"'.format(mode))
+            cls.packet_log_mode = mode
+        if preview_size is not None:
+            cls.packet_log_preview_size = int(preview_size)
+        if sample_rate is not None:
+            sample_rate = int(sample_rate)
+            if sample_rate < 1:
+                raise ValueError('argument "sample_rate" must be greater than 0')
+            cls.packet_log_sample_rate = sample_rate
+
     @classmethod
     def create(cls, *args, **kwargs):
         """建立实例
@@ -329,6 +611,89 @@ class Client(LoggerMixin):
         """
         return cls._instances.get(client_id, default)
 
+    def _dispatch(self, fn, *args):
+        """将事件执行函数交给事件执行器
+
+        C 库的回调函数都经由这个方法执行事件函数。子类可重写它以改变事件的执行方式。
+
+        :param callable fn: 事件执行函数
+        :param args: 事件执行函数的参数
+        """
+        if self._metrics is None:
+            self._event_executor.submit(fn, *args)
+        else:
+            self._event_executor.submit(self._run_timed, perf_counter(), fn, args)
+
+    def _run_timed(self, start, fn, args):
+        """记录事件分派延迟，并执行事件函数"""
+        self._metrics.dispatch_latency.record((perf_counter() - start) * 1e6)
+        return fn(*args)
+
+    def _dispatch_keyed(self, key, fn, *args):
+        """按键将事件执行函数交给事件执行器
+
+        事件执行器是 :class:`KeyedExecutor` 时，键相同的事件按顺序执行；否则同 :meth:`_dispatch`
+
+        :param key: 可哈希的键
+        :param callable fn: 事件执行函数
+        :param args: 事件执行函数的参数
+        """
+        if self._keyed_executor is None:
+            self._dispatch(fn, *args)
+        elif self._metrics is None:
+            self._keyed_executor.submit_keyed(key, fn, *args)
+        else:
+            self._keyed_executor.submit_keyed(key, self._run_timed, perf_counter(), fn, args)
+
+    def _check(self, error_code):
+        """检查 C-API 的返回结果：有错误时记录到运行指标，并抛出 :exc:`SmartBusError`"""
+        if self._metrics is not None and error_code:
+            self._metrics.error(error_code)
+        check(error_code)
+
+    def stats(self):
+        """客户端状态与运行指标
+
+        :return: 包含以下键的字典：
+
+            * ``client_id`` : 本地 client id
+            * ``queues`` : 各队列中等待处理的数量：
+              ``executor`` （事件执行器）、 ``batch`` （批量分派）、 ``outbound`` （发送队列）、
+              ``rate_limited`` （速率限制器中排队的调用）、
+              ``pending_invocations`` （ :meth:`launch_flow_async` 未完成的调用）。未使用或无法获得的是 `None`
+            * ``outbound`` : 发送队列的状态，见 :meth:`OutboundQueue.stats` 。未使用时是 `None`
+            * ``fanout`` : 多进程分发器的状态，见 :meth:`FanOut.stats` 。未使用时是 `None`
+            * ``flow_cache`` : 流程调用结果缓存的状态，见 :meth:`FlowCache.stats` 。未使用时是 `None`
+            * ``flow_coalescer`` : 相同流程调用合并器的状态，见 :meth:`FlowCoalescer.stats` 。未使用时是 `None`
+            * ``rate_limiter`` : 速率限制器的状态，见 :meth:`RateLimiter.stats` 。未使用时是 `None`
+            * ``balancer`` : 负载均衡器各个目标的状态，见 :meth:`Balancer.stats` 。未使用时是 `None`
+            * ``router`` : 接收数据分派表的状态，见 :meth:`Router.stats` 。没有登记处理函数时是 `None`
+            * ``messages`` : 消息类型登记表的状态，见 :meth:`MessageRegistry.stats` 。未使用时是 `None`
+            * ``metrics`` : 运行指标，见 :meth:`Metrics.snapshot` 。构造时没有指定 `metrics` 参数为真的，是 `None`
+
+        :rtype: dict
+        """
+        outbound_queue = self._outbound_queue
+        return {
+            'client_id': self._client_id,
+            'queues': {
+                'executor': _executor_depth(self._event_executor),
+                'batch': None if self._data_batcher is None else len(self._data_batcher),
+                'outbound': None if outbound_queue is None else outbound_queue.depth,
+                'rate_limited': None if self._rate_limiter is None else self._rate_limiter.queued,
+                'pending_invocations': len(self._invocations),
+            },
+            'outbound': None if outbound_queue is None else outbound_queue.stats(),
+            'fanout': None if self._fanout is None else self._fanout.stats(),
+            'flow_cache': None if self._flow_cache is None else self._flow_cache.stats(),
+            'flow_coalescer': None if self._flow_coalescer is None else self._flow_coalescer.stats(),
+            'rate_limiter': None if self._rate_limiter is None else self._rate_limiter.stats(),
+            'balancer': None if self._balancer is None else self._balancer.stats(),
+            'router': None if self._router is None else self._router.stats(),
+            'messages': None if self._message_registry is None else self._message_registry.stats(),
+            'metrics': None if self._metrics is None else self._metrics.snapshot(),
+        }
+
     @property
     def unit_id(self):
         return self._unit_id
@@ -390,7 +755,7 @@ class Client(LoggerMixin):
             c_char_p(to_bytes(self._password)) if self._password else None,
             c_char_p(to_bytes(self._info)) if self._info else None
         )
-        check(error_code)
+        self._check(error_code)
 
     def send_data(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
         """发送数据
@@ -400,26 +765,295 @@ class Client(LoggerMixin):
         :param int dst_unit_id: 目标节点ID
         :param int dst_client_id: 目标客户端ID
         :param int dst_client_type: 目标客户端类型
-        :param bytes data: 待发送数据，类型必须是 :class:`bytes`
+        :param bytes data: 待发送数据，类型可以是 :class:`bytes` 、 :class:`bytearray` 、 :class:`memoryview` 等支持缓冲区协议的对象。
+            可写的、连续的缓冲区直接传递给 C 函数，不复制。
+            也可以是 :class:`StructMessage` 消息对象，发送其编码
+
+        构造时指定了 `outbound_queue` 参数的，底层发送缓冲区已满时，数据进入发送队列，见 :class:`OutboundQueue`
+
+        构造时指定了 `rate_limiter` 参数，且策略是 :data:`POLICY_QUEUE` 的，超过速率限制时，数据在取得令牌后由后台线程发送，
+        发送失败时触发 :meth:`on_send_fail`
+
+        :raises RateLimitedError: 超过速率限制，见 :class:`RateLimiter`
+        """
+        if isinstance(data, StructMessage):
+            data = data.pack()
+        logger = self._packet_logger()
+        if logger:
+            logger.debug(
+                'send_data: '
+                'cmd=%s, cmd_type=%s, dst_unit_id=%s, dst_client_id=%s, dst_client_type=%s, data=%s',
+                cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, self._format_payload(data)
+            )
+        self._send_throttled(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+
+    def send_message(self, message, dst_unit_id, dst_client_id, dst_client_type):
+        """发送消息对象
+
+        `cmd` 与 `cmd_type` 取自消息的类型，其余同 :meth:`send_data`
+
+        :param message: :class:`StructMessage` 消息对象，
+            或者登记在构造时指定的 `message_registry` 中的 :class:`ctypes.Structure` 对象
+        :raises KeyError: 消息的类型既不是 :class:`StructMessage` 的子类，也没有登记
+        """
+        if isinstance(message, StructMessage):
+            cmd, cmd_type = message.cmd, message.cmd_type
+        elif self._message_registry is not None:
+            cmd, cmd_type = self._message_registry.key_of(message)
+        else:
+            raise KeyError(type(message))
+        self.send_data(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, message)
+
+    def send_many(self, messages):
+        """批量发送数据
+
+        相当于对每条消息调用 :meth:`send_data` ，但是只记录一条调试日志，且某个目标发送失败时不抛出异常，而是记录其错误码。
+
+        :param messages: `(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)` 元组的可迭代对象，
+            元组的各个元素同 :meth:`send_data` 的参数
+        :return: 与 `messages` 顺序一致的错误码数组。见 :meth:`broadcast`
+        :rtype: array.array
+        """
+        results = array('i')
+        if self._rate_limiter is None and self._outbound_queue is None:
+            send = self._send_data
+            metrics = self._metrics
+            for cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data in messages:
+                if isinstance(data, StructMessage):
+                    data = data.pack()
+                error_code = send(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+                results.append(error_code)
+                if metrics is not None:
+                    if error_code:
+                        metrics.error(error_code)
+                    else:
+                        metrics.sent(cmd, cmd_type, len(data) if data else 0)
+        else:
+            for message in messages:
+                results.append(self._send_one(*message))
+        self._log_bulk('send_many', None, None, results)
+        return results
+
+    def broadcast(self, cmd, cmd_type, targets, data):
+        """将同一份数据发送给多个目标
+
+        数据只转换一次，所有目标共用同一个缓冲区。某个目标发送失败时不抛出异常，而是记录其错误码。
+
+        :param int cmd: 命令
+        :param int cmd_type: 命令类型
+        :param targets: `(dst_unit_id, dst_client_id, dst_client_type)` 元组的可迭代对象，
+            如 ``[(node.unit_id, node.client_id, node.client_type) for node in Client.topology().by_type(...)]``
+        :param bytes data: 待发送数据，类型同 :meth:`send_data` 的 `data` 参数
+        :return: 与 `targets` 顺序一致的错误码数组：
+
+            * `0` ：发送成功，或者已经进入发送队列、速率限制的等待队列；
+            * 发送失败的，是 `smartbus` 错误码；
+            * 发送队列已满的，是 :data:`SMARTBUS_ERR_BUFF_FULL` ；
+            * 超过速率限制而被拒绝的，是 :data:`SMARTBUS_ERR_OTHER`
+
+        :rtype: array.array
         """
-        self.logger.debug(
-            'send_data: '
-            'cmd=%s, cmd_type=%s, dst_unit_id=%s, dst_client_id=%s, dst_client_type=%s, data=%s',
-            cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data
+        if isinstance(data, StructMessage):
+            data = data.pack()
+        results = array('i')
+        if self._rate_limiter is None and self._outbound_queue is None:
+            buff, length = self._payload_arg(data)
+            send = self._send_buffer
+            for dst_unit_id, dst_client_id, dst_client_type in targets:
+                results.append(send(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, buff, length))
+            self._count_bulk(cmd, cmd_type, length, results)
+        else:
+            if data and not isinstance(data, bytes):
+                data = bytes(data)  # 发送队列与速率限制队列都会保留数据，只复制一次
+            for dst_unit_id, dst_client_id, dst_client_type in targets:
+                results.append(self._send_one(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data))
+        self._log_bulk('broadcast', cmd, cmd_type, results, data)
+        return results
+
+    def ping_many(self, targets, data=None):
+        """向多个目标发送PING命令
+
+        :param targets: `(dst_unit_id, dst_client_id, dst_client_type)` 元组的可迭代对象
+        :param bytes data: 待发送数据，类型同 :meth:`send_data` 的 `data` 参数。所有目标共用同一个缓冲区
+        :return: 与 `targets` 顺序一致的错误码数组， `0` 表示成功
+        :rtype: array.array
+        """
+        results = array('i')
+        buff, length = self._payload_arg(data)
+        ping = self._ping_buffer
+        for dst_unit_id, dst_client_id, dst_client_type in targets:
+            results.append(ping(dst_unit_id, dst_client_id, dst_client_type, buff, length))
+        self._count_bulk(None, None, 0, results)
+        self._log_bulk('ping_many', None, None, results, data)
+        return results
+
+    def _send_one(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """经过速率限制与发送队列发送数据，返回错误码而不抛出异常"""
+        if isinstance(data, StructMessage):
+            data = data.pack()
+        try:
+            self._send_throttled(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+        except SmartBusError as e:
+            return e.code
+        except OutboundQueueFullError:
+            return SMARTBUS_ERR_BUFF_FULL
+        except RateLimitedError:
+            return SMARTBUS_ERR_OTHER
+        return SMARTBUS_ERR_OK
+
+    def _count_bulk(self, cmd, cmd_type, length, results):
+        """将批量发送的结果记录到运行指标。 `cmd` 为 `None` 的，不记录发送的数据包"""
+        metrics = self._metrics
+        if metrics is None:
+            return
+        failed = 0
+        for error_code in results:
+            if error_code:
+                metrics.error(error_code)
+                failed += 1
+        if cmd is not None and len(results) > failed:
+            metrics.sent(cmd, cmd_type, length, len(results) - failed)
+
+    def _log_bulk(self, operation, cmd, cmd_type, results, data=None):
+        logger = self._packet_logger()
+        if logger:
+            logger.debug(
+                '%s: cmd=%s, cmd_type=%s, targets=%s, failed=%s, data=%s',
+                operation, cmd, cmd_type, len(results), sum(1 for error_code in results if error_code),
+                self._format_payload(data)
+            )
+
+    def _send_throttled(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """按速率限制发送数据，或者延后发送
+
+        参数同 :meth:`send_data`
+        """
+        if self._rate_limiter is not None:
+            delay = self._throttle(OP_SEND_DATA, (dst_unit_id, dst_client_id), True)
+            if delay:
+                if data and not isinstance(data, bytes):
+                    data = bytes(data)  # 调用者在返回后仍可能修改可变的缓冲区
+                self._rate_limiter.schedule(
+                    delay, self._send_deferred, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data
+                )
+                return
+        self._send_checked(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+
+    def _send_checked(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """发送数据，失败时抛出异常
+
+        参数同 :meth:`send_data`
+        """
+        if self._outbound_queue is None:
+            error_code = self._send_data(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+            if error_code:
+                self._check(error_code)
+            if self._metrics is not None:
+                self._metrics.sent(cmd, cmd_type, len(data) if data else 0)
+        elif self._metrics is None:
+            self._outbound_queue.send(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+        else:
+            # 发送成功的数据包由 _send_queued 记录：进入队列的，在队列实际发出时才记录
+            try:
+                self._outbound_queue.send(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+            except SmartBusError as e:
+                self._metrics.error(e.code)
+                raise
+
+    def _send_deferred(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """由速率限制器的后台线程延后发送数据。失败时触发 :meth:`on_send_fail`"""
+        try:
+            self._send_checked(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+        except SmartBusError as e:
+            error_code = e.code
+        except OutboundQueueFullError:
+            error_code = SMARTBUS_ERR_BUFF_FULL
+        else:
+            return
+        self.logger.error('send deferred packet failed: error_code=%s', error_code)
+        self._dispatch(self.on_send_fail, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data,
+                       error_code)
+
+    def _throttle(self, operation, destination, queueable=False):
+        """按速率限制取得令牌
+
+        :param str operation: 操作类型
+        :param tuple destination: 目标 `(unit_id, client_id)`
+        :param bool queueable: 调用者能否延后执行
+        :return: 调用者需要延后执行的时间（秒）。只有 `queueable` 为真，且策略是 :data:`POLICY_QUEUE` 时，才可能大于 `0` ；
+            否则已经在这里阻塞等待
+        :rtype: float
+        :raises RateLimitedError: 超过速率限制
+        """
+        limiter = self._rate_limiter
+        delay = limiter.reserve(operation, destination, queueable)
+        if self._metrics is not None:
+            self._metrics.limiter_wait.record(delay * 1e6)
+        if delay > 0 and not (queueable and limiter.policy == POLICY_QUEUE):
+            sleep(delay)
+            return 0.0
+        return delay
+
+    def _send_data(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """调用底层发送函数
+
+        参数同 :meth:`send_data`
+
+        :return: 错误码
+        :rtype: int
+        """
+        buff, length = _buffer_arg(data)
+        return SendData.c_func(
+            self._client_id, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, buff, length
         )
-        length = len(data) if data else 0
-        buff = create_string_buffer(data, length) if data else None
-        error_code = SendData.c_func(
-            c_byte(self._client_id),
-            c_byte(cmd),
-            c_byte(cmd_type),
-            c_int(dst_unit_id),
-            c_int(dst_client_id),
-            c_int(dst_client_type),
-            byref(buff),
-            c_int(length)
+
+    #: 将待发送数据转换为底层发送函数的参数 `(buff, length)` ，见 :func:`_buffer_arg`
+    _payload_arg = staticmethod(_buffer_arg)
+
+    def _send_buffer(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, buff, length):
+        """以 :meth:`_payload_arg` 转换过的参数调用底层发送函数
+
+        :return: 错误码
+        :rtype: int
+        """
+        return SendData.c_func(
+            self._client_id, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, buff, length
         )
-        check(error_code)
+
+    def _ping_buffer(self, dst_unit_id, dst_client_id, dst_client_type, buff, length):
+        """以 :meth:`_payload_arg` 转换过的参数调用底层PING函数
+
+        :return: 错误码
+        :rtype: int
+        """
+        return SendPing.c_func(self._client_id, dst_unit_id, dst_client_id, dst_client_type, buff, length)
+
+    @property
+    def outbound_queue(self):
+        """发送队列。构造时没有指定 `outbound_queue` 参数的，是 `None`
+
+        :rtype: OutboundQueue
+        """
+        return self._outbound_queue
+
+    def _send_queued(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """发送队列的发送函数：调用底层发送函数，发送成功时记录到运行指标
+
+        参数同 :meth:`send_data`
+
+        :return: 错误码
+        :rtype: int
+        """
+        error_code = self._send_data(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+        if not error_code and self._metrics is not None:
+            self._metrics.sent(cmd, cmd_type, len(data) if data else 0)
+        return error_code
+
+    def _on_outbound_fail(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data, error_code):
+        if self._metrics is not None:
+            self._metrics.error(error_code)
+        self._dispatch(self.on_send_fail, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data,
+                       error_code)
 
     def ping(self, dst_unit_id, dst_client_id, dst_client_type, data=None):
         """发送PING命令
@@ -427,30 +1061,25 @@ class Client(LoggerMixin):
         :param int dst_unit_id: 目标的smartbus单元ID
         :param int dst_client_id: 目标的smartbus客户端ID
         :param int dst_client_type: 目标的smartbus客户端类型
-        :param bytes data: 待发送数据，类型必须是 :class:`bytes`
+        :param bytes data: 待发送数据，类型同 :meth:`send_data` 的 `data` 参数
         """
-        self.logger.debug(
-            'ping: '
-            'dst_unit_id=%s, dst_client_id=%s, dst_client_type=%s, data=%s',
-            dst_unit_id, dst_client_id, dst_client_type, data
-        )
-        length = len(data) if data else 0
-        buff = create_string_buffer(data, length) if data else None
-        error_code = SendPing.c_func(
-            c_byte(self._client_id),
-            c_int(dst_unit_id),
-            c_int(dst_client_id),
-            c_int(dst_client_type),
-            byref(buff),
-            c_int(length)
-        )
-        check(error_code)
+        logger = self._packet_logger()
+        if logger:
+            logger.debug(
+                'ping: '
+                'dst_unit_id=%s, dst_client_id=%s, dst_client_type=%s, data=%s',
+                dst_unit_id, dst_client_id, dst_client_type, self._format_payload(data)
+            )
+        buff, length = _buffer_arg(data)
+        error_code = self._ping_buffer(dst_unit_id, dst_client_id, dst_client_type, buff, length)
+        if error_code:
+            self._check(error_code)
 
     def notify(self, server_unit_id, process_index, project_id, title, mode, expires, txt):
         """发送通知消息
 
-        :param int server_unit_id: 目标IPSC服务器 `smartbus` 单元ID
-        :param int process_index:  IPSC 进程ID，同时也是该IPSC进程的 smartbus client-id
+        :param int server_unit_id: 目标IPSC服务器 `smartbus` 单元ID。构造时指定了 `balancer` 参数的，可以是 `None` ：由均衡器选择目标
+        :param int process_index:  IPSC 进程ID，同时也是该IPSC进程的 smartbus client-id。可以是 `None` ，同上
         :param str project_id:     流程项目ID
         :param str title:          通知的标题
         :param int mode:           调用模式。目前无意义，一律使用0
@@ -459,12 +1088,27 @@ class Client(LoggerMixin):
         :return:                   调用任务的ID。
         :rtype:                    int
         :except:                   API返回错误
+        :raises RateLimitedError:  超过速率限制，见 :class:`RateLimiter`
+        """
+        logger = self._packet_logger()
+        if logger:
+            logger.debug(
+                'notify: '
+                'server_unit_id=%s, process_index=%s, project_id=%s, title=%s, mode=%s, expires=%s, txt=%s',
+                server_unit_id, process_index, project_id, title, mode, expires, txt
+            )
+        if server_unit_id is None or process_index is None:
+            server_unit_id, process_index = self._balanced_target().choose()
+        if self._rate_limiter is not None:
+            self._throttle(OP_NOTIFY, (server_unit_id, process_index))
+        return self._send_notify(server_unit_id, process_index, project_id, title, mode, expires, txt)
+
+    def _send_notify(self, server_unit_id, process_index, project_id, title, mode, expires, txt):
+        """调用底层通知发送函数。参数同 :meth:`notify` ，但目标已经确定
+
+        :return: 调用任务的ID
+        :rtype: int
         """
-        self.logger.debug(
-            'notify: '
-            'server_unit_id=%s, process_index=%s, project_id=%s, title=%s, mode=%s, expires=%s, txt=%s',
-            server_unit_id, process_index, project_id, title, mode, expires, txt
-        )
         iid = SendNotify.c_func(
             c_byte(self._client_id),
             c_int(server_unit_id),
@@ -476,14 +1120,15 @@ class Client(LoggerMixin):
             c_char_p(s2b_recode(txt, 'utf-8', 'cp936')) if txt else None
         )
         if iid < 0:
-            check(iid)
+            self._check(iid)
         return iid
 
     def launch_flow(self, server_unit_id, process_index, project_id, flow_id, mode, timeout, params):
         """调用流程
 
-        :param int server_unit_id: 目标 `IPSC` 服务器 `smartbus` 单元ID
-        :param int process_index: `IPSC` 进程 `ID` ，同时也是该 `IPSC` 进程的 `smartbus` Client ID
+        :param int server_unit_id: 目标 `IPSC` 服务器 `smartbus` 单元ID。
+            构造时指定了 `balancer` 参数的，可以是 `None` ：由均衡器选择目标
+        :param int process_index: `IPSC` 进程 `ID` ，同时也是该 `IPSC` 进程的 `smartbus` Client ID。可以是 `None` ，同上
         :param str project_id: 流程项目ID
         :param str flow_id: 流程ID
         :param int mode: 调用模式：0 有流程返回、1 无流程返回
@@ -493,25 +1138,316 @@ class Client(LoggerMixin):
             对应的字符串内容最大长度不超过32K字节。
         :return: invoke_id，调用ID，用于流程结果返回匹配用途。
         :rtype: int
+        :raises SmartBusError: 参数编码后超过32K字节（ :data:`SMARTBUS_ERR_MAX_DATASIZE` ），或者 API 返回错误
+        :raises TypeError: 参数不能序列化为 JSON
+        :raises RateLimitedError: 超过速率限制，见 :class:`RateLimiter`
+        :raises SmartBusError: 由均衡器选择目标，但没有可用的目标（ :data:`SMARTBUS_ERR_DEST_NONEXIST` ）
+
+        构造时指定了 `flow_cache` 参数，且缓存命中的，不经过 `smartbus` ，
+        返回一个新分配的 `invoke_id` ，并以缓存的结果触发 :meth:`on_flow_ack` 与 :meth:`on_flow_resp` 。
+
+        构造时指定了 `flow_coalescer` 参数，且有进行中的相同调用的，不经过 `smartbus` ，
+        返回一个新分配的 `invoke_id` ，在进行中的调用的事件到达时，以这个 `invoke_id` 触发相应的事件函数。
+        """
+        logger = self._packet_logger()
+        if logger:
+            logger.debug(
+                'launch-flow: '
+                'server_unit_id=%s, process_index=%s, project_id=%s, flow_id=%s, mode=%s, timeout=%s, params=%s',
+                server_unit_id, process_index, project_id, flow_id, mode, timeout, params
+            )
+        return self._start_flow(None, server_unit_id, process_index, project_id, flow_id, mode, timeout, params)
+
+    def launch_flow_async(self, server_unit_id, process_index, project_id, flow_id, mode, timeout, params):
+        """调用流程，返回 :class:`concurrent.futures.Future`
+
+        参数同 :meth:`launch_flow`
+
+        :return: 流程调用结果的 `Future` 。
+
+            * 有流程返回 (`mode` 为 `0`) 时，其结果是流程返回值列表，对应于 :meth:`on_flow_resp` 的 `params` 参数；
+            * 无流程返回 (`mode` 为 `1`) 时，在流程启动确认后，其结果是 `None` ；
+            * 流程启动失败、执行超时或者执行错误时，其异常是 :exc:`SmartBusError` ，
+              超时的错误码是 :data:`SMARTBUS_ERR_TIMEOUT` 。
+              超过超时值仍没有收到结果的，由后台线程每隔 :attr:`sweep_interval` 秒检查，以超时错误结束；
+            * 连接断开时，其异常是 :exc:`SmartBusError` ，错误码是 :data:`SMARTBUS_ERR_CONNECT_BREAK`
+
+        :rtype: concurrent.futures.Future
+        :raises InvocationTableFullError: 未完成的调用数量已经达到上限
+        :raises RateLimitedError: 超过速率限制，见 :class:`RateLimiter` 。
+            策略是 :data:`POLICY_QUEUE` 的，调用在取得令牌后由后台线程发起，不抛出这个异常
+
+        :meth:`on_flow_ack` 等事件函数仍然会被回调。
+
+        .. note:: `Future` 在 C 库的回调线程中完成。
+        """
+        logger = self._packet_logger()
+        if logger:
+            logger.debug(
+                'launch-flow-async: '
+                'server_unit_id=%s, process_index=%s, project_id=%s, flow_id=%s, mode=%s, timeout=%s, params=%s',
+                server_unit_id, process_index, project_id, flow_id, mode, timeout, params
+            )
+        fut = Future()
+        self._start_flow(fut, server_unit_id, process_index, project_id, flow_id, mode, timeout, params)
+        return fut
+
+    def prepare_flow(self, server_unit_id, process_index, project_id, flow_id, mode, timeout):
+        """准备反复使用的流程调用
+
+        参数同 :meth:`launch_flow` ，但不包括 `params`
+
+        :return: 流程调用句柄。它预先编码了 `project_id` 、 `flow_id` 等参数，
+            其 :meth:`PreparedFlow.launch` 与 :meth:`PreparedFlow.launch_async` 方法相当于以同样的参数调用
+            :meth:`launch_flow` 与 :meth:`launch_flow_async` ，只需要编码流程参数
+        :rtype: PreparedFlow
         """
-        self.logger.debug(
-            'launch-flow: '
-            'server_unit_id=%s, process_index=%s, project_id=%s, flow_id=%s, mode=%s, timeout=%s, params=%s',
-            server_unit_id, process_index, project_id, flow_id, mode, timeout, params
+        if server_unit_id is None or process_index is None:
+            self._balanced_target()
+        return PreparedFlow(self, server_unit_id, process_index, project_id, flow_id, mode, timeout)
+
+    def _launch_prepared(self, future, flow, params):
+        """以 :class:`PreparedFlow` 句柄发起流程调用"""
+        logger = self._packet_logger()
+        if logger:
+            logger.debug('launch-flow: prepared=%s, async=%s, params=%s', flow, future is not None, params)
+        return self._start_flow(
+            future, flow.server_unit_id, flow.process_index, flow.project_id, flow.flow_id, flow.mode, flow.timeout,
+            params, flow
         )
-        value_string_list = c_char_p(to_bytes(str(params)))
-        iid = RemoteInvokeFlow.c_func(
-            c_byte(self._client_id),
-            c_int(server_unit_id),
-            c_int(process_index),
-            c_char_p(to_bytes(project_id)),
-            c_char_p(to_bytes(flow_id)),
-            c_int(mode),
-            c_int(int(timeout * 1000)),
-            value_string_list
+
+    def _start_flow(self, future, server_unit_id, process_index, project_id, flow_id, mode, timeout, params,
+                    prepared=None):
+        """发起流程调用：依次尝试结果缓存、合并到进行中的相同调用，最后才经过 `smartbus` 发起调用
+
+        :param concurrent.futures.Future future: 用于返回调用结果的 `Future` 。 :meth:`launch_flow` 的是 `None`
+        :param PreparedFlow prepared: 预先准备的调用句柄
+        :return: invoke_id 。因速率限制而延后发起的是 `None`
+        """
+        balanced = server_unit_id is None or process_index is None
+        if balanced:
+            self._balanced_target()
+        cache = self._flow_cache
+        key = None if cache is None else cache.key_of(server_unit_id, project_id, flow_id, mode, params)
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                iid = next_synthetic_invoke_id()
+                if future is not None and future.set_running_or_notify_cancel():
+                    future.set_result(list(cached[1]))
+                self._replay_flow(project_id, iid, *cached)
+                return iid
+        coalescer = self._flow_coalescer
+        flight = None
+        if coalescer is not None:
+            coalesce_key = coalescer.key_of(server_unit_id, process_index, project_id, flow_id, mode, params)
+            if coalesce_key is not None:
+                flight, iid = coalescer.join(coalesce_key, self, project_id, timeout, future)
+                if iid is not None:
+                    return iid
+        limiter = self._rate_limiter
+        delay = 0
+        acquired = False
+        try:
+            if balanced:
+                server_unit_id, process_index = self._balancer.acquire()
+                acquired = True
+            if limiter is not None:
+                delay = self._throttle(OP_LAUNCH_FLOW, (server_unit_id, process_index), future is not None)
+        except Exception as e:
+            if acquired:
+                self._balancer.release((server_unit_id, process_index))
+            if flight is not None:
+                coalescer.abort(flight, e)
+            raise
+        if delay:
+            limiter.schedule(
+                delay, self._launch_deferred, future, key, flight, acquired,
+                server_unit_id, process_index, project_id, flow_id, mode, timeout, params, prepared
+            )
+            return None
+        return self._launch_on_bus(
+            future, key, flight, acquired, server_unit_id, process_index, project_id, flow_id, mode, timeout, params,
+            prepared
         )
+
+    def _balanced_target(self):
+        """返回负载均衡器。没有的，抛出 :exc:`ValueError`"""
+        if self._balancer is None:
+            raise ValueError('server_unit_id and process_index are required without a balancer')
+        return self._balancer
+
+    def _launch_deferred(self, future, *args):
+        """由速率限制器的后台线程延后发起流程调用。失败时以异常完成 `future`"""
+        try:
+            self._launch_on_bus(future, *args)
+        except Exception as e:
+            _settle(future, exception=e)
+
+    def _launch_on_bus(self, future, key, flight, acquired, server_unit_id, process_index, project_id, flow_id, mode,
+                       timeout, params, prepared=None):
+        """经过 `smartbus` 发起流程调用
+
+        :param future: 用于返回调用结果的 `Future` 。 :meth:`launch_flow` 的是 `None`
+        :param key: 结果缓存的缓存键。不缓存的是 `None`
+        :param flight: 作为领头调用的 :class:`Flight` 。不合并的是 `None`
+        :param bool acquired: 目标是否由负载均衡器的 :meth:`Balancer.acquire` 选择
+        :param PreparedFlow prepared: 预先准备的调用句柄
+        :return: invoke_id
+        """
+        if self._sweeper is None:
+            self._start_sweeper()
+        cache = self._flow_cache
+        coalescer = self._flow_coalescer
+        balancer = self._balancer
+        contexts = []
+        if future is not None:
+            contexts.append(self._invocations.launching())
+        if key is not None:
+            contexts.append(cache.launching())
+        if flight is not None:
+            contexts.append(coalescer.launching())
+        if balancer is not None:
+            contexts.append(balancer.launching())
+        # 依次进入各个组件的 launching 上下文，按相反的顺序退出已经进入的
+        entered = []
+        try:
+            try:
+                for context in contexts:
+                    context.__enter__()
+                    entered.append(context)
+                start = perf_counter()
+                iid = self._remote_invoke_flow(
+                    server_unit_id, process_index, project_id, flow_id, mode, timeout, params, prepared
+                )
+                if future is not None:
+                    self._invocations.add(iid, future, mode, timeout)
+                if key is not None:
+                    cache.launched(self._client_id, iid, key)
+                if flight is not None:
+                    coalescer.launched(flight, self._client_id, iid)
+                if balancer is not None:
+                    balancer.launched(self._client_id, iid, (server_unit_id, process_index), mode, start, acquired,
+                                      timeout)
+            finally:
+                for context in reversed(entered):
+                    context.__exit__(None, None, None)
+        except Exception as e:
+            if acquired:
+                balancer.release((server_unit_id, process_index))
+            if flight is not None:
+                coalescer.abort(flight, e)
+            raise
+        if self._metrics is not None or self._flow_tracer is not None:
+            self._flow_launched(iid, server_unit_id, process_index, project_id, flow_id, mode, start)
+        return iid
+
+    def _start_sweeper(self):
+        """启动定期清理过期的流程调用记录的后台线程"""
+        with self._sweeper_lock:
+            if self._sweeper is not None or self._sweeper_stopped.is_set():
+                return
+            self._sweeper = threading.Thread(target=self._run_sweeper,
+                                             name='{}-sweeper-{}'.format(self.__class__.__name__, self._client_id))
+            self._sweeper.daemon = True
+            self._sweeper.start()
+
+    def _run_sweeper(self):
+        while not self._sweeper_stopped.wait(self.sweep_interval):
+            try:
+                self._sweep()
+            except Exception:
+                self.logger.exception('sweep')
+
+    def _sweep(self):
+        """清理过期的流程调用记录
+
+        超过超时值仍无结果的 :meth:`launch_flow_async` 调用与合并的跟随调用，以超时错误结束；
+        负载均衡器中这样的调用，按超时计入统计
+        """
+        self._invocations.expire()
+        if self._flow_coalescer is not None:
+            self._flow_coalescer.expire()
+        if self._balancer is not None:
+            self._balancer.expire()
+
+    def _shutdown(self, exception):
+        """停止后台清理线程，并以 `exception` 结束未完成的 :meth:`launch_flow_async` 调用"""
+        self._sweeper_stopped.set()
+        self._invocations.cancel_all(exception)
+
+    def _replay_flow(self, project_id, invoke_id, head, params):
+        """以缓存的结果分派流程启动确认与结果返回事件"""
+        self._dispatch_keyed(invoke_id, self.on_flow_ack, head, project_id, invoke_id, 1, '')
+        self._dispatch_keyed(invoke_id, self.on_flow_resp, head, project_id, invoke_id, params)
+
+    def _deliver_coalesced_ack(self, future, head, project_id, invoke_id, ack, msg):
+        """将领头调用的启动确认转发给合并到它的跟随调用
+
+        :param concurrent.futures.Future future: 跟随调用的 `Future` 。 :meth:`launch_flow` 的是 `None`
+
+        其它参数同 :meth:`on_flow_ack`
+        """
+        if future is not None and ack != 1:
+            _settle(future, exception=SmartBusError(ack, msg or error_code_message.get(ack, 'UNDEFINED_ERROR')))
+        self._dispatch_keyed(invoke_id, self.on_flow_ack, head, project_id, invoke_id, ack, msg)
+
+    def _deliver_coalesced_ret(self, future, head, project_id, invoke_id, status_code, params):
+        """将领头调用的结果返回转发给合并到它的跟随调用
+
+        :param concurrent.futures.Future future: 跟随调用的 `Future` 。 :meth:`launch_flow` 的是 `None`
+
+        其它参数同 :meth:`_deliver_flow_ret`
+        """
+        if future is not None:
+            if status_code == 1:
+                _settle(future, params)
+            else:
+                _settle(future, exception=check(status_code, False))
+        self._dispatch_keyed(invoke_id, *self._flow_ret_event(head, project_id, invoke_id, status_code, params))
+
+    def _flow_launched(self, invoke_id, server_unit_id, process_index, project_id, flow_id, mode, start):
+        """将流程调用的开始记录到运行指标与追踪器"""
+        if self._metrics is not None:
+            self._metrics.flow_launched(invoke_id, mode, start)
+        if self._flow_tracer is not None:
+            self._flow_tracer.launched(
+                self._client_id, invoke_id, server_unit_id, process_index, project_id, flow_id, mode, start
+            )
+
+    def _encode_flow_params(self, params):
+        """将流程输入参数编码为 JSON
+
+        :raises SmartBusError: 超过 :data:`MAX_FLOW_PARAMS_SIZE` 字节（ :data:`SMARTBUS_ERR_MAX_DATASIZE` ）
+        """
+        data = self._json_codec.encode([] if params is None else params)
+        if len(data) > MAX_FLOW_PARAMS_SIZE:
+            self._check(SMARTBUS_ERR_MAX_DATASIZE)
+        return data
+
+    def _remote_invoke_flow(self, server_unit_id, process_index, project_id, flow_id, mode, timeout, params,
+                            prepared=None):
+        value_string_list = c_char_p(self._encode_flow_params(params))
+        if prepared is None:
+            iid = RemoteInvokeFlow.c_func(
+                c_byte(self._client_id),
+                c_int(server_unit_id),
+                c_int(process_index),
+                c_char_p(to_bytes(project_id)),
+                c_char_p(to_bytes(flow_id)),
+                c_int(mode),
+                c_int(int(timeout * 1000)),
+                value_string_list
+            )
+        else:
+            c_client_id, c_project_id, c_flow_id, c_mode, c_timeout = prepared.c_args
+            c_server_unit_id, c_process_index = prepared.c_target(server_unit_id, process_index)
+            iid = RemoteInvokeFlow.c_func(
+                c_client_id, c_server_unit_id, c_process_index, c_project_id, c_flow_id, c_mode, c_timeout,
+                value_string_list
+            )
         if iid < 0:
-            check(iid)
+            self._check(iid)
         return iid
 
     def on_connect(self):
@@ -530,7 +1466,250 @@ class Client(LoggerMixin):
         """接收到了数据
 
         :param Head head: 消息头
-        :param bytes data: :class:`bytes` 二进制数据
+        :param bytes data: :class:`bytes` 二进制数据。
+            构造时指定了 `buffer_pool` 参数的，是 :class:`memoryview` ，仅在该函数返回前有效。
+            构造时指定了 `message_registry` 参数，且 `(cmd, cmd_type)` 登记了消息类型的，是解码得到的消息对象
+        """
+        pass
+
+    def route(self, cmd=ANY, cmd_type=ANY, executor=None):
+        """按 `(cmd, cmd_type)` 登记接收数据处理函数的装饰器
+
+        登记之后，接收到的数据按分派表交给处理函数，不再触发 :meth:`on_data` 与 :meth:`on_data_batch` ；
+        没有匹配的处理函数的数据包被计数并丢弃。见 :mod:`yunhuni.cti.busnetcli.routing`
+
+        :param int cmd: 命令。默认为 :data:`ANY` ：任意
+        :param int cmd_type: 命令类型。默认为 :data:`ANY` ：任意
+        :param executor: 执行处理函数的执行器。默认为 `None` ：使用事件执行器
+        :return: 装饰器。被装饰的函数形如 ``handler(head, data)`` ，参数同 :meth:`on_data` ，装饰器原样返回它
+        """
+        def decorator(handler):
+            if self._router is None:
+                self._router = Router()
+            self._router.add(cmd, cmd_type, handler, executor)
+            return handler
+
+        return decorator
+
+    def unroute(self, cmd=ANY, cmd_type=ANY):
+        """取消 :meth:`route` 的登记
+
+        :return: 是否存在这个登记
+        :rtype: bool
+        """
+        return self._router is not None and self._router.remove(cmd, cmd_type)
+
+    @property
+    def router(self):
+        """接收数据分派表。没有通过 :meth:`route` 登记过处理函数的，是 `None`
+
+        :rtype: Router
+        """
+        return self._router
+
+    def on_data_batch(self, items):
+        """批量接收到了数据
+
+        仅在构造时指定了 `batch_dispatch` 参数为真时被调用。默认实现是对每个数据包依次调用 :meth:`on_data`
+
+        :param list items: `(head, data)` 元组列表，参数的意义与 :meth:`on_data` 相同
+        """
+        for head, data in items:
+            self.on_data(head, data)
+
+    def _deliver_connect(self, access_point_unit_id, ack):
+        """分派连接（成功或失败）事件
+
+        :param int access_point_unit_id: 连接点的 UnitID
+        :param int ack: 连接注册结果： 0 建立连接成功、< 0 连接失败
+        """
+        metrics = self._metrics
+        if ack == 0:  # 建立连接成功
+            if metrics is not None:
+                metrics.connects += 1
+            self._unit_id = access_point_unit_id
+            self._dispatch(self.on_connect)
+        else:  # 连接失败
+            if metrics is not None:
+                metrics.connect_failures += 1
+                metrics.error(ack)
+            self._dispatch(self.on_connect_fail, ack)
+
+    def _deliver_disconnect(self):
+        """分派连接断开事件。未完成的 :meth:`launch_flow_async` 调用以 :data:`SMARTBUS_ERR_CONNECT_BREAK` 错误结束"""
+        if self._metrics is not None:
+            self._metrics.disconnects += 1
+        self._invocations.cancel_all(check(SMARTBUS_ERR_CONNECT_BREAK, False))
+        self._dispatch(self.on_disconnect)
+
+    def _deliver_data(self, head, data):
+        """分派接收数据事件
+
+        :param Head head: 消息头
+        :param data: 数据。指定了接收缓冲区池时，须是从池中取得的 :class:`memoryview`
+        """
+        if self._metrics is not None:
+            self._metrics.received(head[0], head[1], len(data) if data else 0)
+        if self._fanout is not None:
+            self._fanout.put(head, data)
+            return
+        if self._message_registry is not None and data is not None:
+            decoder = self._message_registry.table[((head[0] & 0xff) << 8) | (head[1] & 0xff)]
+            if decoder is not None:
+                data = self._decode_message(decoder, head, data)
+                if data is None:
+                    return
+        if self._router is not None:
+            self._route_data(head, data)
+        elif self._data_batcher is not None:
+            self._data_batcher.put((head, data))
+        elif self._buffer_pool is None:
+            self._dispatch_keyed(head[3] * 257 + head[4], self.on_data, head, data)
+        else:
+            self._dispatch_keyed(head[3] * 257 + head[4], self._on_pooled_data, head, data)
+
+    def _decode_message(self, decoder, head, data):
+        """在接收回调的线程中解码数据包。解码后立即归还接收缓冲区；解码失败的，记录日志并返回 `None`"""
+        try:
+            return decoder(data)
+        except Exception:
+            self._message_registry.errors += 1
+            self.logger.exception('decode message failed: head=%s, data=%s', head, self._format_payload(data))
+            return None
+        finally:
+            if self._buffer_pool is not None:
+                self._buffer_pool.release(data)
+
+    def _route_data(self, head, data):
+        """按分派表分派接收数据事件。参数同 :meth:`_deliver_data`"""
+        router = self._router
+        entry = router.table[((head[0] & 0xff) << 8) | (head[1] & 0xff)]
+        if entry is None:
+            router.unmatched += 1
+            if isinstance(data, memoryview) and self._buffer_pool is not None:
+                self._buffer_pool.release(data)
+            return
+        handler, executor = entry
+        if self._buffer_pool is None:
+            args = (handler, head, data)
+        else:
+            args = (self._run_pooled, handler, head, data)
+        if executor is None:
+            self._dispatch_keyed(head[3] * 257 + head[4], *args)
+        else:
+            executor.submit(*args)
+
+    def _deliver_flow_ack(self, head, project_id, invoke_id, ack, msg):
+        """处理流程启动确认，并分派事件
+
+        参数同 :meth:`on_flow_ack`
+        """
+        self._invocations.ack(invoke_id, ack, msg)
+        if ack != 1 and self._flow_cache is not None:
+            self._flow_cache.discard(self._client_id, invoke_id)
+        if self._flow_coalescer is not None:
+            self._flow_coalescer.acked(self._client_id, invoke_id, head, ack, msg)
+        if self._balancer is not None:
+            self._balancer.acked(self._client_id, invoke_id, ack, perf_counter())
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.flow_acked(invoke_id, ack, perf_counter())
+            if ack != 1:
+                metrics.error(ack)
+        if self._flow_tracer is None:
+            self._dispatch_keyed(invoke_id, self.on_flow_ack, head, project_id, invoke_id, ack, msg)
+        else:
+            self._flow_tracer.acked(self._client_id, invoke_id, ack, perf_counter())
+            self._dispatch_keyed(invoke_id, self._run_traced, invoke_id, EVENT_ACK, self.on_flow_ack,
+                                 (head, project_id, invoke_id, ack, msg))
+
+    def _deliver_flow_ret(self, head, project_id, invoke_id, status_code, params):
+        """处理流程结果返回，并分派事件
+
+        :param Head head: 消息头
+        :param str project_id: 流程项目ID
+        :param int invoke_id: 流程调用ID
+        :param int status_code: 返回值。1表示正常返回，-25表示超时，其它表示错误
+        :param list params: 正常返回时的流程返回值列表
+        """
+        self._invocations.complete(invoke_id, status_code, params)
+        cache = self._flow_cache
+        if cache is not None:
+            if status_code == 1:
+                cache.complete(self._client_id, invoke_id, project_id, head, params)
+            else:
+                cache.discard(self._client_id, invoke_id)
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.flow_finished(invoke_id, perf_counter())
+            if status_code != 1:
+                metrics.error(status_code)
+        if self._flow_coalescer is not None:
+            self._flow_coalescer.returned(self._client_id, invoke_id, head, status_code, params)
+        if self._balancer is not None:
+            self._balancer.returned(self._client_id, invoke_id, status_code, perf_counter())
+        event = self._flow_ret_event(head, project_id, invoke_id, status_code, params)
+        if self._flow_tracer is None:
+            self._dispatch_keyed(invoke_id, *event)
+        else:
+            self._flow_tracer.returned(self._client_id, invoke_id, status_code, perf_counter())
+            self._dispatch_keyed(invoke_id, self._run_traced, invoke_id, EVENT_RETURN, event[0], event[1:])
+
+    def _flow_ret_event(self, head, project_id, invoke_id, status_code, params):
+        """流程结果返回所对应的事件函数与参数
+
+        :return: `(fn, *args)` 元组
+        """
+        if status_code == 1:
+            return self.on_flow_resp, head, project_id, invoke_id, params
+        if status_code == SMARTBUS_ERR_TIMEOUT:
+            return self.on_flow_timeout, head, project_id, invoke_id
+        return self.on_flow_error, head, project_id, invoke_id, status_code
+
+    def _run_traced(self, invoke_id, event, fn, args):
+        """记录流程调用事件函数开始执行的时刻，并执行事件函数"""
+        self._flow_tracer.handled(self._client_id, invoke_id, event, perf_counter())
+        return fn(*args)
+
+    def _on_pooled_data(self, head, data):
+        return self._run_pooled(self.on_data, head, data)
+
+    def _run_pooled(self, handler, head, data):
+        try:
+            return handler(head, data)
+        finally:
+            if isinstance(data, memoryview):
+                self._buffer_pool.release(data)
+
+    def _on_pooled_data_batch(self, items):
+        try:
+            return self.on_data_batch(items)
+        finally:
+            release = self._buffer_pool.release
+            for _, data in items:
+                if isinstance(data, memoryview):
+                    release(data)
+
+    def release_data(self, data):
+        """提前将接收到的数据所使用的缓冲区归还给接收缓冲区池
+
+        仅在构造时指定了 `buffer_pool` 参数时有效。
+        默认情况下，缓冲区在 :meth:`on_data` （或 :meth:`on_data_batch` ）返回后自动归还；
+        事件函数也可以在用完数据后调用这个方法立即归还。重复归还是无害的。
+
+        :param memoryview data: :meth:`on_data` 收到的数据
+        """
+        if self._buffer_pool is not None and isinstance(data, memoryview):
+            self._buffer_pool.release(data)
+
+    def on_send_fail(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data, error_code):
+        """发送队列中的数据发送失败，或者因队列溢出被丢弃
+
+        仅在构造时指定了 `outbound_queue` 参数时被调用。
+
+        参数 `cmd` ~ `data` 同 :meth:`send_data`
+
+        :param int error_code: 错误码。被丢弃的数据是 :data:`SMARTBUS_ERR_BUFF_FULL`
         """
         pass
 
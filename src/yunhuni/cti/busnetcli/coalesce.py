@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""相同流程调用的合并（single-flight）
+
+突发的大量相同调用（如重新连接后的配置刷新）中，只有第一个调用（领头调用）经过 `smartbus` ，
+其余在领头调用进行期间到达的相同调用（跟随调用）挂接到领头调用上，共享它的启动确认与结果返回。
+结果不会被缓存：领头调用结束后的相同调用，重新发起。
+
+两次调用相同，是指 `server_unit_id` 、 `process_index` 、 `project_id` 、 `flow_id` 相同，且 `params` 的规范化 JSON 相同。
+只合并有流程返回（ `mode` 为 `0` ）的调用。跟随调用的 `timeout` 参数被忽略，以领头调用的为准。
+
+在构造 :class:`Client` 时，通过 `flow_coalescer` 参数使用::
+
+    coalescer = FlowCoalescer()
+    coalescer.coalesce('ivr', 'load_config')
+    client = MyClient(..., flow_coalescer=coalescer)
+
+跟随调用：
+
+* :meth:`Client.launch_flow` 返回一个由 :func:`next_synthetic_invoke_id` 分配的 `invoke_id` ，
+  在领头调用的事件到达时，以这个 `invoke_id` 触发相应的事件函数；
+* :meth:`Client.launch_flow_async` 返回的 `Future` 随领头调用一同完成。
+
+领头调用的 `RemoteInvokeFlow` 失败时，跟随调用以启动失败结束（ :meth:`Client.on_flow_ack` 的 `head` 参数是 `None` ）。
+领头调用超过超时值（再加上 `expire_grace` ）仍无结果的，跟随调用由客户端的后台清理线程以超时结束
+（ :meth:`Client.on_flow_timeout` 的 `head` 参数是 `None` ）。
+"""
+
+from __future__ import absolute_import
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ._c.mutual import SMARTBUS_ERR_OTHER, SMARTBUS_ERR_TIMEOUT
+from .flowcache import canonical_params
+from .invocation import DEFAULT_EXPIRE_GRACE, DEFAULT_MAX_LIFETIME, next_synthetic_invoke_id
+from .utils import monotonic
+
+__all__ = ['FlowCoalescer']
+
+#: 最多暂存多少个“早到”的领头调用事件（事件回调比 `RemoteInvokeFlow` 返回 `invoke_id` 更早到达）
+DEFAULT_ORPHAN_CAPACITY = 1024
+
+
+class Flight(object):
+    """一次进行中的领头调用
+    """
+
+    __slots__ = ('key', 'project_id', 'deadline', 'invoke_key', 'followers', 'ack')
+
+    def __init__(self, key, project_id, deadline):
+        self.key = key
+        self.project_id = project_id
+        self.deadline = deadline
+        self.invoke_key = None
+        #: 跟随调用 `(client, invoke_id, future)` 列表
+        self.followers = []
+        #: 成功的启动确认 `(head, msg)`
+        self.ack = None
+
+
+class FlowCoalescer(object):
+    """线程安全的相同流程调用合并器
+
+    可以由多个客户端共用：跟随调用的事件在发起它的客户端中触发。
+
+    :param bool all_flows: 是否合并所有流程的相同调用。为假时，只合并通过 :meth:`coalesce` 登记的流程
+    :param float expire_grace: 领头调用超过超时值后，再等待多少秒仍无结果的，不再接受跟随调用，并以超时结束已有的跟随调用
+    :param int orphan_capacity: 最多暂存多少个“早到”的领头调用事件
+    """
+
+    def __init__(self, all_flows=False, expire_grace=DEFAULT_EXPIRE_GRACE, orphan_capacity=DEFAULT_ORPHAN_CAPACITY):
+        self._all_flows = bool(all_flows)
+        self._expire_grace = float(expire_grace)
+        self._orphan_capacity = int(orphan_capacity)
+        self._lock = threading.Lock()
+        self._flows = set()
+        self._flights = {}
+        self._invokes = {}
+        self._orphans = OrderedDict()
+        self._launching = 0
+        self._led = 0
+        self._coalesced = 0
+
+    def coalesce(self, project_id, flow_id):
+        """登记一个可以合并相同调用的流程
+
+        :param str project_id: 流程项目ID
+        :param str flow_id: 流程ID
+        """
+        with self._lock:
+            self._flows.add((project_id, flow_id))
+
+    def key_of(self, server_unit_id, process_index, project_id, flow_id, mode, params):
+        """求一次调用的合并键
+
+        :return: 合并键。流程没有登记、不是有流程返回的调用，或者参数不能序列化为 JSON 时，返回 `None`
+        """
+        if mode != 0 or not (self._all_flows or (project_id, flow_id) in self._flows):
+            return None
+        try:
+            return server_unit_id, process_index, project_id, flow_id, canonical_params(params)
+        except (TypeError, ValueError):
+            return None
+
+    def join(self, key, client, project_id, timeout, future=None):
+        """加入进行中的相同调用，或者成为领头调用
+
+        :param key: :meth:`key_of` 返回的合并键
+        :param Client client: 发起调用的客户端
+        :param str project_id: 流程项目ID
+        :param float timeout: 调用超时值（秒）
+        :param concurrent.futures.Future future: 成为跟随调用时，随领头调用一同完成的 `Future`
+        :return: `(flight, invoke_id)` 。 `invoke_id` 是 `None` 的，调用者是领头调用，
+            须在 :meth:`launching` 上下文中发起调用，然后调用 :meth:`launched` 或者 :meth:`abort` ；
+            否则调用者是跟随调用， `invoke_id` 是为它分配的调用ID
+        """
+        now = monotonic()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.deadline > now:
+                invoke_id = next_synthetic_invoke_id()
+                flight.followers.append((client, invoke_id, future))
+                self._coalesced += 1
+                if flight.ack is not None:
+                    # 在持有锁时分派，以保证这个跟随调用的启动确认先于结果返回
+                    client._deliver_coalesced_ack(future, flight.ack[0], project_id, invoke_id, 1, flight.ack[1])
+                return flight, invoke_id
+            deadline = now + (timeout + self._expire_grace if timeout else DEFAULT_MAX_LIFETIME)
+            flight = self._flights[key] = Flight(key, project_id, deadline)
+            self._led += 1
+            return flight, None
+
+    @contextmanager
+    def launching(self):
+        """领头调用在发起调用的 C-API 期间使用的上下文管理器
+
+        在此期间到达的、尚不能匹配的事件，会被暂存，以便随后的 :meth:`launched` 取用。
+        """
+        with self._lock:
+            self._launching += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._launching -= 1
+                if not self._launching:
+                    self._orphans.clear()
+
+    def launched(self, flight, client_id, invoke_id):
+        """领头调用发起成功。应在 :meth:`launching` 上下文中，在得到 `invoke_id` 之后立即调用
+
+        :param Flight flight: :meth:`join` 返回的调用
+        :param int client_id: 领头调用的客户端的 client id
+        :param int invoke_id: 领头调用的调用ID
+        """
+        invoke_key = (client_id, invoke_id)
+        with self._lock:
+            flight.invoke_key = invoke_key
+            self._invokes[invoke_key] = flight
+            events = self._orphans.pop(invoke_key, ())
+        for event in events:
+            event[0](client_id, invoke_id, *event[1:])
+
+    def abort(self, flight, exception):
+        """领头调用发起失败，以启动失败结束所有跟随调用
+
+        :param Flight flight: :meth:`join` 返回的调用
+        :param Exception exception: 发起调用时的异常
+        """
+        with self._lock:
+            self._end(flight)
+            followers = flight.followers
+        code = getattr(exception, 'code', SMARTBUS_ERR_OTHER)
+        for client, invoke_id, future in followers:
+            client._deliver_coalesced_ack(future, None, flight.project_id, invoke_id, code, str(exception))
+
+    def _end(self, flight):
+        # 须在持有锁时调用
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if flight.invoke_key is not None:
+            self._invokes.pop(flight.invoke_key, None)
+
+    def _find(self, client_id, invoke_id, event):
+        # 须在持有锁时调用
+        flight = self._invokes.get((client_id, invoke_id))
+        if flight is None and self._launching and self._flights:
+            self._orphans.setdefault((client_id, invoke_id), []).append(event)
+            while len(self._orphans) > self._orphan_capacity:
+                self._orphans.popitem(last=False)
+        return flight
+
+    def acked(self, client_id, invoke_id, head, ack, msg):
+        """领头调用的启动确认。转发给跟随调用
+
+        :param int client_id: 客户端的 client id
+        :param int invoke_id: 调用ID
+        :param Head head: 消息头
+        :param int ack: 状态码
+        :param str msg: 错误信息
+        """
+        with self._lock:
+            flight = self._find(client_id, invoke_id, (self.acked, head, ack, msg))
+            if flight is None:
+                return
+            if ack == 1:
+                flight.ack = (head, msg)
+            else:
+                self._end(flight)
+            followers = list(flight.followers)
+        for client, follower_invoke_id, future in followers:
+            client._deliver_coalesced_ack(future, head, flight.project_id, follower_invoke_id, ack, msg)
+
+    def returned(self, client_id, invoke_id, head, status_code, params):
+        """领头调用的结果返回。转发给跟随调用
+
+        :param int client_id: 客户端的 client id
+        :param int invoke_id: 调用ID
+        :param Head head: 消息头
+        :param int status_code: 返回值
+        :param list params: 正常返回时的流程返回值列表
+        """
+        with self._lock:
+            flight = self._find(client_id, invoke_id, (self.returned, head, status_code, params))
+            if flight is None:
+                return
+            self._end(flight)
+            followers = flight.followers
+        for client, follower_invoke_id, future in followers:
+            client._deliver_coalesced_ret(
+                future, head, flight.project_id, follower_invoke_id, status_code, list(params) if params else params
+            )
+
+    def expire(self, now=None):
+        """结束超过期限仍无结果的领头调用，以超时（ :data:`SMARTBUS_ERR_TIMEOUT` ）结束它们的跟随调用
+
+        由 :class:`Client` 的后台清理线程定期调用
+
+        :param float now: 当前时刻（ :func:`time.monotonic` ）。默认取当前时刻
+        :return: 结束的领头调用数量
+        :rtype: int
+        """
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            expired = [flight for flight in self._invokes.values() if flight.deadline <= now]
+            for flight in expired:
+                self._end(flight)
+        for flight in expired:
+            for client, invoke_id, future in flight.followers:
+                client._deliver_coalesced_ret(future, None, flight.project_id, invoke_id, SMARTBUS_ERR_TIMEOUT, None)
+        return len(expired)
+
+    def stats(self):
+        """合并器状态
+
+        :return: 包含 ``in_flight`` （进行中的领头调用数）、 ``led`` （领头调用总数）与 ``coalesced`` （跟随调用总数）的字典
+        :rtype: dict
+        """
+        with self._lock:
+            return {'in_flight': len(self._flights), 'led': self._led, 'coalesced': self._coalesced}
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""事件分派工具
+"""
+
+from __future__ import absolute_import
+
+import threading
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+
+from .utils import LoggerMixin
+
+__all__ = ['BatchDispatcher', 'KeyedExecutor', 'KeyedBatchDispatcher']
+
+#: 默认的每批次最大事件数
+DEFAULT_MAX_BATCH_SIZE = 1024
+
+#: :class:`KeyedExecutor` 默认的通道数
+DEFAULT_LANES = 4
+
+
+class BatchDispatcher(LoggerMixin):
+    """批量事件分派器
+
+    回调线程调用 :meth:`put` 将事件追加到队列；队列由空变为非空时，才向执行器提交一次排空任务。
+    排空任务每次从队列中取出至多 `max_batch_size` 个事件，作为一个列表交给 `handler` 。
+
+    这样，在突发的大量事件下，向执行器提交任务的次数大大少于事件数。
+
+    :param callable dispatch: 提交排空任务的函数，形如 ``dispatch(fn)`` ，如 :meth:`Client._dispatch`
+    :param callable handler: 批量事件处理函数，形如 ``handler(items)``
+    :param int max_batch_size: 每批次最大事件数
+    """
+
+    def __init__(self, dispatch, handler, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        self._dispatch = dispatch
+        self._handler = handler
+        self._max_batch_size = int(max_batch_size)
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, item):
+        """追加一个事件
+
+        :param item: 事件
+        """
+        self._queue.append(item)
+        if not self._scheduled:
+            with self._lock:
+                if not self._scheduled:
+                    self._scheduled = True
+                    self._dispatch(self._drain)
+
+    def _drain(self):
+        # 返回 handler 的返回值，以便执行器（如 AsyncClient 的事件循环）处理协程事件函数
+        queue = self._queue
+        popleft = queue.popleft
+        batch = []
+        result = None
+        try:
+            for _ in range(min(len(queue), self._max_batch_size)):
+                batch.append(popleft())
+            if batch:
+                result = self._handler(batch)
+        except Exception:
+            self.logger.exception('batch handler error')
+        finally:
+            with self._lock:
+                # 先复位标志再检查队列，避免与 put 中未加锁的检查发生竞争而遗漏事件
+                self._scheduled = False
+                if queue:
+                    self._scheduled = True
+                    self._dispatch(self._drain)
+        return result
+
+
+class KeyedExecutor(Executor):
+    """按键分通道的事件执行器
+
+    由 `lanes` 个单线程执行器（通道）组成。键相同的任务总是进入同一个通道，因而按提交顺序执行；
+    不同通道的任务并行执行，一个通道中执行缓慢的任务不会阻塞其它通道。
+
+    作为 :class:`Client` 构造函数的 `event_executor` 参数使用时：
+
+    * 接收数据事件以来源（ `src_unit_id` 与 `src_unit_client_id` ）为键，同一来源的数据按顺序处理；
+    * 流程调用事件以 `invoke_id` 为键，同一调用的启动确认与结果按顺序处理；
+    * 其它事件（连接、断开等）进入第一个通道。
+
+    :param int lanes: 通道数
+    """
+
+    def __init__(self, lanes=DEFAULT_LANES):
+        lanes = int(lanes)
+        if lanes < 1:
+            raise ValueError('argument "lanes" must be greater than 0')
+        self._executors = [ThreadPoolExecutor(max_workers=1) for _ in range(lanes)]
+
+    @property
+    def lanes(self):
+        """通道数"""
+        return len(self._executors)
+
+    def lane_of(self, key):
+        """键所对应的通道序号
+
+        :param key: 可哈希的键
+        :rtype: int
+        """
+        return hash(key) % len(self._executors)
+
+    def submit(self, fn, *args, **kwargs):
+        """在第一个通道中执行任务
+
+        :rtype: concurrent.futures.Future
+        """
+        return self._executors[0].submit(fn, *args, **kwargs)
+
+    def submit_keyed(self, key, fn, *args, **kwargs):
+        """在键所对应的通道中执行任务
+
+        :param key: 可哈希的键
+        :rtype: concurrent.futures.Future
+        """
+        return self._executors[hash(key) % len(self._executors)].submit(fn, *args, **kwargs)
+
+    def submit_to(self, lane, fn, *args, **kwargs):
+        """在指定的通道中执行任务
+
+        :param int lane: 通道序号
+        :rtype: concurrent.futures.Future
+        """
+        return self._executors[lane].submit(fn, *args, **kwargs)
+
+    def qsize(self):
+        """各个通道中等待执行的任务总数
+
+        :rtype: int
+        """
+        return sum(executor._work_queue.qsize() for executor in self._executors)
+
+    def shutdown(self, wait=True):
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+        if wait:
+            for executor in self._executors:
+                executor.shutdown(wait=True)
+
+
+class KeyedBatchDispatcher(object):
+    """按键分通道的批量事件分派器
+
+    :class:`KeyedExecutor` 的每个通道有一个 :class:`BatchDispatcher` ，事件按键进入对应通道的批次。
+
+    :param KeyedExecutor executor: 执行器
+    :param callable handler: 批量事件处理函数，形如 ``handler(items)``
+    :param callable key: 从事件求键的函数，形如 ``key(item)``
+    :param int max_batch_size: 每批次最大事件数
+    """
+
+    def __init__(self, executor, handler, key, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        self._lane_of = executor.lane_of
+        self._key = key
+        self._dispatchers = [
+            BatchDispatcher(partial(executor.submit_to, lane), handler, max_batch_size)
+            for lane in range(executor.lanes)
+        ]
+
+    def __len__(self):
+        return sum(len(dispatcher) for dispatcher in self._dispatchers)
+
+    def put(self, item):
+        """追加一个事件
+
+        :param item: 事件
+        """
+        self._dispatchers[self._lane_of(self._key(item))].put(item)
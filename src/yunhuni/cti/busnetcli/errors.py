@@ -69,6 +69,24 @@ class InvokeFlowIdError(Exception):
     pass
 
 
+class InvocationTableFullError(Exception):
+    """未完成的流程调用数量已经达到上限，无法发起新的调用
+    """
+    pass
+
+
+class OutboundQueueFullError(Exception):
+    """发送队列已满，无法放入新的数据
+    """
+    pass
+
+
+class RateLimitedError(Exception):
+    """超过了速率限制，且不能（或者不再）等待
+    """
+    pass
+
+
 class SmartBusError(Exception):
     """SmartBus 通信错误
     """
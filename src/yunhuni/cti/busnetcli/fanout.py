@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+
+"""多进程接收数据分发
+
+接收到的数据包（包头与包体）由回调线程直接复制到 :mod:`multiprocessing.shared_memory` 环形缓冲区中，
+由一组工作进程消费。数据包按来源分配给工作进程，同一来源的数据包总是由同一个工作进程按顺序处理。
+
+工作进程通过 :class:`WorkerContext` 发送的数据，经由另一个（反向的）环形缓冲区回到主进程，由所属的 :class:`Client` 发出。
+
+每个工作进程有一对环形缓冲区。环形缓冲区的布局：
+
+* 字节 0 ~ 7 : 写位置（只增不减的字节计数），由生产者写；
+* 字节 64 ~ 71 : 读位置，由消费者写；
+* 字节 72 ~ 79 : 消费者等待标志，消费者在阻塞等待前置 1，生产者在唤醒消费者时清零；
+* 字节 80 ~ 87 : 停止标志；
+* 字节 128 起 : 数据区。每条记录是 8 字节对齐的 ``记录长度(u32) 包体长度(u32) 包头 包体`` ，
+  包头与 :class:`PacketHeader` 的内存布局相同；包体长度为 ``0xffffffff`` 的是数据区末尾的填充记录。
+
+例如::
+
+    def handle(context, head, data):
+        result = process(bytes(data))
+        context.reply(head, head.cmd, head.cmd_type, result)
+
+    client = Client.create(client_id, client_type, host, port, fanout=FanOut(handle, workers=8))
+
+.. attention:: 该模块需要 Python 3.8 以上版本
+
+.. note::
+    使用 ``spawn`` 或 ``forkserver`` 启动方式时， `handler` 与 `initializer` 必须是可以被导入的模块级函数。
+"""
+
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import struct
+import threading
+from ctypes import addressof, c_char, memmove, sizeof
+from multiprocessing import shared_memory
+from time import sleep
+
+from ._c.mutual import PacketHeader
+from .head import HEAD_STRUCT, Head
+from .utils import LoggerMixin
+
+__all__ = ['FanOut', 'WorkerContext']
+
+#: 默认的每个工作进程的接收环形缓冲区大小（字节）
+DEFAULT_RING_SIZE = 4 << 20
+
+#: 默认的每个工作进程的回复环形缓冲区大小（字节）
+DEFAULT_REPLY_RING_SIZE = 1 << 20
+
+#: 消费者阻塞等待的最长时间（秒）。避免在极端情况下错过唤醒信号
+WAIT_TIMEOUT = 0.05
+
+_U64 = struct.Struct('<Q')
+_RECORD = struct.Struct('<II')
+
+_WRITE_POS = 0
+_READ_POS = 64
+_WAITING = 72
+_STOPPING = 80
+_DATA = 128
+
+_HEAD_SIZE = sizeof(PacketHeader)
+_PAYLOAD = _RECORD.size + _HEAD_SIZE
+_PADDING = 0xffffffff
+
+
+class _Ring(object):
+    """单生产者、单消费者的共享内存环形缓冲区
+
+    生产者一侧用锁保护，可以在多个线程中写入。
+    """
+
+    def __init__(self, shm, semaphore):
+        self.shm = shm
+        self.buf = shm.buf
+        self.capacity = (shm.size - _DATA) & ~7
+        self.semaphore = semaphore
+        self.lock = threading.Lock()
+        # 保留 ctypes 对象以便 memmove 写入；关闭共享内存前须先释放
+        self._c_buf = c_char.from_buffer(self.buf)
+        self.data_address = addressof(self._c_buf) + _DATA
+        self.dropped = 0
+
+    @classmethod
+    def create(cls, size, ctx):
+        size = max(int(size), 4096)
+        shm = shared_memory.SharedMemory(create=True, size=_DATA + size)
+        shm.buf[:_DATA] = bytes(_DATA)
+        return cls(shm, ctx.Semaphore(0))
+
+    @classmethod
+    def attach(cls, name, semaphore):
+        return cls(shared_memory.SharedMemory(name), semaphore)
+
+    def close(self, unlink=False):
+        self._c_buf = None
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def _get(self, offset):
+        return _U64.unpack_from(self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        _U64.pack_into(self.buf, offset, value)
+
+    @property
+    def used(self):
+        """已使用的字节数"""
+        return self._get(_WRITE_POS) - self._get(_READ_POS)
+
+    # ---- 生产者 ----
+
+    def _reserve(self, payload_size):
+        """预留一条记录的空间
+
+        :return: `(offset, new_write_pos)` ；空间不足时返回 `None`
+        """
+        size = (_PAYLOAD + payload_size + 7) & ~7
+        capacity = self.capacity
+        write_pos = self._get(_WRITE_POS)
+        free = capacity - (write_pos - self._get(_READ_POS))
+        offset = write_pos % capacity
+        tail = capacity - offset
+        if size > tail:
+            if tail + size > free:
+                return None
+            _RECORD.pack_into(self.buf, _DATA + offset, tail, _PADDING)
+            write_pos += tail
+            offset = 0
+        elif size > free:
+            return None
+        _RECORD.pack_into(self.buf, _DATA + offset, size, payload_size)
+        return offset, write_pos + size
+
+    def _publish(self, write_pos):
+        buf = self.buf
+        _U64.pack_into(buf, _WRITE_POS, write_pos)
+        if _U64.unpack_from(buf, _WAITING)[0]:
+            _U64.pack_into(buf, _WAITING, 0)
+            self.semaphore.release()
+
+    def put(self, head, data):
+        """写入一条记录
+
+        :param tuple head: 包头字段，同 :class:`Head`
+        :param data: 包体
+        :return: 是否写入。空间不足时丢弃，返回 `False`
+        :rtype: bool
+        """
+        size = len(data) if data else 0
+        with self.lock:
+            reserved = self._reserve(size)
+            if reserved is None:
+                self.dropped += 1
+                return False
+            offset, write_pos = reserved
+            offset += _DATA + _RECORD.size
+            HEAD_STRUCT.pack_into(self.buf, offset, *head)
+            if size:
+                offset += _HEAD_SIZE
+                self.buf[offset:offset + size] = data
+            self._publish(write_pos)
+        return True
+
+    def put_from(self, head_address, data_address, size):
+        """从 C 内存直接写入一条记录
+
+        :param int head_address: :class:`PacketHeader` 结构体的内存地址
+        :param int data_address: 包体的内存地址
+        :param int size: 包体长度
+        :rtype: bool
+        """
+        with self.lock:
+            reserved = self._reserve(size)
+            if reserved is None:
+                self.dropped += 1
+                return False
+            offset, write_pos = reserved
+            address = self.data_address + offset + _RECORD.size
+            memmove(address, head_address, _HEAD_SIZE)
+            if size:
+                memmove(address + _HEAD_SIZE, data_address, size)
+            self._publish(write_pos)
+        return True
+
+    # ---- 消费者 ----
+
+    def consume(self, handler):
+        """消费记录，直到缓冲区为空
+
+        :param callable handler: 形如 ``handler(head, data)`` ， `data` 是仅在调用期间有效的 :class:`memoryview`
+        :return: 消费的记录数
+        :rtype: int
+        """
+        buf = self.buf
+        capacity = self.capacity
+        read_pos = self._get(_READ_POS)
+        write_pos = self._get(_WRITE_POS)
+        count = 0
+        while read_pos < write_pos:
+            offset = _DATA + read_pos % capacity
+            size, payload_size = _RECORD.unpack_from(buf, offset)
+            if payload_size != _PADDING:
+                offset += _RECORD.size
+                head = Head._make(HEAD_STRUCT.unpack_from(buf, offset))
+                offset += _HEAD_SIZE
+                data = buf[offset:offset + payload_size]
+                try:
+                    handler(head, data)
+                finally:
+                    try:
+                        data.release()
+                    except BufferError:  # 处理函数仍持有从它导出的缓冲区
+                        pass
+                count += 1
+            read_pos += size
+            _U64.pack_into(buf, _READ_POS, read_pos)
+            if read_pos == write_pos:
+                write_pos = self._get(_WRITE_POS)
+        return count
+
+    def wait(self):
+        """等待新的记录
+
+        :return: 是否应当继续消费。已停止且缓冲区为空时返回 `False`
+        :rtype: bool
+        """
+        buf = self.buf
+        if _U64.unpack_from(buf, _WRITE_POS)[0] != _U64.unpack_from(buf, _READ_POS)[0]:
+            return True
+        if _U64.unpack_from(buf, _STOPPING)[0]:
+            return False
+        _U64.pack_into(buf, _WAITING, 1)
+        if _U64.unpack_from(buf, _WRITE_POS)[0] == _U64.unpack_from(buf, _READ_POS)[0]:
+            self.semaphore.acquire(timeout=WAIT_TIMEOUT)
+        _U64.pack_into(buf, _WAITING, 0)
+        return True
+
+    def stop(self):
+        self._set(_STOPPING, 1)
+        self.semaphore.release()
+
+
+class WorkerContext(LoggerMixin):
+    """工作进程的上下文，作为第一个参数传给 `handler` 与 `initializer`
+
+    :attr:`state` 是留给使用者的属性，可以在 `initializer` 中设置
+    """
+
+    def __init__(self, index, workers, reply_ring):
+        self._index = index
+        self._workers = workers
+        self._reply_ring = reply_ring
+        #: 使用者自定义的状态
+        self.state = None
+
+    @property
+    def index(self):
+        """工作进程序号"""
+        return self._index
+
+    @property
+    def workers(self):
+        """工作进程数"""
+        return self._workers
+
+    def send_data(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """经由主进程的客户端发送数据
+
+        参数同 :meth:`Client.send_data` 。
+
+        数据写入回复环形缓冲区后即返回，由主进程异步发出；发送失败时记录在主进程的日志中。
+        回复环形缓冲区满时，阻塞等待。
+        """
+        head = (cmd, cmd_type, 0, 0, 0, dst_client_type, dst_unit_id, dst_client_id, 0, len(data) if data else 0)
+        delay = 0.0001
+        while not self._reply_ring.put(head, data):
+            sleep(delay)
+            delay = min(delay * 2, 0.01)
+
+    def reply(self, head, cmd, cmd_type, data):
+        """向数据包的发送者发送数据
+
+        :param Head head: 收到的数据包的包头
+        :param int cmd: 命令
+        :param int cmd_type: 命令类型
+        :param data: 数据
+        """
+        self.send_data(cmd, cmd_type, head.src_unit_id, head.src_unit_client_id, head.src_unit_client_type, data)
+
+
+def _worker_main(index, workers, ring_args, reply_ring_args, handler, initializer):
+    ring = _Ring.attach(*ring_args)
+    reply_ring = _Ring.attach(*reply_ring_args)
+    context = WorkerContext(index, workers, reply_ring)
+    logger = context.logger
+    try:
+        if initializer is not None:
+            initializer(context)
+
+        def handle(head, data):
+            try:
+                handler(context, head, data)
+            except Exception:
+                logger.exception('handler error')
+
+        while ring.wait():
+            ring.consume(handle)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+        reply_ring.close()
+
+
+class FanOut(LoggerMixin):
+    """多进程接收数据分发器
+
+    在构造 :class:`Client` 时，通过 `fanout` 参数使用，每个客户端一个分发器。
+    指定后，接收到的数据不再触发 :meth:`Client.on_data` ，而是交给工作进程中的 `handler` 。
+
+    :param callable handler: 工作进程中的数据处理函数，形如 ``handler(context, head, data)`` 。
+        `context` 是 :class:`WorkerContext` ； `head` 是 :class:`Head` ；
+        `data` 是 :class:`memoryview` ，仅在函数返回前有效
+    :param int workers: 工作进程数。默认为 CPU 数
+    :param int ring_size: 每个工作进程的接收环形缓冲区大小（字节）。缓冲区满时，新收到的数据包被丢弃
+    :param int reply_ring_size: 每个工作进程的回复环形缓冲区大小（字节）
+    :param callable initializer: 工作进程启动时执行的函数，形如 ``initializer(context)``
+    :param mp_context: :mod:`multiprocessing` 上下文。默认为 :func:`multiprocessing.get_context` 的返回值
+    """
+
+    def __init__(self, handler, workers=None, ring_size=DEFAULT_RING_SIZE, reply_ring_size=DEFAULT_REPLY_RING_SIZE,
+                 initializer=None, mp_context=None):
+        self._handler = handler
+        self._workers = int(workers or os.cpu_count() or 1)
+        self._ring_size = ring_size
+        self._reply_ring_size = reply_ring_size
+        self._initializer = initializer
+        self._ctx = mp_context or multiprocessing.get_context()
+        self._send_data = None
+        self._rings = []
+        self._reply_rings = []
+        self._processes = []
+        self._reply_threads = []
+        self._started = False
+
+    @property
+    def workers(self):
+        """工作进程数"""
+        return self._workers
+
+    def bind(self, send_data):
+        """绑定发送函数，并启动工作进程。由 :class:`Client` 在构造时调用
+
+        :param callable send_data: 发送函数，形如 :meth:`Client.send_data`
+        """
+        if self._send_data is not None:
+            raise RuntimeError('FanOut already bound')
+        self._send_data = send_data
+        self.start()
+
+    def start(self):
+        """启动工作进程"""
+        if self._started:
+            return
+        self._started = True
+        for index in range(self._workers):
+            ring = _Ring.create(self._ring_size, self._ctx)
+            reply_ring = _Ring.create(self._reply_ring_size, self._ctx)
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(index, self._workers, (ring.shm.name, ring.semaphore),
+                      (reply_ring.shm.name, reply_ring.semaphore), self._handler, self._initializer),
+                name='{}-{}'.format(self.__class__.__name__, index)
+            )
+            process.daemon = True
+            process.start()
+            thread = threading.Thread(target=self._reply_loop, args=(reply_ring,),
+                                      name='{}-reply-{}'.format(self.__class__.__name__, index))
+            thread.daemon = True
+            thread.start()
+            self._rings.append(ring)
+            self._reply_rings.append(reply_ring)
+            self._processes.append(process)
+            self._reply_threads.append(thread)
+
+    def _reply_loop(self, ring):
+        send_data = self._send_data
+
+        def send(head, data):
+            try:
+                send_data(head[0], head[1], head[6], head[7], head[5], data.tobytes() if data else None)
+            except Exception:
+                self.logger.exception('send reply')
+
+        while ring.wait():
+            ring.consume(send)
+
+    def stop(self, timeout=None):
+        """停止工作进程
+
+        工作进程处理完各自缓冲区中剩余的数据包后退出。
+
+        :param float timeout: 等待每个工作进程退出的最长时间（秒）
+        """
+        if not self._started:
+            return
+        self._started = False
+        for ring in self._rings:
+            ring.stop()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                self.logger.warning('terminate %s', process.name)
+                process.terminate()
+                process.join()
+        for ring in self._reply_rings:
+            ring.stop()
+        for thread in self._reply_threads:
+            thread.join(timeout)
+        for ring in self._rings + self._reply_rings:
+            ring.close(unlink=True)
+        del self._rings[:], self._reply_rings[:], self._processes[:], self._reply_threads[:]
+
+    def stats(self):
+        """各个工作进程的缓冲区状态
+
+        :return: 每个工作进程一个字典：
+
+            * ``used`` : 接收缓冲区已使用的字节数
+            * ``dropped`` : 因接收缓冲区满而丢弃的数据包数量
+            * ``reply_used`` : 回复缓冲区已使用的字节数
+            * ``alive`` : 工作进程是否在运行
+
+        :rtype: list
+        """
+        return [
+            {
+                'used': ring.used,
+                'dropped': ring.dropped,
+                'reply_used': reply_ring.used,
+                'alive': process.is_alive(),
+            }
+            for ring, reply_ring, process in zip(self._rings, self._reply_rings, self._processes)
+        ]
+
+    def _ring_of(self, unit_id, client_id):
+        return self._rings[(unit_id * 257 + client_id) % self._workers]
+
+    def put(self, head, data):
+        """分发一个数据包
+
+        :param Head head: 包头
+        :param data: 包体
+        :return: 是否写入。接收缓冲区满时丢弃，返回 `False`
+        :rtype: bool
+        """
+        return self._ring_of(head[3], head[4]).put(head, data)
+
+    def put_from(self, head_address, data_address, size):
+        """从 C 内存直接分发一个数据包
+
+        :param int head_address: :class:`PacketHeader` 结构体的内存地址
+        :param int data_address: 包体的内存地址
+        :param int size: 包体长度
+        :rtype: bool
+        """
+        header = PacketHeader.from_address(head_address)
+        return self._ring_of(ord(header.src_unit_id), ord(header.src_unit_client_id)).put_from(
+            head_address, data_address, size)
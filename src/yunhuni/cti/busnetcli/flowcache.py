@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""流程调用结果缓存
+
+对于结果只取决于输入参数的流程（如路由表、IVR 配置查询），
+可以将其结果缓存一段时间，在此期间的相同调用不再经过 `smartbus` 。
+
+缓存键是 `(server_unit_id, project_id, flow_id, params)` ，其中 `params` 按规范化的 JSON 比较。
+只有通过 :meth:`FlowCache.cacheable` 登记的流程、有流程返回（ `mode` 为 `0` ）且正常返回的结果才会被缓存。
+
+在构造 :class:`Client` 时，通过 `flow_cache` 参数使用::
+
+    cache = FlowCache(max_entries=4096)
+    cache.cacheable('ivr', 'route_lookup', ttl=30)
+    client = MyClient(..., flow_cache=cache)
+
+缓存命中时：
+
+* :meth:`Client.launch_flow` 返回一个新的 `invoke_id` ，并依次触发 :meth:`Client.on_flow_ack` 与 :meth:`Client.on_flow_resp` ，
+  其 `head` 参数是被缓存的结果的消息头；
+* :meth:`Client.launch_flow_async` 返回已经完成的 `Future` 。
+
+缓存命中时的 `invoke_id` 由 :func:`next_synthetic_invoke_id` 分配，不会与 C 库分配的 `invoke_id` 重复。
+"""
+
+from __future__ import absolute_import
+
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .utils import monotonic
+
+__all__ = ['FlowCache']
+
+#: 默认的最大缓存条目数
+DEFAULT_MAX_ENTRIES = 1024
+
+#: 默认的缓存有效期（秒）
+DEFAULT_TTL = 60.0
+
+#: 最多暂存多少个“早到”的结果（结果回调比 `RemoteInvokeFlow` 返回 `invoke_id` 更早到达）
+DEFAULT_ORPHAN_CAPACITY = 1024
+
+#: 最多跟踪多少个未完成的可缓存调用
+DEFAULT_MAX_PENDING = 65536
+
+
+def canonical_params(params):
+    """流程输入参数的规范化 JSON 表示，用于比较两次调用的参数是否相同
+
+    :param list params: 流程输入参数
+    :rtype: str
+    :raises TypeError: 参数不能序列化为 JSON
+    """
+    return json.dumps(params, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+class FlowCache(object):
+    """线程安全的 TTL/LRU 流程调用结果缓存
+
+    可以由多个客户端共用。
+
+    :param int max_entries: 最大缓存条目数。超过时，淘汰最久未使用的条目
+    :param float default_ttl: :meth:`cacheable` 没有指定有效期时的默认有效期（秒）
+    :param int orphan_capacity: 最多暂存多少个“早到”的结果
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, default_ttl=DEFAULT_TTL,
+                 orphan_capacity=DEFAULT_ORPHAN_CAPACITY):
+        self._max_entries = int(max_entries)
+        self._default_ttl = float(default_ttl)
+        self._orphan_capacity = int(orphan_capacity)
+        self._lock = threading.Lock()
+        self._flows = {}
+        self._projects = {}
+        self._entries = OrderedDict()
+        self._pending = OrderedDict()
+        self._orphans = OrderedDict()
+        self._launching = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def max_entries(self):
+        """最大缓存条目数"""
+        return self._max_entries
+
+    def cacheable(self, project_id, flow_id, ttl=None):
+        """登记一个可以缓存结果的流程
+
+        :param str project_id: 流程项目ID
+        :param str flow_id: 流程ID
+        :param float ttl: 结果的有效期（秒）。默认为构造时的 `default_ttl`
+        """
+        ttl = self._default_ttl if ttl is None else float(ttl)
+        with self._lock:
+            if (project_id, flow_id) not in self._flows:
+                self._projects[project_id] = self._projects.get(project_id, 0) + 1
+            self._flows[(project_id, flow_id)] = ttl
+
+    def uncacheable(self, project_id, flow_id):
+        """取消登记，并清除该流程已缓存的结果
+
+        :param str project_id: 流程项目ID
+        :param str flow_id: 流程ID
+        """
+        with self._lock:
+            if self._flows.pop((project_id, flow_id), None) is not None:
+                n = self._projects.pop(project_id) - 1
+                if n:
+                    self._projects[project_id] = n
+        self.invalidate(project_id, flow_id)
+
+    def invalidate(self, project_id=None, flow_id=None):
+        """清除缓存的结果
+
+        :param str project_id: 只清除这个流程项目的结果。默认为 `None` ：全部项目
+        :param str flow_id: 只清除这个流程的结果。默认为 `None` ：全部流程
+        :return: 清除的条目数
+        :rtype: int
+        """
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (project_id is None or key[1] == project_id) and (flow_id is None or key[2] == flow_id)
+            ]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def key_of(self, server_unit_id, project_id, flow_id, mode, params):
+        """求一次调用的缓存键
+
+        :return: 缓存键。流程没有登记、不是有流程返回的调用，或者参数不能序列化为 JSON 时，返回 `None`
+        """
+        if mode != 0 or (project_id, flow_id) not in self._flows:
+            return None
+        try:
+            return server_unit_id, project_id, flow_id, canonical_params(params)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key):
+        """查找缓存
+
+        :param key: :meth:`key_of` 返回的缓存键
+        :return: 命中时返回 `(head, params)` ，否则返回 `None` 。 `params` 是副本，调用者可以修改
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    # 移到末尾（最近使用）。Python 2 的 OrderedDict 没有 move_to_end
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    self._hits += 1
+                    return entry[1], list(entry[2])
+                del self._entries[key]
+                self._expirations += 1
+            self._misses += 1
+        return None
+
+    def put(self, key, head, params):
+        """放入缓存
+
+        :param key: :meth:`key_of` 返回的缓存键
+        :param Head head: 流程结果返回的消息头
+        :param list params: 流程返回值列表
+        """
+        with self._lock:
+            self._put(key, head, params)
+
+    def _put(self, key, head, params):
+        # 须在持有锁时调用
+        ttl = self._flows.get((key[1], key[2]))
+        if ttl is None:
+            return  # 在调用期间取消了登记
+        self._entries.pop(key, None)
+        self._entries[key] = (monotonic() + ttl, head, tuple(params or ()))
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    @contextmanager
+    def launching(self):
+        """在发起可缓存调用的 C-API 期间使用的上下文管理器
+
+        在此期间到达的、尚不能匹配的结果，会被暂存，以便随后的 :meth:`launched` 取用。
+        """
+        with self._lock:
+            self._launching += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._launching -= 1
+                if not self._launching:
+                    self._orphans.clear()
+
+    def launched(self, client_id, invoke_id, key):
+        """登记一个未完成的可缓存调用。应在 :meth:`launching` 上下文中，在得到 `invoke_id` 之后立即调用
+
+        :param int client_id: 发起调用的客户端的 client id
+        :param int invoke_id: 调用ID
+        :param key: :meth:`key_of` 返回的缓存键
+        """
+        with self._lock:
+            orphan = self._orphans.pop((client_id, invoke_id), None)
+            if orphan is not None:
+                self._put(key, *orphan)
+                return
+            self._pending[(client_id, invoke_id)] = key
+            if len(self._pending) > DEFAULT_MAX_PENDING:
+                self._pending.popitem(last=False)
+
+    def complete(self, client_id, invoke_id, project_id, head, params):
+        """流程正常返回。是可缓存调用的，放入缓存
+
+        :param int client_id: 发起调用的客户端的 client id
+        :param int invoke_id: 调用ID
+        :param str project_id: 流程项目ID
+        :param Head head: 消息头
+        :param list params: 流程返回值列表
+        """
+        with self._lock:
+            key = self._pending.pop((client_id, invoke_id), None)
+            if key is not None:
+                self._put(key, head, params)
+            elif self._launching and project_id in self._projects:
+                self._orphans[(client_id, invoke_id)] = (head, params)
+                while len(self._orphans) > self._orphan_capacity:
+                    self._orphans.popitem(last=False)
+
+    def discard(self, client_id, invoke_id):
+        """调用失败，不再跟踪
+
+        :param int client_id: 发起调用的客户端的 client id
+        :param int invoke_id: 调用ID
+        """
+        if self._pending:
+            with self._lock:
+                self._pending.pop((client_id, invoke_id), None)
+
+    def stats(self):
+        """缓存状态
+
+        :return: 包含 ``size`` 、 ``max_entries`` 、 ``hits`` 、 ``misses`` 、
+            ``evictions`` （因超过条目数上限被淘汰）、 ``expirations`` （因过期被清除）与 ``pending`` （未完成的可缓存调用）的字典
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self._max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'pending': len(self._pending),
+            }
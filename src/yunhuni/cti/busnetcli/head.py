@@ -2,42 +2,76 @@
 
 from __future__ import absolute_import
 
+import struct
+from ctypes import sizeof, c_long
+from operator import itemgetter
+
+from ._c.mutual import PacketHeader
+
 __all__ = ['Head']
 
+#: 与 :class:`PacketHeader` 内存布局一致的 :class:`struct.Struct` 。
+#: 跳过 `head_flag` 与 `reserved` 字段。 `long` 的长度随平台而不同。
+HEAD_STRUCT = struct.Struct('=2xbbBBBBBB2x' + {4: 'i', 8: 'q'}[sizeof(c_long)] * 2)
+
+assert HEAD_STRUCT.size == sizeof(PacketHeader)
+
+_unpack_from = HEAD_STRUCT.unpack_from
+
+
+def _make_head(cls, values):
+    """:meth:`Head.__reduce__` 的重建函数。
+
+    Python 2 的 :mod:`pickle` 不能序列化绑定的类方法，因此不直接使用 :meth:`Head._make`
+    """
+    return tuple.__new__(cls, values)
 
-class Head:
+
+class Head(tuple):
     """Smartbus通信包头信息
 
     每当接收到数据时，所触发的事件中，都包含该类型的参数，记录了一些数据包的相关信息
 
-    对应 `SMARTBUS_PACKET_HEAD` 结构体的 :mod:`ctypes` 数据类型 :class:`PacketHeader` 的再次封装
+    对应 `SMARTBUS_PACKET_HEAD` 结构体的 :mod:`ctypes` 数据类型 :class:`PacketHeader` 的再次封装。
+
+    这是一个不可变的 :class:`tuple` ，在构造时一次性地从结构体中复制全部字段，不保留结构体指针。
     """
 
-    def __init__(self, ptr):
+    __slots__ = ()
+
+    _fields = (
+        'cmd', 'cmd_type',
+        'src_unit_client_type', 'src_unit_id', 'src_unit_client_id',
+        'dst_unit_client_type', 'dst_unit_id', 'dst_unit_client_id',
+        'packet_size', 'data_length',
+    )
+
+    def __new__(cls, ptr):
         """
         :param smartbus._c.mutual.PPacketHeader ptr: 结构体指针
         """
-        self._prt = ptr
-        self._cmd = 0
-        self._cmd_type = 0
-        self._src_unit_client_type = 0
-        self._src_unit_id = 0
-        self._src_unit_clientId = 0
-        self._dst_unit_client_type = 0
-        self._dst_unit_id = 0
-        self._dst_unit_client_id = 0
-        self._packet_size = 0
-        self._data_length = 0
-        self._cmd = ptr.contents.cmd
-        self._cmd_type = ptr.contents.cmdtype
-        self._src_unit_client_type = ord(ptr.contents.src_unit_client_type)
-        self._src_unit_id = ord(ptr.contents.src_unit_id)
-        self._src_unit_clientId = ord(ptr.contents.src_unit_client_id)
-        self._dst_unit_client_type = ord(ptr.contents.dest_unit_client_type)
-        self._dst_unit_id = ord(ptr.contents.dest_unit_id)
-        self._dst_unit_client_id = ord(ptr.contents.dest_unit_client_id)
-        self._packet_size = ptr.contents.packet_size
-        self._data_length = ptr.contents.datalen
+        return tuple.__new__(cls, _unpack_from(ptr.contents))
+
+    @classmethod
+    def _make(cls, iterable):
+        """从字段值序列建立实例
+
+        :param iterable: 按 :attr:`_fields` 顺序排列的字段值
+        :rtype: Head
+        """
+        return tuple.__new__(cls, iterable)
+
+    @classmethod
+    def from_address(cls, address):
+        """从结构体的内存地址建立实例
+
+        :param int address: :class:`PacketHeader` 结构体的内存地址
+        :rtype: Head
+        """
+        return tuple.__new__(cls, _unpack_from(PacketHeader.from_address(address)))
+
+    def __reduce__(self):
+        return _make_head, (self.__class__, tuple(self))
 
     def __repr__(self):
         s = '<%s.%s object at %s. ' + \
@@ -51,82 +85,42 @@ class Head:
             'dst_unit_client_id=%s, ' + \
             'packet_size=%s, ' + \
             'data_length=%s>'
-        return s % (
+        return s % ((
             self.__class__.__module__,
             self.__class__.__name__,
             hex(id(self)),
-            self._cmd,
-            self._cmd_type,
-            self._src_unit_client_type,
-            self._src_unit_id,
-            self._src_unit_clientId,
-            self._dst_unit_client_type,
-            self._dst_unit_id,
-            self._dst_unit_client_id,
-            self._packet_size,
-            self._data_length
-        )
-
-    @property
-    def cmd(self):
-        """ 命令
+        ) + tuple(self))
+
+    cmd = property(itemgetter(0), doc=""" 命令
 
         一条 SmartBus 数据的命令关键字
-        """
-        return self._cmd
+        """)
 
-    @property
-    def cmd_type(self):
-        """ 命令类型
+    cmd_type = property(itemgetter(1), doc=""" 命令类型
 
         一条 SmartBus 数据的命令类型
-        """
-        return self._cmd_type
+        """)
 
-    @property
-    def src_unit_client_type(self):
-        """发送者客户端类型
-        """
-        return self._src_unit_client_type
+    src_unit_client_type = property(itemgetter(2), doc="""发送者客户端类型
+        """)
 
-    @property
-    def src_unit_id(self):
-        """ 发送者节点ID
-        """
-        return self._src_unit_id
+    src_unit_id = property(itemgetter(3), doc=""" 发送者节点ID
+        """)
 
-    @property
-    def src_unit_client_id(self):
-        """ 发送者客户端ID
-        """
-        return self._src_unit_clientId
+    src_unit_client_id = property(itemgetter(4), doc=""" 发送者客户端ID
+        """)
 
-    @property
-    def dst_unit_client_type(self):
-        """ 接收者客户端类型
-        """
-        return self._dst_unit_client_type
+    dst_unit_client_type = property(itemgetter(5), doc=""" 接收者客户端类型
+        """)
 
-    @property
-    def dst_unit_id(self):
-        """ 接收者节点ID
-        """
-        return self._dst_unit_id
+    dst_unit_id = property(itemgetter(6), doc=""" 接收者节点ID
+        """)
 
-    @property
-    def dst_unit_client_id(self):
-        """ 接收者客户端ID
-        """
-        return self._dst_unit_client_id
+    dst_unit_client_id = property(itemgetter(7), doc=""" 接收者客户端ID
+        """)
 
-    @property
-    def packet_size(self):
-        """ 包长度
-        """
-        return self._packet_size
+    packet_size = property(itemgetter(8), doc=""" 包长度
+        """)
 
-    @property
-    def data_length(self):
-        """ 正文数据长度
-        """
-        return self._data_length
+    data_length = property(itemgetter(9), doc=""" 正文数据长度
+        """)
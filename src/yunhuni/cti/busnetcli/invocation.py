@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""流程调用（invoke_id）关联表
+
+:meth:`Client.launch_flow` 只返回 `invoke_id` ，调用结果随后经由 C 库的
+``flow-ack`` / ``flow-ret`` 回调函数返回。
+本模块提供线程安全、有容量上限的关联表，用 `invoke_id` 将回调结果与
+:class:`concurrent.futures.Future` 对象对应起来。
+"""
+
+from __future__ import absolute_import
+
+import heapq
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import count
+
+from ._c.mutual import SMARTBUS_ERR_TIMEOUT
+from .errors import SmartBusError, InvocationTableFullError, check, error_code_message
+from .utils import monotonic
+
+__all__ = ['Invocation', 'InvocationTable', 'SYNTHETIC_INVOKE_ID_BASE', 'next_synthetic_invoke_id']
+
+#: 默认的最大未完成调用数
+DEFAULT_MAX_PENDING = 65536
+
+#: 在调用超时值之外，再额外等待多少秒，仍未收到结果的，视为超时并从表中清除
+DEFAULT_EXPIRE_GRACE = 5.0
+
+#: 没有超时值（或者超时值为0）的调用，最多在表中保留多少秒
+DEFAULT_MAX_LIFETIME = 300.0
+
+#: 最多暂存多少个“早到”的结果（结果回调比 `RemoteInvokeFlow` 返回 `invoke_id` 更早到达）
+DEFAULT_ORPHAN_CAPACITY = 1024
+
+#: 不经过 `smartbus` 完成的调用（如缓存命中、合并到进行中的相同调用）所分配的 `invoke_id` 的起始值。
+#: C 库的 `invoke_id` 是 32 位整数，总是小于这个值
+SYNTHETIC_INVOKE_ID_BASE = 1 << 32
+
+_synthetic_invoke_ids = count(SYNTHETIC_INVOKE_ID_BASE)
+
+# 暂存的“早到”的成功启动确认。无流程返回的调用以它完成；有流程返回的调用忽略它，继续等待结果
+_ACKED = (None, None)
+
+
+def next_synthetic_invoke_id():
+    """分配一个不经过 `smartbus` 完成的调用所使用的 `invoke_id` 。在进程内唯一
+
+    :rtype: int
+    """
+    return next(_synthetic_invoke_ids)
+
+
+class Invocation(object):
+    """一次流程调用的记录
+    """
+
+    __slots__ = ('invoke_id', 'future', 'mode', 'deadline')
+
+    def __init__(self, invoke_id, future, mode, deadline):
+        self.invoke_id = invoke_id
+        self.future = future
+        self.mode = mode
+        self.deadline = deadline
+
+
+def _settle(future, result=None, exception=None):
+    if not future.set_running_or_notify_cancel():
+        return  # 已被调用者取消
+    if exception is None:
+        future.set_result(result)
+    else:
+        future.set_exception(exception)
+
+
+class InvocationTable(object):
+    """线程安全、有容量上限的 `invoke_id` 关联表
+
+    :param int max_pending: 最大未完成调用数。超过这个数量时， :meth:`launching` 抛出 :exc:`InvocationTableFullError`
+    :param float expire_grace: 超过调用超时值后，再等待多少秒仍无结果的，以超时错误结束
+    :param int orphan_capacity: 最多暂存多少个“早到”的结果
+
+    .. note::
+        :class:`concurrent.futures.Future` 在收到结果的线程中完成，即 C 库的回调线程。
+        通过 :meth:`concurrent.futures.Future.add_done_callback` 添加的回调函数也在这个线程中执行，不应阻塞。
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, expire_grace=DEFAULT_EXPIRE_GRACE,
+                 orphan_capacity=DEFAULT_ORPHAN_CAPACITY):
+        self._max_pending = int(max_pending)
+        self._expire_grace = float(expire_grace)
+        self._orphan_capacity = int(orphan_capacity)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._deadlines = []
+        self._orphans = OrderedDict()
+        self._launching = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def max_pending(self):
+        """最大未完成调用数"""
+        return self._max_pending
+
+    @contextmanager
+    def launching(self):
+        """在发起调用的 C-API 期间使用的上下文管理器
+
+        在此期间到达的、尚不能匹配的结果，会被暂存，以便随后的 :meth:`add` 取用。
+
+        :raises InvocationTableFullError: 未完成调用数已经达到上限
+        """
+        with self._lock:
+            if len(self._pending) + self._launching >= self._max_pending:
+                raise InvocationTableFullError(
+                    'Too many pending flow invocations ({})'.format(self._max_pending))
+            self._launching += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._launching -= 1
+                if not self._launching:
+                    self._orphans.clear()
+
+    def add(self, invoke_id, future, mode, timeout):
+        """登记一个调用
+
+        应在 :meth:`launching` 上下文中，在得到 `invoke_id` 之后立即调用。
+
+        :param int invoke_id: 调用ID
+        :param concurrent.futures.Future future: 用于返回调用结果的 `Future`
+        :param int mode: 调用模式：0 有流程返回、1 无流程返回
+        :param float timeout: 有流程返回时的等待超时值（秒）
+        """
+        now = monotonic()
+        if timeout:
+            deadline = now + timeout + self._expire_grace
+        else:
+            deadline = now + DEFAULT_MAX_LIFETIME
+        expired = []
+        with self._lock:
+            orphan = self._orphans.pop(invoke_id, None)
+            if orphan is _ACKED and mode == 0:
+                orphan = None
+            if orphan is None:
+                inv = Invocation(invoke_id, future, mode, deadline)
+                self._pending[invoke_id] = inv
+                heapq.heappush(self._deadlines, (deadline, invoke_id, inv))
+            expired = self._pop_expired(now)
+        if orphan is not None:
+            _settle(future, *orphan)
+        for inv in expired:
+            _settle(inv.future, exception=check(SMARTBUS_ERR_TIMEOUT, False))
+
+    def ack(self, invoke_id, status_code, msg=None):
+        """流程启动确认
+
+        :param int invoke_id: 调用ID
+        :param int status_code: 状态码. 1表示正确.
+        :param str msg: 错误信息
+        """
+        if status_code == 1:
+            with self._lock:
+                inv = self._pending.get(invoke_id)
+                if inv is None:
+                    if self._launching:
+                        # 不覆盖已经暂存的结果返回
+                        self._orphans.setdefault(invoke_id, _ACKED)
+                        self._trim_orphans()
+                    return
+                if inv.mode == 0:
+                    return
+                del self._pending[invoke_id]
+            _settle(inv.future)  # 无流程返回的调用，在启动确认后即完成
+        else:
+            self._finish(invoke_id, (None, SmartBusError(
+                status_code, msg or error_code_message.get(status_code, 'UNDEFINED_ERROR'))))
+
+    def complete(self, invoke_id, status_code, params=None):
+        """流程结果返回
+
+        :param int invoke_id: 调用ID
+        :param int status_code: 返回值。1表示正常返回，-25表示超时，其它表示错误
+        :param list params: 流程返回值
+        """
+        if status_code == 1:
+            self._finish(invoke_id, (params, None))
+        else:
+            self._finish(invoke_id, (None, check(status_code, False)))
+
+    def _finish(self, invoke_id, outcome):
+        with self._lock:
+            inv = self._pending.pop(invoke_id, None)
+            if inv is None:
+                if self._launching:
+                    self._orphans[invoke_id] = outcome
+                    self._trim_orphans()
+                return
+        _settle(inv.future, *outcome)
+
+    def _trim_orphans(self):
+        # 须在持有锁时调用
+        while len(self._orphans) > self._orphan_capacity:
+            self._orphans.popitem(last=False)
+
+    def _pop_expired(self, now):
+        # 须在持有锁时调用
+        expired = []
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] < now:
+            _, invoke_id, inv = heapq.heappop(deadlines)
+            if self._pending.get(invoke_id) is inv:
+                del self._pending[invoke_id]
+                expired.append(inv)
+        if len(deadlines) > 2 * len(self._pending) + 64:
+            # 已完成的调用仍留在堆中，定期清理
+            self._deadlines = [item for item in deadlines if self._pending.get(item[1]) is item[2]]
+            heapq.heapify(self._deadlines)
+        return expired
+
+    def expire(self):
+        """清除已过期的调用，以超时错误结束它们的 `Future`
+
+        :return: 清除的调用数量
+        :rtype: int
+        """
+        with self._lock:
+            expired = self._pop_expired(monotonic())
+        for inv in expired:
+            _settle(inv.future, exception=check(SMARTBUS_ERR_TIMEOUT, False))
+        return len(expired)
+
+    def cancel_all(self, exception):
+        """以指定的异常结束所有未完成的调用
+
+        :param Exception exception: 异常
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._deadlines = []
+        for inv in pending:
+            _settle(inv.future, exception=exception)
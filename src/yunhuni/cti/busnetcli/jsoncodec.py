@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""流程参数与流程返回值的 JSON 编解码
+
+流程调用的输入参数与返回值都是 JSON 数组，在 `smartbus` 上以 `cp936` 编码传输。
+:class:`JsonCodec` 直接在 Python 对象与目标编码的 :class:`bytes` 之间转换：
+
+* 安装了 `orjson <https://pypi.org/project/orjson/>`_ 或 `ujson <https://pypi.org/project/ujson/>`_ 的，
+  优先使用它们（可通过 ``pip install yunhuni.cti.busnetcli[fastjson]`` 安装 `orjson` ），否则使用标准库 :mod:`json` ；
+* 只含 ASCII 字符的 JSON（最常见的情况），不经过 `str` 的编解码，直接交给 JSON 库；
+* 不能以目标编码表示的字符，以 ``\\uXXXX`` 转义。
+
+在构造 :class:`Client` 时，可以通过 `json_codec` 参数指定编解码器。
+"""
+
+from __future__ import absolute_import
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+__all__ = ['JsonCodec', 'default_codec', 'available_backends', 'MAX_FLOW_PARAMS_SIZE']
+
+#: 流程输入参数 JSON 的最大字节数
+MAX_FLOW_PARAMS_SIZE = 32 * 1024
+
+#: `smartbus` 上 JSON 文本的编码
+DEFAULT_ENCODING = 'cp936'
+
+_WHITESPACES = b'\x00 \t\r\n'
+
+if hasattr(str, 'isascii'):  # Python 3.7+
+    def _isascii(s):
+        return s.isascii()
+else:
+    def _isascii(s):
+        try:
+            s.decode('ascii') if isinstance(s, bytes) else s.encode('ascii')
+        except UnicodeError:
+            return False
+        return True
+
+
+def available_backends():
+    """已经安装的 JSON 库，按优先顺序排列
+
+    :return: ``'orjson'`` 、 ``'ujson'`` 与 ``'json'`` 中已经安装的
+    :rtype: list
+    """
+    return [name for name, module in (('orjson', orjson), ('ujson', ujson), ('json', json)) if module is not None]
+
+
+class JsonCodec(object):
+    """流程参数与返回值的 JSON 编解码器
+
+    :param str backend: JSON 库： ``'orjson'`` 、 ``'ujson'`` 或 ``'json'`` 。
+        默认为 `None` ：使用 :func:`available_backends` 的第一个
+    :param str encoding: JSON 文本的编码。默认为 ``'cp936'``
+    :raises ValueError: 指定的 JSON 库没有安装
+    """
+
+    def __init__(self, backend=None, encoding=DEFAULT_ENCODING):
+        if backend is None:
+            backend = available_backends()[0]
+        elif backend not in available_backends():
+            raise ValueError('JSON backend {!r} is not available'.format(backend))
+        self._backend = backend
+        self._encoding = encoding
+        self._utf8 = encoding.replace('_', '-').lower() in ('utf-8', 'utf8')
+        if backend == 'orjson':
+            self._dumps = orjson.dumps
+            self._loads = orjson.loads
+        elif backend == 'ujson':
+            self._dumps = lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+            self._loads = ujson.loads
+        else:
+            self._dumps = lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+            self._loads = json.loads
+
+    def __repr__(self):
+        return '<{} backend={} encoding={}>'.format(self.__class__.__name__, self._backend, self._encoding)
+
+    @property
+    def backend(self):
+        """使用的 JSON 库"""
+        return self._backend
+
+    @property
+    def encoding(self):
+        """JSON 文本的编码"""
+        return self._encoding
+
+    def encode(self, obj):
+        """将对象编码为紧凑的 JSON
+
+        :param obj: 可以序列化为 JSON 的对象
+        :return: 目标编码的 JSON
+        :rtype: bytes
+        :raises TypeError: 对象不能序列化为 JSON
+        """
+        data = self._dumps(obj)
+        if isinstance(data, bytes):  # orjson: UTF-8
+            if self._utf8 or _isascii(data):
+                return data
+            data = data.decode('utf-8')
+        elif _isascii(data):
+            return data.encode('ascii')
+        try:
+            return data.encode(self._encoding)
+        except UnicodeEncodeError:
+            return json.dumps(obj, separators=(',', ':')).encode('ascii')
+
+    def decode(self, data):
+        """解码 JSON
+
+        :param data: 目标编码的 JSON 。也可以是 `str`
+        :type data: bytes | str
+        :return: 解码得到的对象。 `data` 为空（或者只有空白字符）的，返回 `[]`
+        :raises ValueError: 不是合法的 JSON
+        """
+        if isinstance(data, bytes):
+            data = data.strip(_WHITESPACES)
+            if not data:
+                return []
+            if not (self._utf8 or _isascii(data)):
+                data = data.decode(self._encoding)
+        else:
+            data = data.strip()
+            if not data:
+                return []
+        return self._loads(data)
+
+
+#: 默认的编解码器
+default_codec = JsonCodec()
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+"""按 `(cmd, cmd_type)` 登记的定长二进制消息编解码
+
+应用层的数据包通常是由 `(cmd, cmd_type)` 区分的定长二进制结构。
+:class:`MessageRegistry` 将预先编译的 :class:`struct.Struct` 格式（通过 :func:`struct_message` 定义的消息类型），
+或者 :class:`ctypes.Structure` 布局，绑定到 `(cmd, cmd_type)` ::
+
+    registry = MessageRegistry()
+    AgentState = registry.define('AgentState', 10, 1, '<HBi', ('agent_id', 'state', 'since'))
+    registry.register(CallInfo, 10, 2)   # CallInfo 是 ctypes.Structure 的子类
+    client = MyClient(..., message_registry=registry)
+
+    client.send_message(AgentState(1001, 2, 0), dst_unit_id, dst_client_id, dst_client_type)
+
+在构造 :class:`Client` 时通过 `message_registry` 参数使用，此后：
+
+* :meth:`Client.send_data` 、 :meth:`Client.broadcast` 等的 `data` 参数可以是消息对象；
+* 接收到的、登记了类型的数据包，在接收回调的线程中解码一次，以消息对象（而不是 :class:`bytes` ）的形式交给
+  :meth:`Client.on_data` 、 :meth:`Client.on_data_batch` 或者 :meth:`Client.route` 登记的处理函数。
+  使用接收缓冲区池的，缓冲区在解码后立即归还。解码失败的数据包被记录到日志，然后丢弃。
+
+一个数据包中连续存放多条记录的，可以用 :meth:`StructMessage.unpack_many` 解码为消息列表，
+或者用 :meth:`StructMessage.unpack_columns` 按字段解码为 :class:`array.array` 。
+"""
+
+from __future__ import absolute_import
+
+import re
+import struct
+import threading
+from array import array
+from ctypes import Structure
+from operator import attrgetter
+
+__all__ = ['StructMessage', 'struct_message', 'MessageRegistry']
+
+_TABLE_SIZE = 0x10000
+
+_FORMAT_ITEM = re.compile(r'(\d*)([xcbB?hHiIlLqQnNefdspP])')
+
+# struct 格式字符中，可以直接作为 array 类型码的
+_ARRAY_TYPECODES = frozenset('bBhHiIlLqQfd')
+
+
+def _field_codes(fmt):
+    """struct 格式中每个字段的格式字符。 ``'s'`` 与 ``'p'`` 算作一个字段， ``'x'`` 不算"""
+    codes = []
+    for repeat, code in _FORMAT_ITEM.findall(fmt):
+        if code == 'x':
+            continue
+        if code in 'sp':
+            codes.append(code)
+        else:
+            codes.extend(code * int(repeat or 1))
+    return codes
+
+
+def _iter_unpack(struct_, data):
+    """逐条解码连续存放的记录。 Python 2.7 的 :class:`struct.Struct` 没有 ``iter_unpack`` """
+    size = struct_.size
+    view = memoryview(data)
+    length = len(view) * view.itemsize
+    if not size or length % size:
+        raise struct.error('data length {0} is not a multiple of record size {1}'.format(length, size))
+    unpack_from = struct_.unpack_from
+    return (unpack_from(data, offset) for offset in range(0, length, size))
+
+
+class StructMessage(object):
+    """由 :func:`struct_message` 定义的消息类型的基类
+
+    消息对象使用 `__slots__` ，其字段按定义的顺序作为构造函数的位置参数（或者关键字参数）。
+    """
+
+    __slots__ = ()
+
+    #: 命令
+    cmd = None
+    #: 命令类型
+    cmd_type = None
+    #: 预先编译的 :class:`struct.Struct`
+    struct = None
+    #: 编码后的字节数
+    size = 0
+    #: 字段名称
+    _fields = ()
+    _codes = ()
+    # 按定义的顺序取得全部字段值的元组
+    _getter = None
+
+    def __init__(self, *args, **kwargs):
+        fields = self._fields
+        if len(args) > len(fields):
+            raise TypeError('{} takes at most {} arguments'.format(self.__class__.__name__, len(fields)))
+        for name, value in zip(fields, args):
+            object.__setattr__(self, name, value)
+        for name in fields[len(args):]:
+            try:
+                object.__setattr__(self, name, kwargs.pop(name))
+            except KeyError:
+                raise TypeError('{} missing argument {!r}'.format(self.__class__.__name__, name))
+        if kwargs:
+            raise TypeError('{} got unexpected arguments {}'.format(self.__class__.__name__, sorted(kwargs)))
+
+    def __repr__(self):
+        return '{}({})'.format(
+            self.__class__.__name__, ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self._fields)
+        )
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def _values(self):
+        return self._getter(self)
+
+    def _asdict(self):
+        """字段名到值的字典
+
+        :rtype: dict
+        """
+        return dict(zip(self._fields, self._values()))
+
+    def pack(self):
+        """编码
+
+        :rtype: bytes
+        :raises struct.error: 字段值与格式不符
+        """
+        return self.struct.pack(*self._values())
+
+    @classmethod
+    def unpack(cls, data):
+        """解码
+
+        :param data: :class:`bytes` 、 :class:`memoryview` 等支持缓冲区协议的对象。长度不小于 :attr:`size`
+        :rtype: StructMessage
+        :raises struct.error: 数据长度不足
+        """
+        return cls(*cls.struct.unpack_from(data))
+
+    @classmethod
+    def unpack_many(cls, data):
+        """将连续存放的多条记录解码为消息列表
+
+        :param data: 支持缓冲区协议的对象。长度须是 :attr:`size` 的整数倍
+        :rtype: list
+        :raises struct.error: 数据长度不是记录长度的整数倍
+        """
+        return [cls(*values) for values in _iter_unpack(cls.struct, data)]
+
+    @classmethod
+    def unpack_columns(cls, data):
+        """将连续存放的多条记录按字段解码
+
+        :param data: 支持缓冲区协议的对象。长度须是 :attr:`size` 的整数倍
+        :return: 字段名到值序列的字典。整数与浮点数字段是 :class:`array.array` ，其它字段是 :class:`list`
+        :rtype: dict
+        :raises struct.error: 数据长度不是记录长度的整数倍
+        """
+        rows = list(_iter_unpack(cls.struct, data))
+        columns = {}
+        for i, (name, code) in enumerate(zip(cls._fields, cls._codes)):
+            values = [row[i] for row in rows]
+            columns[name] = array(code, values) if code in _ARRAY_TYPECODES else values
+        return columns
+
+
+def struct_message(name, cmd, cmd_type, fmt, fields):
+    """定义一个以 :class:`struct.Struct` 编解码的消息类型
+
+    :param str name: 类型名称
+    :param int cmd: 命令
+    :param int cmd_type: 命令类型
+    :param str fmt: :mod:`struct` 格式，如 ``'<HBi'`` 。字段数须与 `fields` 一致
+    :param fields: 字段名称序列，或者以空格、逗号分隔的字符串
+    :return: :class:`StructMessage` 的子类
+    :rtype: type
+    """
+    if isinstance(fields, str):
+        fields = fields.replace(',', ' ').split()
+    fields = tuple(fields)
+    codes = _field_codes(fmt.lstrip('@=<>!'))
+    if len(codes) != len(fields):
+        raise ValueError('format {!r} has {} fields, but {} names given'.format(fmt, len(codes), len(fields)))
+    compiled = struct.Struct(fmt)
+    namespace = {
+        '__slots__': fields,
+        'cmd': cmd,
+        'cmd_type': cmd_type,
+        'struct': compiled,
+        'size': compiled.size,
+        '_fields': fields,
+        '_codes': tuple(codes),
+    }
+    if len(fields) > 1:
+        namespace['_getter'] = staticmethod(attrgetter(*fields))
+    else:
+        namespace['_getter'] = staticmethod(lambda message: tuple(getattr(message, name) for name in fields))
+    return type(name, (StructMessage,), namespace)
+
+
+class MessageRegistry(object):
+    """`(cmd, cmd_type)` 到消息类型的登记表
+
+    与 :class:`Router` 相同，以 `(cmd & 0xff) << 8 | (cmd_type & 0xff)` 为下标的定长数组保存解码函数；
+    登记时整体替换，查找不加锁。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._keys = {}
+        #: 解码函数表。每一项是 ``decoder(data)`` 或 `None`
+        self.table = [None] * _TABLE_SIZE
+        #: 解码失败的数据包数
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._types)
+
+    def define(self, name, cmd, cmd_type, fmt, fields):
+        """定义并登记一个消息类型。参数见 :func:`struct_message`
+
+        :return: 消息类型
+        :rtype: type
+        """
+        message_type = struct_message(name, cmd, cmd_type, fmt, fields)
+        self.register(message_type)
+        return message_type
+
+    def register(self, message_type, cmd=None, cmd_type=None):
+        """登记消息类型。替换已有的相同 `(cmd, cmd_type)` 的登记
+
+        :param type message_type: :class:`StructMessage` 的子类，或者 :class:`ctypes.Structure` 的子类
+        :param int cmd: 命令。默认使用 `message_type.cmd` ， :class:`ctypes.Structure` 的子类须指定
+        :param int cmd_type: 命令类型。默认使用 `message_type.cmd_type` ， :class:`ctypes.Structure` 的子类须指定
+        """
+        if issubclass(message_type, StructMessage):
+            decoder = message_type.unpack
+        elif issubclass(message_type, Structure):
+            decoder = message_type.from_buffer_copy
+        else:
+            raise TypeError('message type must be a StructMessage or ctypes.Structure subclass')
+        cmd = getattr(message_type, 'cmd', None) if cmd is None else cmd
+        cmd_type = getattr(message_type, 'cmd_type', None) if cmd_type is None else cmd_type
+        if cmd is None or cmd_type is None:
+            raise ValueError('"cmd" and "cmd_type" are required for {}'.format(message_type.__name__))
+        key = (int(cmd) & 0xff, int(cmd_type) & 0xff)
+        with self._lock:
+            old = self._types.pop(key, None)
+            if old is not None:
+                self._keys.pop(old, None)
+            self._types[key] = message_type
+            self._keys[message_type] = (int(cmd), int(cmd_type))
+            table = list(self.table)
+            table[(key[0] << 8) | key[1]] = decoder
+            self.table = table
+
+    def unregister(self, cmd, cmd_type):
+        """取消登记
+
+        :return: 被取消登记的消息类型。不存在的，返回 `None`
+        """
+        key = (int(cmd) & 0xff, int(cmd_type) & 0xff)
+        with self._lock:
+            message_type = self._types.pop(key, None)
+            if message_type is not None:
+                self._keys.pop(message_type, None)
+                table = list(self.table)
+                table[(key[0] << 8) | key[1]] = None
+                self.table = table
+        return message_type
+
+    def message_type(self, cmd, cmd_type):
+        """登记在 `(cmd, cmd_type)` 的消息类型。没有的，返回 `None`"""
+        return self._types.get((cmd & 0xff, cmd_type & 0xff))
+
+    def key_of(self, message):
+        """消息对象的 `(cmd, cmd_type)`
+
+        :raises KeyError: 消息的类型没有登记
+        """
+        return self._keys[type(message)]
+
+    def decode(self, cmd, cmd_type, data):
+        """解码数据包
+
+        :return: 消息对象。 `(cmd, cmd_type)` 没有登记消息类型的，原样返回 `data`
+        :raises struct.error: 数据与消息格式不符
+        :raises ValueError: 数据长度不足（ :class:`ctypes.Structure` ）
+        """
+        decoder = self.table[((cmd & 0xff) << 8) | (cmd_type & 0xff)]
+        return data if decoder is None else decoder(data)
+
+    def stats(self):
+        """登记表状态
+
+        :return: 包含 ``types`` （登记的消息类型数）与 ``errors`` （解码失败的数据包数）的字典
+        :rtype: dict
+        """
+        return {'types': len(self._types), 'errors': self.errors}
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""客户端运行指标
+
+* 按 `(cmd, cmd_type)` 统计的收发数据包数与字节数；
+* 按错误码统计的错误数；
+* 连接、断开与连接失败次数；
+* 事件分派延迟（从 C 回调函数到事件函数开始执行）、流程调用往返时间与速率限制等待时间的直方图。
+
+在构造 :class:`Client` 时指定 `metrics` 参数为真以启用，通过 :meth:`Client.stats` 读取，
+或者用 :func:`render_prometheus` 输出为 Prometheus 文本格式。
+"""
+
+from __future__ import absolute_import
+
+import threading
+from collections import OrderedDict
+
+from .errors import error_code_message
+
+__all__ = ['Histogram', 'Metrics', 'render_prometheus']
+
+#: :class:`Histogram` 每个 2 的整数次幂区间的分桶数的以 2 为底的对数。分桶的相对误差不超过 ``2 ** -(SUB_BUCKET_BITS - 1)``
+SUB_BUCKET_BITS = 6
+
+#: 流程调用往返时间最多跟踪的未完成调用数。超过时，丢弃最早的记录
+MAX_TRACKED_FLOWS = 65536
+
+_SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+_SUB_BUCKET_HALF = _SUB_BUCKET_COUNT >> 1
+
+#: :func:`render_prometheus` 输出的分位数
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram(object):
+    """HDR 风格的对数-线性直方图
+
+    记录非负整数值。小于 ``2 ** SUB_BUCKET_BITS`` 的值精确记录；更大的值按 2 的整数次幂分段，
+    每段再等分为 ``2 ** (SUB_BUCKET_BITS - 1)`` 个桶。记录是常数时间，内存占用固定。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * ((64 - SUB_BUCKET_BITS + 1) * _SUB_BUCKET_HALF + _SUB_BUCKET_HALF)
+        self._count = 0
+        self._sum = 0
+        self._max = 0
+
+    @staticmethod
+    def _index(value):
+        if value < _SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * _SUB_BUCKET_HALF + (value >> shift)
+
+    @staticmethod
+    def _value_at(index):
+        """桶的上界（含）"""
+        if index < _SUB_BUCKET_COUNT:
+            return index
+        shift, mantissa = divmod(index, _SUB_BUCKET_HALF)
+        shift -= 1
+        mantissa += _SUB_BUCKET_HALF
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        """记录一个值
+
+        :param int value: 非负整数。负数按 0 记录
+        """
+        value = int(value) if value > 0 else 0
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    @property
+    def count(self):
+        """记录数"""
+        return self._count
+
+    def percentiles(self, quantiles):
+        """计算分位数
+
+        :param quantiles: `0` ~ `1` 的分位数序列
+        :return: 与 `quantiles` 对应的值（所在桶的上界，不超过最大值）
+        :rtype: list
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            maximum = self._max
+        results = []
+        for q in quantiles:
+            if not total:
+                results.append(0)
+                continue
+            target = max(1, int(q * total + 0.5))
+            seen = 0
+            for index, n in enumerate(counts):
+                seen += n
+                if seen >= target:
+                    results.append(min(self._value_at(index), maximum))
+                    break
+        return results
+
+    def snapshot(self):
+        """直方图摘要
+
+        :return: 包含 `count` 、 `sum` 、 `max` 与 `p50` 、 `p90` 、 `p99` 、 `p999` 的字典
+        :rtype: dict
+        """
+        p50, p90, p99, p999 = self.percentiles(QUANTILES)
+        with self._lock:
+            count, total, maximum = self._count, self._sum, self._max
+        return {
+            'count': count,
+            'sum': total,
+            'max': maximum,
+            'p50': p50,
+            'p90': p90,
+            'p99': p99,
+            'p999': p999,
+        }
+
+
+class Metrics(object):
+    """一个客户端的运行指标
+
+    由 :class:`Client` 在各个收发、事件分派与流程调用的环节中更新。所有时间值的单位是微秒。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._received = {}
+        self._sent = {}
+        self._errors = {}
+        self.connects = 0
+        self.disconnects = 0
+        self.connect_failures = 0
+        #: 事件分派延迟直方图（微秒）
+        self.dispatch_latency = Histogram()
+        #: 流程调用往返时间直方图（微秒）
+        self.flow_rtt = Histogram()
+        #: 速率限制等待时间直方图（微秒）
+        self.limiter_wait = Histogram()
+        self._flows = OrderedDict()
+        self._early_flows = OrderedDict()
+
+    def received(self, cmd, cmd_type, size):
+        """记录一个接收到的数据包"""
+        with self._lock:
+            try:
+                counter = self._received[(cmd, cmd_type)]
+            except KeyError:
+                counter = self._received[(cmd, cmd_type)] = [0, 0]
+            counter[0] += 1
+            counter[1] += size
+
+    def sent(self, cmd, cmd_type, size, count=1):
+        """记录发送的数据包
+
+        :param int size: 每个数据包的字节数
+        :param int count: 数据包的个数
+        """
+        with self._lock:
+            try:
+                counter = self._sent[(cmd, cmd_type)]
+            except KeyError:
+                counter = self._sent[(cmd, cmd_type)] = [0, 0]
+            counter[0] += count
+            counter[1] += size * count
+
+    def error(self, code):
+        """记录一个错误
+
+        :param int code: 错误码
+        """
+        with self._lock:
+            self._errors[code] = self._errors.get(code, 0) + 1
+
+    def flow_launched(self, invoke_id, mode, start):
+        """记录流程调用的开始
+
+        :param int invoke_id: 调用ID
+        :param int mode: 调用模式
+        :param float start: 调用开始的时间（秒，:func:`time.perf_counter` ）
+        """
+        with self._lock:
+            end = self._early_flows.pop(invoke_id, None)
+            if end is None:
+                self._flows[invoke_id] = (start, mode)
+                if len(self._flows) > MAX_TRACKED_FLOWS:
+                    self._flows.popitem(last=False)
+                return
+        self.flow_rtt.record((end - start) * 1e6)
+
+    def flow_acked(self, invoke_id, ack, now):
+        """记录流程启动确认。启动失败，或者无流程返回的调用，在此结束"""
+        with self._lock:
+            try:
+                start, mode = self._flows[invoke_id]
+            except KeyError:
+                if ack != 1:
+                    self._early(invoke_id, now)
+                return
+            if ack == 1 and mode == 0:
+                return
+            del self._flows[invoke_id]
+        self.flow_rtt.record((now - start) * 1e6)
+
+    def flow_finished(self, invoke_id, now):
+        """记录流程结果返回"""
+        with self._lock:
+            item = self._flows.pop(invoke_id, None)
+            if item is None:
+                self._early(invoke_id, now)
+                return
+        self.flow_rtt.record((now - item[0]) * 1e6)
+
+    def _early(self, invoke_id, now):
+        # 结果先于 flow_launched 到达
+        self._early_flows[invoke_id] = now
+        if len(self._early_flows) > MAX_TRACKED_FLOWS:
+            self._early_flows.popitem(last=False)
+
+    def snapshot(self):
+        """指标摘要
+
+        :rtype: dict
+        """
+        with self._lock:
+            received = [
+                {'cmd': key[0], 'cmd_type': key[1], 'packets': value[0], 'bytes': value[1]}
+                for key, value in sorted(self._received.items())
+            ]
+            sent = [
+                {'cmd': key[0], 'cmd_type': key[1], 'packets': value[0], 'bytes': value[1]}
+                for key, value in sorted(self._sent.items())
+            ]
+            errors = dict(self._errors)
+            tracked_flows = len(self._flows)
+        return {
+            'received': received,
+            'sent': sent,
+            'errors': errors,
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'connect_failures': self.connect_failures,
+            'tracked_flows': tracked_flows,
+            'dispatch_latency_us': self.dispatch_latency.snapshot(),
+            'flow_rtt_us': self.flow_rtt.snapshot(),
+            'limiter_wait_us': self.limiter_wait.snapshot(),
+        }
+
+
+def _labels(**kwargs):
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in sorted(kwargs.items())) + '}'
+
+
+def _render_summary(lines, name, help_text, clients, key):
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} summary'.format(name))
+    for client_id, client in clients:
+        metrics = client._metrics
+        if metrics is None:
+            continue
+        histogram = getattr(metrics, key)
+        for q, value in zip(QUANTILES, histogram.percentiles(QUANTILES)):
+            lines.append('{}{} {}'.format(name, _labels(client_id=client_id, quantile=q), value / 1e6))
+        snapshot = histogram.snapshot()
+        lines.append('{}_sum{} {}'.format(name, _labels(client_id=client_id), snapshot['sum'] / 1e6))
+        lines.append('{}_count{} {}'.format(name, _labels(client_id=client_id), snapshot['count']))
+
+
+def render_prometheus(clients, prefix='smartbus'):
+    """将客户端的指标输出为 Prometheus 文本格式
+
+    :param clients: :class:`Client` 实例序列
+    :param str prefix: 指标名称前缀
+    :return: Prometheus 文本格式（ `text/plain; version=0.0.4` ）
+    :rtype: str
+    """
+    clients = [(client.client_id, client) for client in clients]
+    stats = [(client_id, client.stats()) for client_id, client in clients]
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        name = '{}_{}'.format(prefix, name)
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in samples:
+            lines.append('{}{} {}'.format(name, _labels(**labels), value))
+
+    enabled = [(client_id, s['metrics']) for client_id, s in stats if s['metrics'] is not None]
+    for direction in ('received', 'sent'):
+        for unit in ('packets', 'bytes'):
+            family('{}_{}_total'.format(direction, unit), 'counter', '{} {} by cmd and cmd_type'.format(direction, unit), [
+                ({'client_id': client_id, 'cmd': item['cmd'], 'cmd_type': item['cmd_type']}, item[unit])
+                for client_id, m in enabled for item in m[direction]
+            ])
+    family('errors_total', 'counter', 'errors by SmartBus error code', [
+        ({'client_id': client_id, 'code': code, 'name': error_code_message.get(code, 'UNDEFINED_ERROR')}, n)
+        for client_id, m in enabled for code, n in sorted(m['errors'].items())
+    ])
+    for key in ('connects', 'disconnects', 'connect_failures'):
+        family('{}_total'.format(key), 'counter', key.replace('_', ' '), [
+            ({'client_id': client_id}, m[key]) for client_id, m in enabled
+        ])
+    family('queue_depth', 'gauge', 'number of items waiting in client queues', [
+        ({'client_id': client_id, 'queue': queue}, depth)
+        for client_id, s in stats for queue, depth in sorted(s['queues'].items()) if depth is not None
+    ])
+    _render_summary(lines, '{}_dispatch_latency_seconds'.format(prefix),
+                    'latency from library callback to event handler', clients, 'dispatch_latency')
+    _render_summary(lines, '{}_flow_rtt_seconds'.format(prefix),
+                    'flow invocation round-trip time', clients, 'flow_rtt')
+    _render_summary(lines, '{}_limiter_wait_seconds'.format(prefix),
+                    'time spent waiting for rate limiter tokens', clients, 'limiter_wait')
+    return '\n'.join(lines) + '\n'
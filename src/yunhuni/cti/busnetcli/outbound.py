@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""发送队列
+
+底层发送缓冲区已满（ :data:`SMARTBUS_ERR_BUFF_FULL` ）时，数据进入队列，由后台线程以自适应的退避间隔重试发送，
+调用者不必自己编写重试循环。
+
+队列为空时，数据直接发送，不经过队列和后台线程；
+队列中有数据时，新数据排在队尾，以保持发送顺序。
+"""
+
+from __future__ import absolute_import
+
+import threading
+from collections import deque
+
+from ._c.mutual import SMARTBUS_ERR_BUFF_FULL, SMARTBUS_ERR_OTHER
+from .errors import OutboundQueueFullError, check
+from .utils import LoggerMixin, monotonic
+
+__all__ = ['OutboundQueue', 'OVERFLOW_BLOCK', 'OVERFLOW_NONBLOCK', 'OVERFLOW_DROP_OLDEST']
+
+#: 溢出策略：阻塞发送者，直到队列有足够的空间
+OVERFLOW_BLOCK = 'block'
+
+#: 溢出策略：立即抛出 :class:`OutboundQueueFullError`
+OVERFLOW_NONBLOCK = 'nonblock'
+
+#: 溢出策略：丢弃队列中最早的数据，为新数据腾出空间
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+
+#: 默认的队列内存上限（字节）
+DEFAULT_MAX_BYTES = 4 << 20
+
+#: 默认的最小重试间隔（秒）
+DEFAULT_MIN_BACKOFF = 0.001
+
+#: 默认的最大重试间隔（秒）
+DEFAULT_MAX_BACKOFF = 0.1
+
+#: 计算队列内存占用时，每个数据包在包体之外的估计开销（字节）
+ITEM_OVERHEAD = 128
+
+
+class OutboundQueue(LoggerMixin):
+    """有内存上限的发送队列
+
+    在构造 :class:`Client` 时，通过 `outbound_queue` 参数使用，每个客户端一个队列。
+
+    :param int max_bytes: 队列内存上限（字节），按包体长度加上 :data:`ITEM_OVERHEAD` 计算。
+        队列为空时，总是可以放入一个数据包，无论它有多大
+    :param str overflow: 队列满时的溢出策略：
+        :data:`OVERFLOW_BLOCK` 、 :data:`OVERFLOW_NONBLOCK` 或 :data:`OVERFLOW_DROP_OLDEST`
+    :param float block_timeout: :data:`OVERFLOW_BLOCK` 策略下，最长阻塞时间（秒）。
+        超时后抛出 :class:`OutboundQueueFullError` 。默认为 `None` ：一直等待
+    :param float min_backoff: 最小重试间隔（秒）
+    :param float max_backoff: 最大重试间隔（秒）
+
+    每次重试仍是 :data:`SMARTBUS_ERR_BUFF_FULL` 时，重试间隔加倍，直到 `max_backoff` ；
+    每次发送成功后，重试间隔减半，小于 `min_backoff` 时归零。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, overflow=OVERFLOW_BLOCK, block_timeout=None,
+                 min_backoff=DEFAULT_MIN_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_NONBLOCK, OVERFLOW_DROP_OLDEST):
+            raise ValueError('invalid overflow policy {!r}'.format(overflow))
+        self._max_bytes = int(max_bytes)
+        self._overflow = overflow
+        self._block_timeout = block_timeout
+        self._min_backoff = float(min_backoff)
+        self._max_backoff = float(max_backoff)
+        self._send = None
+        self._on_fail = None
+        self._cond = threading.Condition(threading.Lock())
+        self._items = deque()
+        self._inflight = None
+        self._bytes = 0
+        self._backoff = 0.0
+        self._thread = None
+        self._closed = False
+        self._sent = 0
+        self._retries = 0
+        self._dropped = 0
+        self._failed = 0
+
+    def bind(self, send, on_fail=None):
+        """绑定发送函数。由 :class:`Client` 在构造时调用
+
+        :param callable send: 发送函数，形如 ``send(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)`` ，
+            返回错误码，不抛出异常
+        :param callable on_fail: 队列中的数据发送失败或被丢弃时的回调函数，
+            形如 ``on_fail(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data, error_code)``
+        """
+        if self._send is not None:
+            raise RuntimeError('OutboundQueue already bound')
+        self._send = send
+        self._on_fail = on_fail
+
+    @property
+    def max_bytes(self):
+        """队列内存上限（字节）"""
+        return self._max_bytes
+
+    @property
+    def overflow(self):
+        """溢出策略"""
+        return self._overflow
+
+    @property
+    def depth(self):
+        """队列中等待发送的数据包数量，含正在重试的数据包"""
+        return len(self._items) + (self._inflight is not None)
+
+    @property
+    def bytes(self):
+        """队列的内存占用（字节）"""
+        return self._bytes
+
+    def stats(self):
+        """队列状态
+
+        :return: 包含以下键的字典：
+
+            * ``depth`` : 队列中的数据包数量
+            * ``bytes`` : 队列的内存占用
+            * ``max_bytes`` : 队列内存上限
+            * ``backoff`` : 当前的重试间隔（秒）
+            * ``sent`` : 经由队列发送成功的数据包数量
+            * ``retries`` : 重试次数
+            * ``dropped`` : 因溢出被丢弃的数据包数量
+            * ``failed`` : 经由队列发送失败的数据包数量
+
+        :rtype: dict
+        """
+        with self._cond:
+            return {
+                'depth': len(self._items) + (self._inflight is not None),
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes,
+                'backoff': self._backoff,
+                'sent': self._sent,
+                'retries': self._retries,
+                'dropped': self._dropped,
+                'failed': self._failed,
+            }
+
+    def send(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """发送数据
+
+        队列为空时直接发送；直接发送的结果是 :data:`SMARTBUS_ERR_BUFF_FULL` ，或者队列不为空时，放入队列。
+
+        参数同 :meth:`Client.send_data`
+
+        :raises SmartBusError: 直接发送失败，且错误不是 :data:`SMARTBUS_ERR_BUFF_FULL`
+        :raises OutboundQueueFullError: 队列已满，且溢出策略是 :data:`OVERFLOW_NONBLOCK` ，
+            或者 :data:`OVERFLOW_BLOCK` 策略下等待超时
+        """
+        if self._closed:
+            raise RuntimeError('OutboundQueue closed')
+        if self._inflight is None and not self._items:
+            error_code = self._send(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+            if error_code != SMARTBUS_ERR_BUFF_FULL:
+                if error_code:
+                    check(error_code)
+                return
+        if data and not isinstance(data, bytes):
+            data = bytes(data)  # 调用者在返回后仍可能修改可变的缓冲区
+        self._put((cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data))
+
+    def _put(self, item):
+        size = len(item[5] or b'') + ITEM_OVERHEAD
+        dropped = []
+        with self._cond:
+            deadline = None
+            while self._items and self._bytes + size > self._max_bytes:
+                if self._overflow == OVERFLOW_DROP_OLDEST:
+                    oldest = self._items.popleft()
+                    self._bytes -= len(oldest[5] or b'') + ITEM_OVERHEAD
+                    self._dropped += 1
+                    dropped.append(oldest)
+                elif self._overflow == OVERFLOW_NONBLOCK:
+                    raise OutboundQueueFullError('{} bytes queued'.format(self._bytes))
+                elif self._block_timeout is None:
+                    self._cond.wait()
+                else:
+                    if deadline is None:
+                        deadline = monotonic() + self._block_timeout
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise OutboundQueueFullError('{} bytes queued'.format(self._bytes))
+                    self._cond.wait(remaining)
+            self._items.append(item)
+            self._bytes += size
+            self._cond.notify_all()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='{}-{:x}'.format(self.__class__.__name__, id(self)))
+                self._thread.daemon = True
+                self._thread.start()
+        if dropped:
+            self.logger.warning('queue full, drop %s oldest packet(s)', len(dropped))
+            for oldest in dropped:
+                self._notify_fail(oldest, SMARTBUS_ERR_BUFF_FULL)
+
+    def _notify_fail(self, item, error_code):
+        if self._on_fail is not None:
+            try:
+                self._on_fail(*(item + (error_code,)))
+            except Exception:
+                self.logger.exception('on_fail')
+
+    def _run(self):
+        cond = self._cond
+        send = self._send
+        while True:
+            with cond:
+                while self._inflight is None:
+                    if self._items:
+                        self._inflight = self._items.popleft()
+                    elif self._closed:
+                        self._thread = None
+                        return
+                    else:
+                        cond.wait()
+                item = self._inflight
+            try:
+                error_code = send(*item)
+            except Exception:
+                self.logger.exception('send')
+                error_code = SMARTBUS_ERR_OTHER
+            with cond:
+                if error_code == SMARTBUS_ERR_BUFF_FULL:
+                    self._retries += 1
+                    self._backoff = min(max(self._backoff * 2, self._min_backoff), self._max_backoff)
+                    # 放入数据时的 notify_all 也会唤醒这里，须等满退避间隔
+                    deadline = monotonic() + self._backoff
+                    remaining = self._backoff
+                    while remaining > 0:
+                        cond.wait(remaining)
+                        remaining = deadline - monotonic()
+                    continue
+                self._inflight = None
+                self._bytes -= len(item[5] or b'') + ITEM_OVERHEAD
+                if error_code == 0:
+                    self._sent += 1
+                else:
+                    self._failed += 1
+                backoff = self._backoff / 2
+                self._backoff = backoff if backoff >= self._min_backoff else 0.0
+                cond.notify_all()
+            if error_code != 0:
+                self.logger.error('send queued packet failed: error_code=%s', error_code)
+                self._notify_fail(item, error_code)
+
+    def flush(self, timeout=None):
+        """等待队列中的数据全部发送完毕
+
+        :param float timeout: 最长等待时间（秒）。默认为 `None` ：一直等待
+        :return: 队列是否已空
+        :rtype: bool
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while self._items or self._inflight is not None:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+    def close(self, drain=True):
+        """关闭队列
+
+        关闭后不能再发送数据。
+
+        :param bool drain: 为真时，后台线程继续发送队列中剩余的数据，然后退出；
+            否则丢弃剩余的数据（正在重试的数据包除外）
+        """
+        dropped = []
+        with self._cond:
+            self._closed = True
+            if not drain:
+                while self._items:
+                    item = self._items.popleft()
+                    self._bytes -= len(item[5] or b'') + ITEM_OVERHEAD
+                    self._dropped += 1
+                    dropped.append(item)
+            self._cond.notify_all()
+        for item in dropped:
+            self._notify_fail(item, SMARTBUS_ERR_BUFF_FULL)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""预先准备的流程调用
+
+反复调用同一个流程时，每次调用都要编码 `project_id` 与 `flow_id` ，并构造 :mod:`ctypes` 参数对象。
+:meth:`Client.prepare_flow` 返回的 :class:`PreparedFlow` 预先完成这些工作，之后每次调用只需要编码流程参数::
+
+    route = client.prepare_flow(0, 0, 'ivr', 'route_lookup', 0, 5)
+    for caller in callers:
+        route.launch_async([caller])
+
+调用仍然经过客户端的结果缓存、调用合并、负载均衡、速率限制等环节，事件函数与 :meth:`Client.launch_flow` 的相同。
+"""
+
+from __future__ import absolute_import
+
+from concurrent.futures import Future
+from ctypes import c_byte, c_char_p, c_int
+
+from .utils import to_bytes
+
+__all__ = ['PreparedFlow']
+
+
+class PreparedFlow(object):
+    """预先准备的流程调用句柄。由 :meth:`Client.prepare_flow` 创建
+
+    句柄可以在多个线程中同时使用。
+    """
+
+    __slots__ = ('_client', 'server_unit_id', 'process_index', 'project_id', 'flow_id', 'mode', 'timeout',
+                 'identifiers', 'c_args', '_c_targets')
+
+    def __init__(self, client, server_unit_id, process_index, project_id, flow_id, mode, timeout):
+        self._client = client
+        self.server_unit_id = server_unit_id
+        self.process_index = process_index
+        self.project_id = project_id
+        self.flow_id = flow_id
+        self.mode = int(mode)
+        self.timeout = timeout
+        b_project_id = to_bytes(project_id)
+        b_flow_id = to_bytes(flow_id)
+        #: 已编码的 ``project_id \0 flow_id \0`` ，用于 :class:`LoopbackClient` 的数据包
+        self.identifiers = b_project_id + b'\0' + b_flow_id + b'\0'
+        #: `RemoteInvokeFlow` 的 `client_id` 以及 `project_id` ~ `timeout` 参数
+        self.c_args = (
+            c_byte(client.client_id), c_char_p(b_project_id), c_char_p(b_flow_id), c_int(self.mode),
+            c_int(int(timeout * 1000))
+        )
+        self._c_targets = {}
+
+    def __repr__(self):
+        return '<{} {}:{} {}/{} mode={}>'.format(
+            self.__class__.__name__, self.server_unit_id, self.process_index, self.project_id, self.flow_id, self.mode
+        )
+
+    @property
+    def client(self):
+        """所属的客户端"""
+        return self._client
+
+    def c_target(self, server_unit_id, process_index):
+        """`RemoteInvokeFlow` 的 `server_unit_id` 与 `process_index` 参数
+
+        由负载均衡器选择目标的，每个目标的参数对象构造一次
+        """
+        target = self._c_targets.get((server_unit_id, process_index))
+        if target is None:
+            target = self._c_targets[(server_unit_id, process_index)] = (c_int(server_unit_id), c_int(process_index))
+        return target
+
+    def launch(self, params):
+        """调用流程
+
+        :param list params: 流程输入参数列表
+        :return: invoke_id ，见 :meth:`Client.launch_flow`
+        :rtype: int
+        """
+        return self._client._launch_prepared(None, self, params)
+
+    def launch_async(self, params):
+        """调用流程，返回 :class:`concurrent.futures.Future`
+
+        :param list params: 流程输入参数列表
+        :return: 流程调用结果的 `Future` ，见 :meth:`Client.launch_flow_async`
+        :rtype: concurrent.futures.Future
+        """
+        fut = Future()
+        self._client._launch_prepared(fut, self, params)
+        return fut
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+"""按目标与操作类型的令牌桶速率限制
+
+在 :class:`Client` 调用 C-API 之前，按操作类型（ :data:`OP_SEND_DATA` 、 :data:`OP_NOTIFY` 、 :data:`OP_LAUNCH_FLOW` ）
+与目标（ `send_data` 是 `(dst_unit_id, dst_client_id)` ，其它是 `(server_unit_id, process_index)` ）取得令牌，
+以免瞬间的大量调用压垮单个 `IPSC` 进程。
+
+在构造 :class:`Client` 时，通过 `rate_limiter` 参数使用::
+
+    limiter = RateLimiter(policy=POLICY_BLOCK)
+    limiter.set_limit(OP_LAUNCH_FLOW, rate=200, burst=50)              # 每个 IPSC 进程每秒 200 次
+    limiter.set_limit(OP_LAUNCH_FLOW, rate=50, destination=(0, 3))     # 单独限制 0 号单元的 3 号进程
+    limiter.set_limit(OP_SEND_DATA, rate=5000, destination=ANY_DESTINATION)  # 所有目标合计
+    client = MyClient(..., rate_limiter=limiter)
+
+令牌不足时的策略：
+
+* :data:`POLICY_BLOCK` ：阻塞调用者，直到取得令牌；
+* :data:`POLICY_QUEUE` ：不阻塞，调用在取得令牌的时刻由后台线程执行。
+  只适用于 :meth:`Client.send_data` 与 :meth:`Client.launch_flow_async` ，其它调用仍然阻塞；
+* :data:`POLICY_FAIL` ：立即抛出 :exc:`RateLimitedError` 。
+
+令牌桶允许透支：排队等待的调用预先扣除令牌，因而同一个桶中的调用按到达顺序执行。
+"""
+
+from __future__ import absolute_import
+
+import heapq
+import threading
+from itertools import count
+
+from .errors import RateLimitedError
+from .utils import LoggerMixin, monotonic
+
+__all__ = [
+    'TokenBucket', 'RateLimiter',
+    'POLICY_BLOCK', 'POLICY_QUEUE', 'POLICY_FAIL',
+    'OP_SEND_DATA', 'OP_NOTIFY', 'OP_LAUNCH_FLOW', 'ANY_DESTINATION',
+]
+
+#: 策略：阻塞调用者，直到取得令牌
+POLICY_BLOCK = 'block'
+
+#: 策略：调用在取得令牌的时刻由后台线程执行
+POLICY_QUEUE = 'queue'
+
+#: 策略：立即抛出 :exc:`RateLimitedError`
+POLICY_FAIL = 'fail'
+
+#: 操作类型： :meth:`Client.send_data`
+OP_SEND_DATA = 'send_data'
+
+#: 操作类型： :meth:`Client.notify`
+OP_NOTIFY = 'notify'
+
+#: 操作类型： :meth:`Client.launch_flow` 与 :meth:`Client.launch_flow_async`
+OP_LAUNCH_FLOW = 'launch_flow'
+
+#: :meth:`RateLimiter.set_limit` 的 `destination` 参数：所有目标共用一个令牌桶
+ANY_DESTINATION = '*'
+
+#: :data:`POLICY_QUEUE` 策略下，默认最多排队的调用数
+DEFAULT_MAX_QUEUED = 10000
+
+
+class TokenBucket(object):
+    """令牌桶
+
+    非线程安全，由 :class:`RateLimiter` 在持有锁时使用。
+
+    :param float rate: 每秒补充的令牌数
+    :param float burst: 桶的容量，即允许的突发调用数。默认与 `rate` 相同，但不小于 `1`
+    """
+
+    __slots__ = ('rate', 'burst', '_tokens', '_updated')
+
+    def __init__(self, rate, burst=None):
+        rate = float(rate)
+        if rate <= 0:
+            raise ValueError('argument "rate" must be greater than 0')
+        self.rate = rate
+        self.burst = max(float(rate if burst is None else burst), 1.0)
+        self._tokens = self.burst
+        self._updated = monotonic()
+
+    def delay(self, now):
+        """取得一个令牌需要等待的时间（秒）。不扣除令牌
+
+        :param float now: 当前时刻（ :func:`time.monotonic` ）
+        :rtype: float
+        """
+        # `now` 可能早于桶的创建时刻（在取得锁之前取得），不能因此扣减令牌
+        tokens = min(self.burst, self._tokens + max(now - self._updated, 0.0) * self.rate)
+        self._tokens = tokens
+        self._updated = max(now, self._updated)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self):
+        """扣除一个令牌。可以透支"""
+        self._tokens -= 1
+
+
+class RateLimiter(LoggerMixin):
+    """按目标与操作类型的速率限制器
+
+    可以由多个客户端共用，此时限制的是它们的调用总和。
+
+    :param str policy: 令牌不足时的策略： :data:`POLICY_BLOCK` 、 :data:`POLICY_QUEUE` 或 :data:`POLICY_FAIL`
+    :param float block_timeout: 最长等待时间（秒）。需要等待更久的，抛出 :exc:`RateLimitedError` 。
+        默认为 `None` ：不限
+    :param int max_queued: :data:`POLICY_QUEUE` 策略下，最多排队的调用数。超过时抛出 :exc:`RateLimitedError`
+    """
+
+    def __init__(self, policy=POLICY_BLOCK, block_timeout=None, max_queued=DEFAULT_MAX_QUEUED):
+        if policy not in (POLICY_BLOCK, POLICY_QUEUE, POLICY_FAIL):
+            raise ValueError('invalid rate limit policy {!r}'.format(policy))
+        self._policy = policy
+        self._block_timeout = block_timeout
+        self._max_queued = int(max_queued)
+        self._lock = threading.Lock()
+        self._limits = {}
+        self._buckets = {}
+        self._cond = threading.Condition(threading.Lock())
+        self._scheduled = []
+        self._seq = count()
+        self._thread = None
+        self._closed = False
+        self._acquired = 0
+        self._throttled = 0
+        self._rejected = 0
+
+    @property
+    def policy(self):
+        """令牌不足时的策略"""
+        return self._policy
+
+    @property
+    def queued(self):
+        """:data:`POLICY_QUEUE` 策略下，排队等待执行的调用数"""
+        return len(self._scheduled)
+
+    def set_limit(self, operation, rate, burst=None, destination=None):
+        """设置速率限制
+
+        :param str operation: 操作类型： :data:`OP_SEND_DATA` 、 :data:`OP_NOTIFY` 或 :data:`OP_LAUNCH_FLOW`
+        :param float rate: 每秒允许的调用数
+        :param float burst: 允许的突发调用数。默认与 `rate` 相同
+        :param destination: 目标：
+
+            * `None` （默认）：每个目标各自一个令牌桶，未单独设置的目标都使用这个限制；
+            * `(unit_id, client_id)` 元组：只限制这个目标，优先于 `None` 的设置；
+            * :data:`ANY_DESTINATION` ：所有目标共用一个令牌桶，在以上两种限制之外同时生效
+        """
+        TokenBucket(rate, burst)  # 检查参数
+        with self._lock:
+            self._limits[(operation, destination)] = (rate, burst)
+            for key in [key for key in self._buckets if key[0] == operation]:
+                del self._buckets[key]
+
+    def remove_limit(self, operation, destination=None):
+        """取消 :meth:`set_limit` 设置的速率限制
+
+        参数同 :meth:`set_limit`
+        """
+        with self._lock:
+            self._limits.pop((operation, destination), None)
+            for key in [key for key in self._buckets if key[0] == operation]:
+                del self._buckets[key]
+
+    def _bucket(self, operation, destination):
+        # 须在持有锁时调用。返回 None 表示不限制
+        key = (operation, destination)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limit = self._limits.get(key)
+            if limit is None and destination != ANY_DESTINATION:
+                limit = self._limits.get((operation, None))
+            if limit is None:
+                return None
+            bucket = self._buckets[key] = TokenBucket(*limit)
+        return bucket
+
+    def reserve(self, operation, destination, queueable=False):
+        """为一次调用预留令牌
+
+        :param str operation: 操作类型
+        :param tuple destination: 目标 `(unit_id, client_id)`
+        :param bool queueable: 调用者能否在 :data:`POLICY_QUEUE` 策略下通过 :meth:`schedule` 延后执行
+        :return: 调用者需要等待（或者延后）的时间（秒）。令牌已经扣除
+        :rtype: float
+        :raises RateLimitedError: :data:`POLICY_FAIL` 策略下令牌不足；需要等待的时间超过 `block_timeout` ；
+            或者排队的调用数已达上限
+        """
+        if not self._limits:
+            return 0.0
+        now = monotonic()
+        with self._lock:
+            buckets = [
+                bucket for bucket in (
+                    self._bucket(operation, destination), self._bucket(operation, ANY_DESTINATION)
+                ) if bucket is not None
+            ]
+            if not buckets:
+                return 0.0
+            delay = max(bucket.delay(now) for bucket in buckets)
+            if delay > 0:
+                queued = queueable and self._policy == POLICY_QUEUE
+                if self._policy == POLICY_FAIL:
+                    reason = 'no token'
+                elif self._block_timeout is not None and delay > self._block_timeout:
+                    reason = 'need to wait {:.3f}s'.format(delay)
+                elif queued and len(self._scheduled) >= self._max_queued:
+                    reason = '{} calls queued'.format(len(self._scheduled))
+                else:
+                    reason = None
+                if reason is not None:
+                    self._rejected += 1
+                    raise RateLimitedError('{} to {}: {}'.format(operation, destination, reason))
+                self._throttled += 1
+            for bucket in buckets:
+                bucket.take()
+            self._acquired += 1
+        return delay
+
+    def schedule(self, delay, fn, *args):
+        """在 `delay` 秒之后，由后台线程执行 `fn(*args)`
+
+        :param float delay: 延后的时间（秒），通常是 :meth:`reserve` 的返回值
+        :param callable fn: 函数。其异常被记录到日志
+        """
+        when = monotonic() + delay
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('RateLimiter closed')
+            heapq.heappush(self._scheduled, (when, next(self._seq), fn, args))
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='{}-{:x}'.format(self.__class__.__name__, id(self)))
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        cond = self._cond
+        scheduled = self._scheduled
+        while True:
+            with cond:
+                while True:
+                    if scheduled:
+                        remaining = scheduled[0][0] - monotonic()
+                        if remaining <= 0:
+                            _, _, fn, args = heapq.heappop(scheduled)
+                            break
+                        cond.wait(remaining)
+                    elif self._closed:
+                        self._thread = None
+                        return
+                    else:
+                        cond.wait()
+            try:
+                fn(*args)
+            except Exception:
+                self.logger.exception('%s', fn)
+
+    def stats(self):
+        """限制器状态
+
+        :return: 包含 ``acquired`` （取得令牌的调用数）、 ``throttled`` （需要等待或延后的调用数）、
+            ``rejected`` （被拒绝的调用数）与 ``queued`` （排队等待执行的调用数）的字典
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'acquired': self._acquired,
+                'throttled': self._throttled,
+                'rejected': self._rejected,
+                'queued': len(self._scheduled),
+            }
+
+    def close(self):
+        """关闭限制器。已经排队的调用仍会按时执行，之后后台线程退出"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
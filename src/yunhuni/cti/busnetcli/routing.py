@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""按 `(cmd, cmd_type)` 分派接收到的数据
+
+通过 :meth:`Client.route` 为不同的 `(cmd, cmd_type)` 登记不同的处理函数，代替在 :meth:`Client.on_data` 中逐个判断::
+
+    @client.route(1, 2)
+    def on_agent_state(head, data):
+        ...
+
+    @client.route(cmd_type=5, executor=report_executor)   # cmd 任意
+    def on_report(head, data):
+        ...
+
+:class:`Router` 预先计算一个以 `(cmd & 0xff) << 8 | (cmd_type & 0xff)` 为下标、共 65536 项的分派表，
+每个数据包在接收回调的线程中只做一次下标访问。匹配的优先顺序是：
+
+1. `cmd` 与 `cmd_type` 都相同；
+2. `cmd` 相同， `cmd_type` 任意；
+3. `cmd_type` 相同， `cmd` 任意；
+4. 都任意。
+
+登记了处理函数之后，接收到的数据不再交给 :meth:`Client.on_data` 与 :meth:`Client.on_data_batch` ：
+没有匹配的处理函数的数据包只被计数，然后丢弃。如果需要保留 :meth:`Client.on_data` ，可以将它登记为都任意的处理函数。
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+__all__ = ['Router', 'ANY']
+
+#: 通配符：任意的 `cmd` 或 `cmd_type`
+ANY = None
+
+_TABLE_SIZE = 0x10000
+
+
+def _index(cmd, cmd_type):
+    return ((cmd & 0xff) << 8) | (cmd_type & 0xff)
+
+
+class Router(object):
+    """`(cmd, cmd_type)` 到处理函数的分派表
+
+    登记与取消登记时重新计算分派表；查找不加锁。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        #: 分派表。每一项是 `(handler, executor)` 或 `None`
+        self.table = [None] * _TABLE_SIZE
+        #: 没有匹配的处理函数而被丢弃的数据包数
+        self.unmatched = 0
+
+    def __len__(self):
+        return len(self._routes)
+
+    def add(self, cmd, cmd_type, handler, executor=None):
+        """登记处理函数。替换已有的相同 `(cmd, cmd_type)` 的处理函数
+
+        :param int cmd: 命令。 :data:`ANY` 表示任意
+        :param int cmd_type: 命令类型。 :data:`ANY` 表示任意
+        :param callable handler: 处理函数，形如 ``handler(head, data)`` ，参数同 :meth:`Client.on_data`
+        :param executor: 执行处理函数的执行器（具有 ``submit(fn, *args)`` 方法）。
+            默认为 `None` ：使用客户端的事件执行器
+        """
+        key = (
+            None if cmd is ANY else int(cmd) & 0xff,
+            None if cmd_type is ANY else int(cmd_type) & 0xff,
+        )
+        with self._lock:
+            self._routes[key] = (handler, executor)
+            self._rebuild()
+
+    def remove(self, cmd, cmd_type):
+        """取消登记
+
+        参数同 :meth:`add`
+
+        :return: 是否存在这个登记
+        :rtype: bool
+        """
+        key = (
+            None if cmd is ANY else int(cmd) & 0xff,
+            None if cmd_type is ANY else int(cmd_type) & 0xff,
+        )
+        with self._lock:
+            if self._routes.pop(key, None) is None:
+                return False
+            self._rebuild()
+        return True
+
+    def _rebuild(self):
+        # 须在持有锁时调用。按优先顺序从低到高填写，再整体替换，查找者总是看到完整的表
+        table = [self._routes.get((None, None))] * _TABLE_SIZE
+        for (cmd, cmd_type), entry in self._routes.items():
+            if cmd is None and cmd_type is not None:
+                table[cmd_type::0x100] = [entry] * 0x100
+        for (cmd, cmd_type), entry in self._routes.items():
+            if cmd is not None and cmd_type is None:
+                table[cmd << 8:(cmd + 1) << 8] = [entry] * 0x100
+        for (cmd, cmd_type), entry in self._routes.items():
+            if cmd is not None and cmd_type is not None:
+                table[(cmd << 8) | cmd_type] = entry
+        self.table = table
+
+    def lookup(self, cmd, cmd_type):
+        """查找处理函数
+
+        :return: `(handler, executor)` 。没有匹配的，返回 `None`
+        """
+        return self.table[_index(cmd, cmd_type)]
+
+    def stats(self):
+        """分派表状态
+
+        :return: 包含 ``routes`` （登记数）与 ``unmatched`` （被丢弃的数据包数）的字典
+        :rtype: dict
+        """
+        return {'routes': len(self._routes), 'unmatched': self.unmatched}
@@ -0,0 +1,658 @@
+# -*- coding: utf-8 -*-
+
+"""本地 SmartBus 模拟器
+
+用于在没有真实 SmartBus 节点与 IPSC 的情况下测试、压测客户端。
+
+* :class:`SimBus` : 总线核心。在各个客户端之间转发数据与 PING，模拟 IPSC 响应流程调用，发出全局连接事件；
+* :class:`FakeLibrary` : 模拟 `busnetcli` 共享库，通过 :meth:`Client.initialize` 的 `lib` 参数使用；
+* :class:`SimServer` : 监听本地端口，以 :mod:`yunhuni.cti.busnetcli.wire` 回环线路协议接受 :class:`LoopbackClient` 的连接。
+
+同一个 :class:`SimBus` 上的 :class:`FakeLibrary` 客户端与 :class:`SimServer` 客户端可以相互通信。
+
+所有的事件都在总线的“网络线程”中送出，与 C 库在其内部线程中调用回调函数的方式相同。
+
+例如::
+
+    bus = SimBus()
+    bus.set_flow('project', 'flow', FlowBehavior(result=[1, 2, 3], delay=0.01))
+    bus.add_ipsc(0, 0)
+    bus.start()
+    Client.initialize(16, lib=FakeLibrary(bus))
+
+.. attention:: 该模块需要 Python 3.5 以上版本
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import heapq
+import threading
+from ctypes import Array, _SimpleCData, addressof, create_string_buffer, pointer, sizeof
+from itertools import count
+from time import time
+
+from ._c.mutual import *
+from .jsoncodec import default_codec
+from .utils import LoggerMixin, to_bytes, s2b_recode
+from .wire import (FrameDecoder, ProtocolError, pack_head,
+                   WIRE_CMD_REGISTER, WIRE_CMD_REGISTER_ACK, WIRE_CMD_GLOBAL_CONNECT, WIRE_SYSCMD_PING,
+                   WIRE_SYSCMD_FLOW_INVOKE, WIRE_SYSCMD_FLOW_ACK, WIRE_SYSCMD_FLOW_RET, WIRE_SYSCMD_NOTIFY,
+                   REGISTER_ACK_STRUCT, GLOBAL_CONNECT_STRUCT, FLOW_INVOKE_STRUCT, FLOW_RESULT_STRUCT, NOTIFY_STRUCT)
+
+__all__ = ['SimBus', 'FlowBehavior', 'FakeLibrary', 'SimServer']
+
+
+class FlowBehavior(object):
+    """模拟 IPSC 对流程调用的响应方式
+
+    :param result: 正常返回时的流程返回值列表；或者形如 ``result(params)`` 的函数，返回值列表
+    :param int ack: 启动确认的状态码。 `1` 表示成功；否则只返回启动失败，不再返回结果
+    :param str ack_msg: 启动失败时的信息描述
+    :param int ret: 结果返回值。 `1` 表示正常返回；
+        :data:`SMARTBUS_ERR_TIMEOUT` 表示超时——在调用的超时值之后返回超时；其它值表示错误
+    :param float delay: 从收到调用到返回结果的延迟（秒）
+    :param float ack_delay: 从收到调用到返回启动确认的延迟（秒）
+    """
+
+    __slots__ = ('result', 'ack', 'ack_msg', 'ret', 'delay', 'ack_delay')
+
+    def __init__(self, result=None, ack=1, ack_msg='', ret=1, delay=0.0, ack_delay=0.0):
+        self.result = result
+        self.ack = ack
+        self.ack_msg = ack_msg
+        self.ret = ret
+        self.delay = delay
+        self.ack_delay = ack_delay
+
+
+class SimBus(LoggerMixin):
+    """模拟的 SmartBus 总线
+
+    :param int unit_id: 总线节点（连接点）的单元ID
+    """
+
+    def __init__(self, unit_id=0):
+        self._unit_id = unit_id
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(threading.Lock())
+        self._schedule = []
+        self._seq = count()
+        self._thread = None
+        self._running = False
+        self._endpoints = {}
+        self._nodes = {}
+        self._flows = {}
+        self.default_flow_behavior = FlowBehavior(result=[])
+        #: 计数器
+        self.counters = dict.fromkeys(('data', 'ping', 'flow', 'notify', 'dropped'), 0)
+
+    @property
+    def unit_id(self):
+        """总线节点的单元ID"""
+        return self._unit_id
+
+    def start(self):
+        """启动网络线程"""
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='SimBus-{}'.format(self._unit_id))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止网络线程"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def call_later(self, delay, fn, *args):
+        """在网络线程中延迟执行函数
+
+        :param float delay: 延迟（秒）
+        :param callable fn: 函数
+        """
+        with self._cond:
+            item = (time() + delay, next(self._seq), fn, args)
+            heapq.heappush(self._schedule, item)
+            if self._schedule[0] is item:
+                self._cond.notify()
+
+    def call_soon(self, fn, *args):
+        """在网络线程中尽快执行函数"""
+        self.call_later(0, fn, *args)
+
+    def _run(self):
+        schedule = self._schedule
+        cond = self._cond
+        while True:
+            with cond:
+                while self._running:
+                    if schedule:
+                        wait = schedule[0][0] - time()
+                        if wait <= 0:
+                            break
+                        cond.wait(wait)
+                    else:
+                        cond.wait()
+                if not self._running:
+                    return
+                _, _, fn, args = heapq.heappop(schedule)
+            try:
+                fn(*args)
+            except Exception:
+                self.logger.exception('%s', fn)
+
+    # ---- topology ----
+
+    def add_ipsc(self, unit_id, process_index, info=''):
+        """添加一个模拟的 IPSC 进程节点
+
+        它出现在全局连接事件中。流程调用不要求目标必须是已添加的 IPSC 进程。
+        """
+        self._add_node(unit_id, process_index, SMARTBUS_NODECLI_TYPE_IPSC, info, None)
+
+    def attach(self, endpoint, unit_id, client_id, client_type, info=''):
+        """接入一个客户端端点
+
+        :return: 错误码
+        :rtype: int
+        """
+        with self._lock:
+            if (unit_id, client_id) in self._nodes:
+                return SMARTBUS_ERR_CLI_EXIST
+            self._add_node(unit_id, client_id, client_type, info, endpoint)
+            existing = [v for k, v in self._nodes.items() if k != (unit_id, client_id)]
+        self.call_soon(endpoint.on_connect, self._unit_id, 0)
+        for node_unit_id, node_client_id, node_client_type, node_info, _ in existing:
+            self.call_soon(endpoint.on_global_connect, node_unit_id, node_client_id, node_client_type,
+                           self._unit_id, 2, node_info)
+        return SMARTBUS_ERR_OK
+
+    def detach(self, unit_id, client_id, reconnect_delay=None):
+        """断开一个客户端端点
+
+        :param float reconnect_delay: 不是 `None` 时，在这个延迟（秒）之后，重新接入该端点，模拟客户端的自动重连
+        """
+        with self._lock:
+            node = self._nodes.pop((unit_id, client_id), None)
+            if node is None:
+                return
+            self._endpoints.pop((unit_id, client_id), None)
+            others = list(self._endpoints.values())
+        _, _, client_type, info, endpoint = node
+        if endpoint is not None:
+            self.call_soon(endpoint.on_disconnect)
+            if reconnect_delay is not None:
+                self.call_later(reconnect_delay, self.attach, endpoint, unit_id, client_id, client_type, info)
+        for other in others:
+            self.call_soon(other.on_global_connect, unit_id, client_id, client_type, self._unit_id, 0, info)
+
+    def _add_node(self, unit_id, client_id, client_type, info, endpoint):
+        with self._lock:
+            self._nodes[(unit_id, client_id)] = (unit_id, client_id, client_type, info, endpoint)
+            others = list(self._endpoints.values())
+            if endpoint is not None:
+                self._endpoints[(unit_id, client_id)] = endpoint
+        for other in others:
+            self.call_soon(other.on_global_connect, unit_id, client_id, client_type, self._unit_id, 1, info)
+
+    # ---- flows ----
+
+    def set_flow(self, project_id, flow_id, behavior):
+        """设置流程的模拟响应方式
+
+        :param str project_id: 流程项目ID
+        :param str flow_id: 流程ID。 `None` 表示该项目的所有流程
+        :param FlowBehavior behavior: 响应方式
+        """
+        self._flows[(project_id, flow_id)] = behavior
+
+    def _find_flow(self, project_id, flow_id):
+        flows = self._flows
+        return flows.get((project_id, flow_id)) or flows.get((project_id, None)) or self.default_flow_behavior
+
+    # ---- routing ----
+
+    def send(self, src, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        """转发数据
+
+        :param tuple src: 发送者 `(unit_id, client_id, client_type)`
+        :return: 错误码
+        :rtype: int
+        """
+        endpoint = self._endpoints.get((dst_unit_id, dst_client_id))
+        if endpoint is None:
+            self.counters['dropped'] += 1
+            return SMARTBUS_ERR_DEST_NONEXIST
+        self.counters['data'] += 1
+        length = len(data) if data else 0
+        head = (cmd, cmd_type, src[2], src[0], src[1], dst_client_type, dst_unit_id, dst_client_id, length, length)
+        self.call_soon(endpoint.on_data, head, data)
+        return SMARTBUS_ERR_OK
+
+    def inject(self, dst_unit_id, dst_client_id, cmd, cmd_type, data, src=(0, 0, SMARTBUS_NODECLI_TYPE_NODE)):
+        """以总线的名义，向客户端送出数据，用于产生接收负载
+
+        :return: 错误码
+        :rtype: int
+        """
+        return self.send(src, cmd, cmd_type, dst_unit_id, dst_client_id, 0, data)
+
+    def ping(self, src, dst_unit_id, dst_client_id, dst_client_type, data):
+        """PING 。目标存在时，以目标的名义向发送者返回 PING 应答
+
+        :return: 错误码
+        :rtype: int
+        """
+        if (dst_unit_id, dst_client_id) not in self._nodes:
+            return SMARTBUS_ERR_DEST_NONEXIST
+        endpoint = self._endpoints.get(src[:2])
+        if endpoint is None:
+            return SMARTBUS_ERR_CONN_NOT_ESTAB
+        self.counters['ping'] += 1
+        length = len(data) if data else 0
+        head = (0, SMARTBUS_SYSCMD_PING_ACK, dst_client_type, dst_unit_id, dst_client_id,
+                src[2], src[0], src[1], length, length)
+        self.call_soon(endpoint.on_data, head, data)
+        return SMARTBUS_ERR_OK
+
+    def invoke_flow(self, src, server_unit_id, process_index, project_id, flow_id, mode, timeout, params, invoke_id):
+        """模拟 IPSC 执行流程
+
+        :param str project_id: 流程项目ID
+        :param str flow_id: 流程ID
+        :param float timeout: 超时值（秒）
+        :param bytes params: 流程参数（ `cp936` 编码的 JSON）
+        :return: 错误码
+        :rtype: int
+        """
+        endpoint = self._endpoints.get(src[:2])
+        if endpoint is None:
+            return SMARTBUS_ERR_CONN_NOT_ESTAB
+        self.counters['flow'] += 1
+        behavior = self._find_flow(project_id, flow_id)
+        head = (0, SMARTBUS_CMDTYPE_SYSTEM, SMARTBUS_NODECLI_TYPE_IPSC, server_unit_id, process_index,
+                src[2], src[0], src[1], 0, 0)
+        b_project_id = to_bytes(project_id)
+        self.call_later(behavior.ack_delay, endpoint.on_flow_ack, head, b_project_id, invoke_id, behavior.ack,
+                        s2b_recode(behavior.ack_msg, 'utf-8', 'cp936') if behavior.ack_msg else b'')
+        if behavior.ack != 1 or mode != 0:
+            return SMARTBUS_ERR_OK
+        if behavior.ret == 1:
+            result = behavior.result
+            if callable(result):
+                result = result(default_codec.decode(params) if params else [])
+            result = default_codec.encode(result or [])
+            self.call_later(behavior.delay, endpoint.on_flow_ret, head, b_project_id, invoke_id, 1, result)
+        elif behavior.ret == SMARTBUS_ERR_TIMEOUT:
+            self.call_later(timeout, endpoint.on_flow_ret, head, b_project_id, invoke_id, behavior.ret, b'')
+        else:
+            self.call_later(behavior.delay, endpoint.on_flow_ret, head, b_project_id, invoke_id, behavior.ret, b'')
+        return SMARTBUS_ERR_OK
+
+    def notify(self, src, server_unit_id, process_index, project_id, title, mode, expires, txt):
+        """接收通知消息。模拟器只计数
+
+        :return: 错误码
+        :rtype: int
+        """
+        if src[:2] not in self._endpoints:
+            return SMARTBUS_ERR_CONN_NOT_ESTAB
+        self.counters['notify'] += 1
+        return SMARTBUS_ERR_OK
+
+
+def _value(arg):
+    """将 ctypes 参数转换为 Python 值"""
+    if isinstance(arg, _SimpleCData):
+        return arg.value
+    if isinstance(arg, Array):
+        return bytes(arg)
+    return arg
+
+
+class _FakeFunc(object):
+
+    def __init__(self, fn):
+        self._fn = fn
+        self.argtypes = None
+        self.restype = None
+
+    def __call__(self, *args):
+        return self._fn(*[_value(arg) for arg in args])
+
+
+class _LibEndpoint(object):
+    """:class:`FakeLibrary` 中一个客户端的端点：把总线事件转换为 C 回调函数调用"""
+
+    def __init__(self, lib, client_id):
+        self._lib = lib
+        self._client_id = client_id
+
+    def on_connect(self, access_unit_id, ack):
+        cb = self._lib._callbacks.get('connection')
+        if cb:
+            cb(None, self._client_id, access_unit_id, ack)
+
+    def on_disconnect(self):
+        cb = self._lib._callbacks.get('disconnect')
+        if cb:
+            cb(None, self._client_id)
+
+    def on_data(self, head, data):
+        cb = self._lib._callbacks.get('recvdata')
+        if cb:
+            size = len(data) if data else 0
+            buff = create_string_buffer(data, size) if size else None
+            cb(None, self._client_id, _c_head(head), addressof(buff) if buff else None, size)
+
+    def on_flow_ack(self, head, project_id, invoke_id, ack, msg):
+        cb = self._lib._callbacks.get('flow_ack')
+        if cb:
+            cb(None, self._client_id, _c_head(head), project_id, invoke_id, ack, msg or None)
+
+    def on_flow_ret(self, head, project_id, invoke_id, ret, params):
+        cb = self._lib._callbacks.get('invokeflow_ret')
+        if cb:
+            cb(None, self._client_id, _c_head(head), project_id, invoke_id, ret, params or None)
+
+    def on_global_connect(self, unit_id, client_id, client_type, access_unit_id, status, info):
+        cb = self._lib._callbacks.get('global_connect')
+        if cb:
+            cb(None, bytes(bytearray([unit_id & 0xff])), bytes(bytearray([client_id & 0xff])),
+               bytes(bytearray([client_type & 0xff])), bytes(bytearray([access_unit_id & 0xff])),
+               bytes(bytearray([status & 0xff])), to_bytes(info) if info else None)
+
+
+def _c_head(head):
+    cmd, cmd_type, src_type, src_unit, src_client, dst_type, dst_unit, dst_client, _, length = head
+    return pointer(PacketHeader(
+        0x5b15, cmd, cmd_type,
+        bytes(bytearray([src_type & 0xff])), bytes(bytearray([src_unit & 0xff])), bytes(bytearray([src_client & 0xff])),
+        bytes(bytearray([dst_type & 0xff])), bytes(bytearray([dst_unit & 0xff])), bytes(bytearray([dst_client & 0xff])),
+        b'', sizeof(PacketHeader) + length, length
+    ))
+
+
+class FakeLibrary(object):
+    """模拟的 `busnetcli` 共享库
+
+    提供与 :mod:`yunhuni.cti.busnetcli._c.netapi` 所声明的函数同名的函数，将调用转到 :class:`SimBus` 。
+
+    :param SimBus bus: 总线
+
+    使用方法::
+
+        Client.initialize(unit_id, lib=FakeLibrary(bus))
+    """
+
+    prefix = 'SmartBusNetCli_'
+
+    def __init__(self, bus):
+        self._bus = bus
+        self._unit_id = None
+        self._callbacks = {}
+        self._clients = {}
+        self._invoke_ids = count(1)
+
+    def __getattr__(self, name):
+        if not name.startswith(self.prefix):
+            raise AttributeError(name)
+        fn = _FakeFunc(getattr(self, '_' + name[len(self.prefix):]))
+        setattr(self, name, fn)
+        return fn
+
+    def _src(self, client_id):
+        client_id &= 0xff
+        return self._unit_id, client_id, self._clients.get(client_id, 0)
+
+    def _Init(self, unit_id):
+        self._unit_id = unit_id & 0xff
+        return SMARTBUS_ERR_OK
+
+    def _Release(self):
+        for client_id in list(self._clients):
+            self._bus.detach(self._unit_id, client_id)
+        self._clients.clear()
+
+    def _SetCallBackFn(self, connection, recvdata, disconnect, invokeflow_ret, global_connect, arg):
+        self._callbacks.update(connection=connection, recvdata=recvdata, disconnect=disconnect,
+                               invokeflow_ret=invokeflow_ret, global_connect=global_connect)
+
+    def _SetCallBackFnArg(self, arg):
+        pass
+
+    def _SetCallBackFnEx(self, name, fn):
+        if name == b'smartbus_invokeflow_ack_cb':
+            self._callbacks['flow_ack'] = fn
+
+    def _CreateConnect(self, client_id, client_type, master_ip, master_port, slave_ip, slave_port, user, password,
+                       info):
+        client_id &= 0xff
+        if self._unit_id is None:
+            return SMARTBUS_ERR_NON_INIT
+        self._clients[client_id] = client_type
+        return self._bus.attach(_LibEndpoint(self, client_id), self._unit_id, client_id, client_type,
+                                (info or b'').decode('utf-8'))
+
+    def _SendData(self, client_id, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data, size):
+        if data is not None and len(data) != size:
+            data = data[:size]
+        return self._bus.send(self._src(client_id), cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type,
+                              data or None)
+
+    def _SendPing(self, client_id, dst_unit_id, dst_client_id, dst_client_type, data, size):
+        if data is not None and len(data) != size:
+            data = data[:size]
+        return self._bus.ping(self._src(client_id), dst_unit_id, dst_client_id, dst_client_type, data or None)
+
+    def _RemoteInvokeFlow(self, client_id, server_unit_id, process_index, project_id, flow_id, mode, timeout, params):
+        invoke_id = next(self._invoke_ids) & 0x7fffffff
+        code = self._bus.invoke_flow(self._src(client_id), server_unit_id, process_index,
+                                     (project_id or b'').decode('utf-8'), (flow_id or b'').decode('utf-8'),
+                                     mode, timeout / 1000.0, params, invoke_id)
+        return code if code else invoke_id
+
+    def _SendNotify(self, client_id, server_unit_id, process_index, project_id, title, mode, expires, txt):
+        invoke_id = next(self._invoke_ids) & 0x7fffffff
+        code = self._bus.notify(self._src(client_id), server_unit_id, process_index, project_id, title, mode,
+                                expires / 1000.0, txt)
+        return code if code else invoke_id
+
+
+class _ServerProtocol(asyncio.Protocol):
+    """:class:`SimServer` 的一个连接，同时也是总线上的一个端点"""
+
+    def __init__(self, server):
+        self._bus = server.bus
+        self._loop = server.loop
+        self._transport = None
+        self._addr = None
+        self._decoder = FrameDecoder(self._on_frame)
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        try:
+            self._decoder.feed(data)
+        except ProtocolError:
+            self._bus.logger.exception('protocol error')
+            self._transport.close()
+
+    def connection_lost(self, exc):
+        if self._addr is not None:
+            self._bus.detach(self._addr[0], self._addr[1])
+            self._addr = None
+
+    def _write(self, *chunks):
+        # 在总线的网络线程中调用
+        self._loop.call_soon_threadsafe(self._transport.writelines, chunks)
+
+    def _write_to_self(self, cmd, cmd_type, src, payload):
+        unit_id, client_id, client_type = self._addr
+        self._write(pack_head(cmd, cmd_type, src[2], src[0], src[1], client_type, unit_id, client_id, len(payload)),
+                    payload)
+
+    def _on_frame(self, fields, payload):
+        cmd = fields[1]
+        cmd_type = fields[2]
+        bus = self._bus
+        if self._addr is None:
+            if cmd_type != SMARTBUS_CMDTYPE_INTERNAL or cmd != WIRE_CMD_REGISTER:
+                return
+            addr = fields[4], fields[5], fields[3]
+            info = payload.tobytes().split(b'\0')[2:3]
+            code = bus.attach(self, addr[0], addr[1], addr[2], info[0].decode('utf-8') if info else '')
+            if code:
+                self._transport.write(
+                    pack_head(WIRE_CMD_REGISTER_ACK, SMARTBUS_CMDTYPE_INTERNAL, SMARTBUS_NODECLI_TYPE_NODE,
+                              bus.unit_id, 0, addr[2], addr[0], addr[1], REGISTER_ACK_STRUCT.size)
+                    + REGISTER_ACK_STRUCT.pack(code, bus.unit_id))
+                self._transport.close()
+            else:
+                self._addr = addr
+            return
+        addr = self._addr
+        if cmd_type == SMARTBUS_CMDTYPE_SYSTEM and cmd == WIRE_SYSCMD_PING:
+            bus.ping(addr, fields[7], fields[8], fields[6], payload.tobytes() or None)
+        elif cmd_type == SMARTBUS_CMDTYPE_SYSTEM and cmd == WIRE_SYSCMD_FLOW_INVOKE:
+            invoke_id, timeout, mode = FLOW_INVOKE_STRUCT.unpack_from(payload)
+            project_id, flow_id, params = payload[FLOW_INVOKE_STRUCT.size:].tobytes().split(b'\0', 2)
+            code = bus.invoke_flow(addr, fields[7], fields[8], project_id.decode('utf-8'),
+                                   flow_id.decode('utf-8'), mode, timeout / 1000.0, params, invoke_id)
+            if code:
+                self._write_to_self(WIRE_SYSCMD_FLOW_ACK, SMARTBUS_CMDTYPE_SYSTEM, (fields[7], fields[8], fields[6]),
+                                    FLOW_RESULT_STRUCT.pack(invoke_id, code) + project_id + b'\0')
+        elif cmd_type == SMARTBUS_CMDTYPE_SYSTEM and cmd == WIRE_SYSCMD_NOTIFY:
+            invoke_id, expires, mode = NOTIFY_STRUCT.unpack_from(payload)
+            project_id, title, txt = payload[NOTIFY_STRUCT.size:].tobytes().split(b'\0', 2)
+            bus.notify(addr, fields[7], fields[8], project_id, title, mode, expires / 1000.0, txt)
+        elif cmd_type == SMARTBUS_CMDTYPE_INTERNAL and cmd in (WIRE_CMD_REGISTER, WIRE_CMD_REGISTER_ACK,
+                                                                WIRE_CMD_GLOBAL_CONNECT):
+            pass  # 线路控制命令，不转发
+        else:
+            bus.send(addr, cmd, cmd_type, fields[7], fields[8], fields[6], payload.tobytes() or None)
+
+    # ---- 总线端点接口，在总线的网络线程中调用 ----
+
+    def on_connect(self, access_unit_id, ack):
+        self._write_to_self(WIRE_CMD_REGISTER_ACK, SMARTBUS_CMDTYPE_INTERNAL,
+                            (access_unit_id, 0, SMARTBUS_NODECLI_TYPE_NODE),
+                            REGISTER_ACK_STRUCT.pack(ack, access_unit_id))
+
+    def on_disconnect(self):
+        self._loop.call_soon_threadsafe(self._transport.close)
+
+    def on_data(self, head, data):
+        data = data or b''
+        self._write(pack_head(head[0], head[1], head[2], head[3], head[4], head[5], head[6], head[7], len(data)), data)
+
+    def on_flow_ack(self, head, project_id, invoke_id, ack, msg):
+        self._write_to_self(WIRE_SYSCMD_FLOW_ACK, SMARTBUS_CMDTYPE_SYSTEM, (head[3], head[4], head[2]),
+                            FLOW_RESULT_STRUCT.pack(invoke_id, ack) + project_id + b'\0' + (msg or b''))
+
+    def on_flow_ret(self, head, project_id, invoke_id, ret, params):
+        self._write_to_self(WIRE_SYSCMD_FLOW_RET, SMARTBUS_CMDTYPE_SYSTEM, (head[3], head[4], head[2]),
+                            FLOW_RESULT_STRUCT.pack(invoke_id, ret) + project_id + b'\0' + (params or b''))
+
+    def on_global_connect(self, unit_id, client_id, client_type, access_unit_id, status, info):
+        self._write_to_self(WIRE_CMD_GLOBAL_CONNECT, SMARTBUS_CMDTYPE_INTERNAL,
+                            (access_unit_id, 0, SMARTBUS_NODECLI_TYPE_NODE),
+                            GLOBAL_CONNECT_STRUCT.pack(unit_id, client_id, client_type, access_unit_id, status)
+                            + to_bytes(info or ''))
+
+
+class SimServer(LoggerMixin):
+    """以回环线路协议接受 :class:`LoopbackClient` 连接的模拟 SmartBus 节点
+
+    :param SimBus bus: 总线
+    :param str host: 监听地址
+    :param int port: 监听端口。 `0` 表示由系统分配，启动后从 :attr:`port` 获得
+    :param asyncio.AbstractEventLoop loop: 事件循环。
+        默认为 `None` : :meth:`start` 使用当前的事件循环； :meth:`start_in_thread` 新建事件循环，并在一个新的守护线程中运行它
+    """
+
+    def __init__(self, bus, host='127.0.0.1', port=0, loop=None):
+        self._bus = bus
+        self._host = host
+        self._port = port
+        self._loop = loop
+        self._own_loop = False
+        self._server = None
+
+    @property
+    def bus(self):
+        """总线"""
+        return self._bus
+
+    @property
+    def loop(self):
+        """事件循环"""
+        return self._loop
+
+    @property
+    def host(self):
+        """监听地址"""
+        return self._host
+
+    @property
+    def port(self):
+        """监听端口"""
+        return self._port
+
+    async def start(self):
+        """开始监听
+
+        :return: 本对象
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self._server = await self._loop.create_server(lambda: _ServerProtocol(self), self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def start_in_thread(self):
+        """在事件循环线程中开始监听，并等待监听开始
+
+        :return: 本对象
+        """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._own_loop = True
+            thread = threading.Thread(target=self._run_loop, name='SimServer')
+            thread.daemon = True
+            thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+    def _run_loop(self):
+        # start_in_thread 中新建的事件循环的线程：停止之后关闭事件循环
+        loop = self._loop
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def close(self):
+        """停止监听
+
+        如果事件循环是在 :meth:`start_in_thread` 中新建的，也将其停止并关闭。
+        """
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._server = None
+        if self._own_loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
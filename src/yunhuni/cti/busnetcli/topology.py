@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""`smartbus` 拓扑登记表
+
+由全局连接事件（见 :meth:`Client.initialize` 的 `global_connect_callback` ）维护的、
+`smartbus` 上各个节点客户端的实时视图。
+
+`smartbus` 最多有 :data:`MAX_SMARTBUS_NODE_NUM` 个单元，每个单元最多 :data:`MAX_SMARTBUS_NODE_CLI_NUM` 个客户端。
+:class:`Topology` 以 `unit_id * MAX_SMARTBUS_NODE_CLI_NUM + client_id` 为下标，将节点保存在一个定长数组中，
+按地址的查找是一次下标访问；同时按客户端类型分组，按类型的查找返回缓存的元组，在该类型的节点变化之前不重新构造。
+
+:class:`Client` 有一个内置的登记表，它接收所有的全局连接事件::
+
+    topology = Client.topology()
+    ipsc_nodes = topology.by_type(SMARTBUS_NODECLI_TYPE_IPSC)
+    if topology.get(0, 3) is not None:
+        ...
+
+:class:`LoopbackClient` 的每个实例各自有一个登记表（ ``client.topology()`` ），只接收该连接上的全局连接事件，连接断开时被清空。
+
+每次变化，递增全局的 :attr:`Topology.version` 与所在单元的 :meth:`Topology.unit_version` ，
+并依次调用通过 :meth:`Topology.subscribe` 登记的订阅函数。
+"""
+
+from __future__ import absolute_import
+
+import threading
+from collections import namedtuple
+
+from ._c.mutual import MAX_SMARTBUS_NODE_NUM, MAX_SMARTBUS_NODE_CLI_NUM
+from .utils import LoggerMixin
+
+__all__ = ['Node', 'Topology', 'CHANGE_UP', 'CHANGE_DOWN', 'CHANGE_UPDATE']
+
+#: 变化类型：节点出现
+CHANGE_UP = 'up'
+
+#: 变化类型：节点断开
+CHANGE_DOWN = 'down'
+
+#: 变化类型：已有节点的类型、连接点或附加信息变化
+CHANGE_UPDATE = 'update'
+
+_NODE_SLOTS = MAX_SMARTBUS_NODE_NUM * MAX_SMARTBUS_NODE_CLI_NUM
+
+#: 一个节点客户端
+Node = namedtuple('Node', ('unit_id', 'client_id', 'client_type', 'access_unit_id', 'info'))
+
+
+def _slot(unit_id, client_id):
+    # 地址在表内的，返回数组下标；否则返回 -1
+    if 0 <= unit_id < MAX_SMARTBUS_NODE_NUM and 0 <= client_id < MAX_SMARTBUS_NODE_CLI_NUM:
+        return unit_id * MAX_SMARTBUS_NODE_CLI_NUM + client_id
+    return -1
+
+
+class Topology(LoggerMixin):
+    """线程安全的 `smartbus` 拓扑登记表
+
+    地址超出 `MAX_SMARTBUS_NODE_NUM` × `MAX_SMARTBUS_NODE_CLI_NUM` 范围的节点（如 client id 较大的 net 客户端），
+    保存在一个额外的字典中，查找同样是 O(1) 的。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._nodes = [None] * _NODE_SLOTS
+        self._overflow = {}
+        self._by_type = {}
+        self._type_cache = {}
+        self._count = 0
+        self._version = 0
+        self._unit_versions = [0] * MAX_SMARTBUS_NODE_NUM
+        self._subscribers = []
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, address):
+        return self.get(*address) is not None
+
+    def __iter__(self):
+        return iter(self.nodes())
+
+    @property
+    def version(self):
+        """全局版本号。每次变化递增"""
+        return self._version
+
+    def unit_version(self, unit_id):
+        """单元的版本号。该单元的节点每次变化递增
+
+        :param int unit_id: 单元ID
+        :rtype: int
+        """
+        if 0 <= unit_id < MAX_SMARTBUS_NODE_NUM:
+            return self._unit_versions[unit_id]
+        return 0
+
+    def get(self, unit_id, client_id, default=None):
+        """按地址查找节点
+
+        :param int unit_id: 单元ID
+        :param int client_id: 客户端ID
+        :return: 节点。不存在的，返回 `default`
+        :rtype: Node
+        """
+        i = _slot(unit_id, client_id)
+        if i < 0:
+            return self._overflow.get((unit_id, client_id), default)
+        node = self._nodes[i]
+        return default if node is None else node
+
+    def by_type(self, client_type):
+        """某一类型的全部节点
+
+        :param int client_type: 客户端类型，如 :data:`SMARTBUS_NODECLI_TYPE_IPSC`
+        :return: 按地址排序的节点元组。在该类型的节点变化之前，返回同一个对象
+        :rtype: tuple
+        """
+        nodes = self._type_cache.get(client_type)
+        if nodes is None:
+            with self._lock:
+                nodes = self._type_cache.get(client_type)
+                if nodes is None:
+                    nodes = self._type_cache[client_type] = tuple(
+                        sorted(self._by_type.get(client_type, {}).values())
+                    )
+        return nodes
+
+    def unit(self, unit_id):
+        """某一单元的全部节点
+
+        :param int unit_id: 单元ID
+        :return: 按客户端ID排序的节点列表
+        :rtype: list
+        """
+        with self._lock:
+            i = _slot(unit_id, 0)
+            nodes = [] if i < 0 else [node for node in self._nodes[i:i + MAX_SMARTBUS_NODE_CLI_NUM] if node is not None]
+            nodes.extend(sorted(node for node in self._overflow.values() if node.unit_id == unit_id))
+            return nodes
+
+    def nodes(self):
+        """全部节点
+
+        :return: 按地址排序的节点列表
+        :rtype: list
+        """
+        with self._lock:
+            nodes = [node for node in self._nodes if node is not None]
+            nodes.extend(sorted(self._overflow.values()))
+            return nodes
+
+    def subscribe(self, callback):
+        """订阅变化
+
+        :param callable callback: 订阅函数，形如 ``callback(change, node, version)`` ：
+
+            * `change` ： :data:`CHANGE_UP` 、 :data:`CHANGE_DOWN` 或 :data:`CHANGE_UPDATE`
+            * `node` ：变化后的节点。断开的，是断开前的节点
+            * `version` ：变化后的全局版本号
+
+            订阅函数在全局连接事件的回调线程中，按变化的顺序被调用，不应阻塞；其异常被记录到日志
+        """
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        """取消订阅
+
+        :param callable callback: :meth:`subscribe` 登记的订阅函数
+        """
+        with self._lock:
+            self._subscribers = [fn for fn in self._subscribers if fn != callback]
+
+    def on_global_connect(self, unit_id, client_id, client_type, access_unit_id, status, info):
+        """全局连接事件监听函数。参数见 :meth:`Client.initialize` 的 `global_connect_callback`
+        """
+        if status:
+            self.put(Node(unit_id, client_id, client_type, access_unit_id, info))
+        else:
+            self.remove(unit_id, client_id)
+
+    def put(self, node):
+        """加入或者更新节点
+
+        :param Node node: 节点
+        :return: 是否有变化
+        :rtype: bool
+        """
+        with self._lock:
+            old = self._store(node.unit_id, node.client_id, node)
+            if old == node:
+                return False
+            if old is not None:
+                self._ungroup(old)
+            self._by_type.setdefault(node.client_type, {})[(node.unit_id, node.client_id)] = node
+            self._type_cache.pop(node.client_type, None)
+            self._changed(CHANGE_UP if old is None else CHANGE_UPDATE, node)
+        return True
+
+    def remove(self, unit_id, client_id):
+        """移除节点
+
+        :param int unit_id: 单元ID
+        :param int client_id: 客户端ID
+        :return: 被移除的节点。不存在的，返回 `None`
+        :rtype: Node
+        """
+        with self._lock:
+            old = self._store(unit_id, client_id, None)
+            if old is not None:
+                self._ungroup(old)
+                self._changed(CHANGE_DOWN, old)
+        return old
+
+    def clear(self):
+        """移除全部节点，如本地客户端与 `smartbus` 断开时。每个节点都触发 :data:`CHANGE_DOWN`"""
+        for node in self.nodes():
+            self.remove(node.unit_id, node.client_id)
+
+    def _store(self, unit_id, client_id, node):
+        # 须在持有锁时调用。返回原有的节点
+        i = _slot(unit_id, client_id)
+        if i < 0:
+            old = self._overflow.pop((unit_id, client_id), None)
+            if node is not None:
+                self._overflow[(unit_id, client_id)] = node
+        else:
+            old = self._nodes[i]
+            self._nodes[i] = node
+        if old is None and node is not None:
+            self._count += 1
+        elif old is not None and node is None:
+            self._count -= 1
+        return old
+
+    def _ungroup(self, node):
+        # 须在持有锁时调用
+        group = self._by_type.get(node.client_type)
+        if group is not None:
+            group.pop((node.unit_id, node.client_id), None)
+            self._type_cache.pop(node.client_type, None)
+
+    def _changed(self, change, node):
+        # 须在持有锁时调用：订阅函数按变化的顺序被调用
+        self._version += 1
+        if 0 <= node.unit_id < MAX_SMARTBUS_NODE_NUM:
+            self._unit_versions[node.unit_id] += 1
+        for callback in self._subscribers:
+            try:
+                callback(change, node, self._version)
+            except Exception:
+                self.logger.exception('topology subscriber %s', callback)
+
+    def stats(self):
+        """登记表状态
+
+        :return: 包含 ``nodes`` （节点数）、 ``version`` 与 ``by_type`` （各类型的节点数）的字典
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'nodes': self._count,
+                'version': self._version,
+                'by_type': {client_type: len(group) for client_type, group in self._by_type.items() if group},
+            }
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+"""流程调用生命周期追踪
+
+每次流程调用记录为一个 :class:`FlowSpan` ，包含以下时刻：
+
+1. 开始调用： :meth:`Client.launch_flow` 被调用；
+2. 调用返回： `RemoteInvokeFlow` 返回 `invoke_id` ；
+3. 启动确认： C 库的 ``flow-ack`` 回调函数被调用；
+4. 结果返回： C 库的 ``flow-ret`` 回调函数被调用；
+5. 事件执行：最后一个事件函数（ :meth:`Client.on_flow_resp` 、 :meth:`Client.on_flow_timeout` 、
+   :meth:`Client.on_flow_error` ，或者无流程返回、启动失败时的 :meth:`Client.on_flow_ack` ）开始执行。
+
+由此可以区分耗时是在本地发送、 `IPSC` 启动确认、流程执行，还是在事件执行器的排队中。
+
+在构造 :class:`Client` 时，通过 `flow_tracer` 参数使用::
+
+    ring = RingExporter(4096)
+    client = MyClient(..., flow_tracer=FlowTracer(ring))
+    ...
+    print(summarize(ring.spans()))
+
+调用完成的 :class:`FlowSpan` 交给导出器（ :class:`SpanExporter` 的子类）。
+内置的导出器有：写入 JSON Lines 文件的 :class:`JsonLinesExporter` ，以及保存在内存环形缓冲区中的 :class:`RingExporter` 。
+"""
+
+from __future__ import absolute_import
+
+import io
+import json
+import threading
+from collections import OrderedDict, deque
+from time import time
+
+from ._c.mutual import SMARTBUS_ERR_TIMEOUT
+from .metrics import Histogram
+from .utils import LoggerMixin, perf_counter
+
+__all__ = ['FlowSpan', 'FlowTracer', 'SpanExporter', 'JsonLinesExporter', 'RingExporter', 'summarize']
+
+#: :class:`FlowTracer` 默认最多跟踪的未完成调用数。超过时，最早的调用以 ``incomplete`` 结果导出
+DEFAULT_MAX_PENDING = 65536
+
+#: :class:`RingExporter` 默认的容量
+DEFAULT_RING_CAPACITY = 4096
+
+#: 事件函数：启动确认
+EVENT_ACK = 'ack'
+
+#: 事件函数：结果返回
+EVENT_RETURN = 'return'
+
+#: :meth:`FlowSpan.to_dict` 输出、 :func:`summarize` 统计的各阶段耗时
+PHASES = ('launch_ms', 'ack_ms', 'execute_ms', 'dispatch_ms', 'total_ms')
+
+
+def _ms(begin, end):
+    if begin is None or end is None:
+        return None
+    # “早到”的回调可能先于 RemoteInvokeFlow 返回
+    return max(end - begin, 0.0) * 1000
+
+
+class FlowSpan(object):
+    """一次流程调用的追踪记录
+
+    时刻属性（ `launch_start` 等）是 :func:`time.perf_counter` 的值，只在同一进程中可比较；
+    `start_time` 是开始调用时的 Unix 时间戳。尚未发生的时刻是 `None` 。
+    """
+
+    __slots__ = (
+        'client_id', 'invoke_id', 'server_unit_id', 'process_index', 'project_id', 'flow_id', 'mode',
+        'start_time', 'launch_start', 'launch_end', 'ack_time', 'ack', 'return_time', 'status',
+        'ack_handler_time', 'return_handler_time', 'launched',
+    )
+
+    def __init__(self, client_id, invoke_id):
+        self.client_id = client_id
+        self.invoke_id = invoke_id
+        self.server_unit_id = None
+        self.process_index = None
+        self.project_id = None
+        self.flow_id = None
+        self.mode = None
+        self.start_time = None
+        self.launch_start = None
+        self.launch_end = None
+        self.ack_time = None
+        self.ack = None
+        self.return_time = None
+        self.status = None
+        self.ack_handler_time = None
+        self.return_handler_time = None
+        self.launched = False
+
+    def __repr__(self):
+        return '<{} client_id={} invoke_id={} project_id={!r} flow_id={!r} outcome={}>'.format(
+            self.__class__.__name__, self.client_id, self.invoke_id, self.project_id, self.flow_id, self.outcome
+        )
+
+    @property
+    def complete(self):
+        """调用是否已经结束，且最后一个事件函数已经开始执行"""
+        if not self.launched:
+            return False
+        if self.return_handler_time is not None:
+            return True
+        return self.ack_handler_time is not None and (self.ack != 1 or self.mode != 0)
+
+    @property
+    def outcome(self):
+        """调用结果： ``ok`` 、 ``timeout`` 、 ``error`` 、 ``ack_error`` （启动失败）或 ``incomplete`` （尚未结束）"""
+        if self.status is not None:
+            if self.status == 1:
+                return 'ok'
+            return 'timeout' if self.status == SMARTBUS_ERR_TIMEOUT else 'error'
+        if self.ack is not None and (self.ack != 1 or self.mode != 0):
+            return 'ok' if self.ack == 1 else 'ack_error'
+        return 'incomplete'
+
+    def to_dict(self):
+        """转为可以 JSON 序列化的字典
+
+        除了调用的属性，还包含以毫秒为单位的各阶段耗时（未发生的是 `None` ）：
+
+        * ``launch_ms`` : 开始调用到调用返回，即本地发送
+        * ``ack_ms`` : 调用返回到启动确认，即 `IPSC` 启动流程
+        * ``execute_ms`` : 启动确认到结果返回，即流程执行
+        * ``dispatch_ms`` : 最后一个回调到对应的事件函数开始执行，即事件执行器中的排队
+        * ``total_ms`` : 开始调用到最后一个事件函数开始执行
+
+        :rtype: dict
+        """
+        if self.return_time is not None:
+            last_callback, handler_time = self.return_time, self.return_handler_time
+        else:
+            last_callback, handler_time = self.ack_time, self.ack_handler_time
+        return OrderedDict([
+            ('client_id', self.client_id),
+            ('invoke_id', self.invoke_id),
+            ('server_unit_id', self.server_unit_id),
+            ('process_index', self.process_index),
+            ('project_id', self.project_id),
+            ('flow_id', self.flow_id),
+            ('mode', self.mode),
+            ('start_time', self.start_time),
+            ('ack', self.ack),
+            ('status', self.status),
+            ('outcome', self.outcome),
+            ('launch_ms', _ms(self.launch_start, self.launch_end)),
+            ('ack_ms', _ms(self.launch_end, self.ack_time)),
+            ('execute_ms', _ms(self.ack_time, self.return_time)),
+            ('dispatch_ms', _ms(last_callback, handler_time)),
+            ('total_ms', _ms(self.launch_start, handler_time)),
+        ])
+
+
+class SpanExporter(object):
+    """导出器基类"""
+
+    def export(self, span):
+        """导出一个调用完成的 :class:`FlowSpan`
+
+        在 C 库的回调线程或者事件执行器的线程中被调用，不应阻塞
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """关闭导出器"""
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    """将 :meth:`FlowSpan.to_dict` 逐行写入 JSON Lines 文件
+
+    :param file: 文件路径，或者已打开的文本文件对象。是路径的，以追加、行缓冲方式打开，在 :meth:`close` 时关闭
+    """
+
+    def __init__(self, file):
+        if isinstance(file, str):
+            self._file = io.open(file, 'a', buffering=1, encoding='utf-8')
+            self._owns_file = True
+        else:
+            self._file = file
+            self._owns_file = False
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._owns_file:
+                self._file.close()
+            else:
+                self._file.flush()
+
+
+class RingExporter(SpanExporter):
+    """将 :class:`FlowSpan` 保存在内存中的环形缓冲区，满时丢弃最早的记录
+
+    :param int capacity: 容量
+    """
+
+    def __init__(self, capacity=DEFAULT_RING_CAPACITY):
+        self._spans = deque(maxlen=int(capacity))
+
+    def __len__(self):
+        return len(self._spans)
+
+    def export(self, span):
+        self._spans.append(span)
+
+    def spans(self):
+        """缓冲区中的记录，按导出顺序排列
+
+        :rtype: list
+        """
+        return list(self._spans)
+
+    def clear(self):
+        """清空缓冲区"""
+        self._spans.clear()
+
+    def summary(self):
+        """缓冲区中的记录的统计，见 :func:`summarize`"""
+        return summarize(self.spans())
+
+
+class FlowTracer(LoggerMixin):
+    """流程调用追踪器
+
+    由 :class:`Client` 在流程调用的各个环节中调用；调用完成时，将 :class:`FlowSpan` 交给导出器。
+    可以由多个客户端共用。
+
+    :param SpanExporter exporter: 导出器
+    :param int max_pending: 最多跟踪的未完成调用数。超过时，最早的调用以 ``incomplete`` 结果导出
+    """
+
+    def __init__(self, exporter, max_pending=DEFAULT_MAX_PENDING):
+        self._exporter = exporter
+        self._max_pending = int(max_pending)
+        self._lock = threading.Lock()
+        self._spans = OrderedDict()
+        self._exported = 0
+        self._evicted = 0
+
+    @property
+    def exporter(self):
+        """导出器"""
+        return self._exporter
+
+    def _get(self, client_id, invoke_id):
+        # 须在持有锁时调用。回调可能先于 launched 到达，此时先建立空白的记录
+        key = (client_id, invoke_id)
+        span = self._spans.get(key)
+        if span is None:
+            span = self._spans[key] = FlowSpan(client_id, invoke_id)
+            if len(self._spans) > self._max_pending:
+                self._evicted += 1
+                return span, self._spans.popitem(last=False)[1]
+        return span, None
+
+    def _export(self, span):
+        try:
+            self._exporter.export(span)
+        except Exception:
+            self.logger.exception('export %r', span)
+
+    def _update(self, client_id, invoke_id, update):
+        with self._lock:
+            span, evicted = self._get(client_id, invoke_id)
+            update(span)
+            if span.complete:
+                del self._spans[(client_id, invoke_id)]
+                self._exported += 1
+            else:
+                span = None
+        if evicted is not None and evicted.launched:
+            self._export(evicted)
+        if span is not None:
+            self._export(span)
+
+    def launched(self, client_id, invoke_id, server_unit_id, process_index, project_id, flow_id, mode,
+                 launch_start, launch_end=None):
+        """记录调用开始
+
+        :param float launch_start: 开始调用的时刻（ :func:`time.perf_counter` ）
+        :param float launch_end: `RemoteInvokeFlow` 返回的时刻。默认为当前时刻
+
+        其它参数同 :meth:`Client.launch_flow`
+        """
+        if launch_end is None:
+            launch_end = perf_counter()
+        start_time = time() - (perf_counter() - launch_start)
+
+        def update(span):
+            span.server_unit_id = server_unit_id
+            span.process_index = process_index
+            span.project_id = project_id
+            span.flow_id = flow_id
+            span.mode = mode
+            span.start_time = start_time
+            span.launch_start = launch_start
+            span.launch_end = launch_end
+            span.launched = True
+
+        self._update(client_id, invoke_id, update)
+
+    def acked(self, client_id, invoke_id, ack, now):
+        """记录启动确认
+
+        :param int ack: 启动确认的状态码
+        :param float now: 回调的时刻（ :func:`time.perf_counter` ）
+        """
+        def update(span):
+            span.ack = ack
+            span.ack_time = now
+
+        self._update(client_id, invoke_id, update)
+
+    def returned(self, client_id, invoke_id, status, now):
+        """记录结果返回
+
+        :param int status: 返回值
+        :param float now: 回调的时刻（ :func:`time.perf_counter` ）
+        """
+        def update(span):
+            span.status = status
+            span.return_time = now
+
+        self._update(client_id, invoke_id, update)
+
+    def handled(self, client_id, invoke_id, event, now):
+        """记录事件函数开始执行
+
+        :param str event: :data:`EVENT_ACK` 或 :data:`EVENT_RETURN`
+        :param float now: 事件函数开始执行的时刻（ :func:`time.perf_counter` ）
+        """
+        def update(span):
+            if event == EVENT_ACK:
+                span.ack_handler_time = now
+            else:
+                span.return_handler_time = now
+
+        self._update(client_id, invoke_id, update)
+
+    def stats(self):
+        """追踪器状态
+
+        :return: 包含 ``pending`` （未完成的调用数）、 ``exported`` （已导出数）与 ``evicted`` （因超过上限被提前导出的数量）的字典
+        :rtype: dict
+        """
+        with self._lock:
+            return {'pending': len(self._spans), 'exported': self._exported, 'evicted': self._evicted}
+
+    def close(self):
+        """关闭导出器"""
+        self._exporter.close()
+
+
+def summarize(spans):
+    """按流程项目与 `IPSC` 进程统计调用的各阶段耗时
+
+    :param spans: :class:`FlowSpan` 序列
+    :return: 以 `(project_id, server_unit_id, process_index)` 为键的字典。
+        值是字典，包含 ``count`` 、按结果分类的 ``outcomes`` ，以及 :data:`PHASES` 中每个阶段耗时（毫秒）的
+        ``p50`` 、 ``p90`` 、 ``p99`` 与 ``max``
+    :rtype: dict
+    """
+    groups = {}
+    for span in spans:
+        key = (span.project_id, span.server_unit_id, span.process_index)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ({}, dict((phase, Histogram()) for phase in PHASES))
+        outcomes, histograms = group
+        outcomes[span.outcome] = outcomes.get(span.outcome, 0) + 1
+        d = span.to_dict()
+        for phase in PHASES:
+            if d[phase] is not None:
+                histograms[phase].record(d[phase] * 1000)
+    result = {}
+    for key, (outcomes, histograms) in groups.items():
+        item = result[key] = {'count': sum(outcomes.values()), 'outcomes': outcomes}
+        for phase, histogram in histograms.items():
+            p50, p90, p99 = histogram.percentiles((0.5, 0.9, 0.99))
+            snapshot = histogram.snapshot()
+            item[phase] = {
+                'p50': p50 / 1000.0,
+                'p90': p90 / 1000.0,
+                'p99': p99 / 1000.0,
+                'max': snapshot['max'] / 1000.0,
+            } if histogram.count else None
+    return result
@@ -6,8 +6,16 @@ Some helper functions
 
 import sys
 import logging
+from binascii import hexlify
 
-__all__ = ['b2s_recode', 's2b_recode', 'to_bytes', 'to_str', 'to_unicode', 'LoggerMixin']
+try:
+    from time import monotonic, perf_counter
+except ImportError:  # Python 2
+    # Python 2 has neither clock, fall back to the wall clock.
+    from time import time as monotonic
+    from time import time as perf_counter
+
+__all__ = ['b2s_recode', 's2b_recode', 'to_bytes', 'to_str', 'to_unicode', 'hex_preview', 'DecodeCache', 'LoggerMixin']
 
 if bytes != str:  # Python 3
     #: Define text string data type, same as that in Python 2.x.
@@ -120,6 +128,57 @@ def to_unicode(s, encoding='utf-8'):
         raise TypeError('Type of argument "s" is neither "str" nor "bytes".')
 
 
+def hex_preview(data, limit=32, size=None):
+    """Hexadecimal preview of binary data, for logging.
+
+    :param data: `bytes` or other buffer object.
+    :param int limit: Max number of bytes in the preview.
+    :param int size: Total size of data, default is ``len(data)``.
+    :return: Such as ``68656c6c6f...(+1019 bytes)``
+    :rtype: str
+    """
+    if size is None:
+        size = len(data)
+    s = to_str(hexlify(bytes(data[:limit])))
+    if size > limit:
+        s = '{0}...(+{1} bytes)'.format(s, size - limit)
+    return s
+
+
+class DecodeCache(object):
+    """Bounded cache of decoded identifier strings, such as project IDs in flow callbacks.
+
+    Calling the cache with a `bytes` string returns it decoded with `encoding`,
+    with NUL characters and whitespace stripped. In Python 2, the result is re-encoded to `utf-8` `str`,
+    the same as :func:`b2s_recode`. Results are interned and cached by the raw `bytes`,
+    so the same identifier is decoded only once. When `capacity` is reached, the cache is cleared.
+
+    :param str encoding: Decoding codec.
+    :param int capacity: Max number of cached strings.
+    """
+
+    __slots__ = ('_encoding', '_capacity', '_cache')
+
+    def __init__(self, encoding='utf-8', capacity=4096):
+        self._encoding = encoding
+        self._capacity = int(capacity)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __call__(self, bs):
+        s = self._cache.get(bs)
+        if s is None:
+            s = b2s_recode(bs.strip(b'\x00'), self._encoding, 'utf-8').strip()
+            if bytes != str:  # Python 3
+                s = sys.intern(s)
+            if len(self._cache) >= self._capacity:
+                self._cache.clear()
+            self._cache[bs] = s
+        return s
+
+
 class LoggerMixin:
     """Mixin Class provide a :attr:`logger` property
     """
@@ -131,12 +190,20 @@ class LoggerMixin:
         :rtype: logging.Logger
 
         logger name format is `ModuleName.ClassName`
+
+        The logger is cached in the class on first access.
         """
+        try:
+            return cls.__dict__['_LoggerMixin_logger']
+        except KeyError:
+            pass
         try:
             name = '{0.__module__:s}.{0.__qualname__:s}'.format(cls)
         except AttributeError:
             name = '{0.__module__:s}.{0.__name__:s}'.format(cls)
-        return logging.getLogger(name)
+        logger = logging.getLogger(name)
+        setattr(cls, '_LoggerMixin_logger', logger)
+        return logger
 
     @property
     def logger(self):
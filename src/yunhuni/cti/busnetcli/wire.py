@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+
+"""连接 :class:`SimServer` 的模拟器回环传输
+
+:class:`LoopbackClient` 不加载 `busnetcli` 共享库，而是在 :mod:`asyncio` 套接字上，
+以本模块定义的线路协议连接 :mod:`yunhuni.cti.busnetcli.sim` 中的 :class:`SimServer` 。
+它提供与 :class:`Client` 相同的 API ，用于在没有 SmartBus 节点与 `busnetcli` 共享库的环境中测试、压测应用程序，并且：
+
+* 没有进程级的全局状态：同一个进程中可以有多个相互独立的实例，各自连接不同的模拟总线；
+* 网络 I/O 在 :mod:`asyncio` 事件循环中进行，多个数据包合并成一次向量写。
+
+数据包的格式：
+
+* 包头与 :class:`PacketHeader` 的字段顺序相同，1字节对齐、小端字节序， `long` 字段为 4 字节，共 20 字节。
+  `head_flag` 是 `0x5b15` ， `packet_size` 是包头与包体的总长度， `datalen` 是包体长度；
+* `cmd_type` 为 :data:`SMARTBUS_CMDTYPE_INTERNAL` 、 :data:`SMARTBUS_CMDTYPE_SYSTEM` 的数据包用于注册、PING、流程调用等控制命令，
+  其 `cmd` 与包体格式见本模块的 `WIRE_*` 常量。应用数据不应使用这两种 `cmd_type` 。
+
+.. warning::
+    控制命令的包体格式由本模块自行定义，不是 SmartBus 的控制包格式。
+    :class:`LoopbackClient` 只能连接 :class:`SimServer` ，不能连接真实的 SmartBus 节点；
+    连接生产环境的总线，应使用基于 `busnetcli` 共享库的 :class:`Client` 。
+
+.. attention:: 该模块需要 Python 3.5 以上版本
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import struct
+import threading
+from itertools import count
+
+from ._c.mutual import *
+from .client import Client
+from .dispatch import BatchDispatcher
+from .errors import check
+from .head import Head
+from .topology import Topology
+from .utils import to_bytes, to_str, b2s_recode, s2b_recode
+
+__all__ = ['LoopbackClient', 'FrameDecoder', 'pack_head', 'ProtocolError']
+
+#: 包头标识
+HEAD_FLAG = 0x5b15
+
+#: 线路上的包头格式。解包时 `cmd` 、 `cmd_type` 是有符号数，与 :class:`Head` 一致
+WIRE_HEAD_STRUCT = struct.Struct('<HbbBBBBBB2xii')
+
+#: 线路上的包头长度
+WIRE_HEAD_SIZE = WIRE_HEAD_STRUCT.size
+
+_WIRE_HEAD_PACK_STRUCT = struct.Struct('<HBBBBBBBB2xii')
+
+#: 默认的最大数据包长度
+DEFAULT_MAX_PACKET_SIZE = 16 << 20
+
+#: 默认的重连间隔（秒）
+DEFAULT_RECONNECT_INTERVAL = 3.0
+
+#: 默认的发送缓冲区上限（字节）。超过时，发送函数返回 :data:`SMARTBUS_ERR_BUFF_FULL` 错误
+DEFAULT_SEND_BUFFER_LIMIT = 4 << 20
+
+#: 注册。 `cmd_type` : INTERNAL ，包体： ``user \0 password \0 info``
+WIRE_CMD_REGISTER = 1
+#: 注册应答。 `cmd_type` : INTERNAL ，包体： :data:`REGISTER_ACK_STRUCT`
+WIRE_CMD_REGISTER_ACK = 2
+#: 全局连接事件。 `cmd_type` : INTERNAL ，包体： :data:`GLOBAL_CONNECT_STRUCT` + ``info``
+WIRE_CMD_GLOBAL_CONNECT = 3
+#: PING。 `cmd_type` : SYSTEM ，包体：任意数据，应答包的 `cmd_type` 是 :data:`SMARTBUS_SYSCMD_PING_ACK` ，包体原样返回
+WIRE_SYSCMD_PING = 7
+#: 流程调用。 `cmd_type` : SYSTEM ，包体： :data:`FLOW_INVOKE_STRUCT` + ``project_id \0 flow_id \0 params``
+WIRE_SYSCMD_FLOW_INVOKE = 16
+#: 流程启动确认。 `cmd_type` : SYSTEM ，包体： :data:`FLOW_RESULT_STRUCT` + ``project_id \0 msg``
+WIRE_SYSCMD_FLOW_ACK = 17
+#: 流程结果返回。 `cmd_type` : SYSTEM ，包体： :data:`FLOW_RESULT_STRUCT` + ``project_id \0 params``
+WIRE_SYSCMD_FLOW_RET = 18
+#: 通知消息。 `cmd_type` : SYSTEM ，包体： :data:`NOTIFY_STRUCT` + ``project_id \0 title \0 txt``
+WIRE_SYSCMD_NOTIFY = 19
+
+#: 注册应答：ack（0 表示成功）, access_unit_id
+REGISTER_ACK_STRUCT = struct.Struct('<ii')
+#: 全局连接事件：unit_id, client_id, client_type, access_unit_id, status
+GLOBAL_CONNECT_STRUCT = struct.Struct('<BBBBB')
+#: 流程调用：invoke_id, timeout（毫秒）, mode
+FLOW_INVOKE_STRUCT = struct.Struct('<iiB')
+#: 流程启动确认/结果返回：invoke_id, ack 或 ret
+FLOW_RESULT_STRUCT = struct.Struct('<ii')
+#: 通知消息：invoke_id, expires（毫秒）, mode
+NOTIFY_STRUCT = struct.Struct('<iiB')
+
+
+class ProtocolError(Exception):
+    """线路协议错误
+    """
+    pass
+
+
+def pack_head(cmd, cmd_type, src_client_type, src_unit_id, src_client_id, dst_client_type, dst_unit_id, dst_client_id,
+              data_length):
+    """打包一个线路包头
+
+    :return: 20 字节的包头
+    :rtype: bytes
+    """
+    return _WIRE_HEAD_PACK_STRUCT.pack(
+        HEAD_FLAG, cmd & 0xff, cmd_type & 0xff,
+        src_client_type & 0xff, src_unit_id & 0xff, src_client_id & 0xff,
+        dst_client_type & 0xff, dst_unit_id & 0xff, dst_client_id & 0xff,
+        WIRE_HEAD_SIZE + data_length, data_length
+    )
+
+
+class FrameDecoder(object):
+    """从字节流中切分数据包
+
+    :param callable on_frame: 每切分出一个数据包，调用一次 ``on_frame(fields, payload)`` 。
+        `fields` 是 :data:`WIRE_HEAD_STRUCT` 解包的结果， ``fields[1:]`` 可直接用于 :meth:`Head._make` ；
+        `payload` 是包体的 :class:`memoryview` ，仅在 `on_frame` 返回前有效。
+    :param int max_packet_size: 最大数据包长度
+    """
+
+    def __init__(self, on_frame, max_packet_size=DEFAULT_MAX_PACKET_SIZE):
+        self._on_frame = on_frame
+        self._max_packet_size = int(max_packet_size)
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """输入收到的数据
+
+        :param bytes data: 数据
+        :raises ProtocolError: 数据包格式错误
+        """
+        buffer = self._buffer
+        buffer += data
+        size = len(buffer)
+        offset = 0
+        unpack_from = WIRE_HEAD_STRUCT.unpack_from
+        on_frame = self._on_frame
+        with memoryview(buffer) as view:
+            while size - offset >= WIRE_HEAD_SIZE:
+                fields = unpack_from(view, offset)
+                packet_size = fields[9]
+                data_length = fields[10]
+                if fields[0] != HEAD_FLAG:
+                    raise ProtocolError('Invalid head flag 0x{:04x}'.format(fields[0]))
+                if not (0 <= data_length <= packet_size - WIRE_HEAD_SIZE) or packet_size > self._max_packet_size:
+                    raise ProtocolError('Invalid packet size {}/{}'.format(packet_size, data_length))
+                if size - offset < packet_size:
+                    break
+                start = offset + WIRE_HEAD_SIZE
+                payload = view[start:start + data_length]
+                try:
+                    on_frame(fields, payload)
+                finally:
+                    payload.release()
+                offset += packet_size
+        if offset:
+            del buffer[:offset]
+
+
+class _ClientProtocol(asyncio.Protocol):
+
+    def __init__(self, client):
+        self._client = client
+        self._decoder = FrameDecoder(client._on_frame)
+        self.closed = client._loop.create_future()
+
+    def connection_made(self, transport):
+        self._client._on_transport_made(transport)
+
+    def data_received(self, data):
+        try:
+            self._decoder.feed(data)
+        except ProtocolError:
+            self._client.logger.exception('protocol error')
+            self._client._transport.close()
+
+    def connection_lost(self, exc):
+        self._client._on_transport_lost(exc)
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class LoopbackClient(Client):
+    """连接 :class:`SimServer` 的模拟器回环客户端
+
+    与 :class:`Client` 的 API 相同，但不需要 :meth:`Client.initialize` ，也没有全局的实例表。
+    只能连接 :class:`SimServer` ，见本模块的说明。
+    实例可以多次建立，在不需要时调用 :meth:`close` 释放。
+
+    网络 I/O 在 :attr:`loop` 中进行。发送函数可以在任何线程中调用：
+    在事件循环线程之外调用时，数据包先进入队列，再在事件循环中合并写出。
+
+    事件函数的执行方式与 :class:`Client` 相同：默认在事件执行器中执行。
+    """
+
+    def __init__(self, client_id, client_type, master_ip, master_port, slave_ip=None, slave_port=None, user=None,
+                 password=None, info=None, unit_id=None, loop=None, global_connect_callback=None,
+                 reconnect_interval=DEFAULT_RECONNECT_INTERVAL, send_buffer_limit=DEFAULT_SEND_BUFFER_LIMIT,
+                 **kwargs):
+        """
+        参数 `client_id` ~ `info` 以及其它关键字参数与 :class:`Client` 构造函数相同
+
+        :param int unit_id: 本节点的单元ID，相当于 :meth:`Client.initialize` 的 `unit_id` 参数
+        :param asyncio.AbstractEventLoop loop: 进行网络 I/O 的事件循环。
+            默认为 `None` : 在 :meth:`activate` 时新建一个事件循环，并在一个新的守护线程中运行它
+        :param callable global_connect_callback: 全局连接事件回调函数，形式见 :meth:`Client.initialize`
+        :param float reconnect_interval: 连接断开或失败后，重新连接的间隔（秒）
+        :param int send_buffer_limit: 发送缓冲区上限（字节）
+
+        没有指定 `event_executor` 参数的，默认的事件执行器在 :meth:`close` 之后被关闭
+        """
+        if unit_id is None:
+            raise ValueError('argument "unit_id" is required')
+        self._own_executor = not kwargs.get('event_executor')
+        # 每个连接各自的拓扑登记表与全局连接事件监听函数（基类在构造时就会登记监听函数）
+        self._topology = Topology()
+        self._global_connect_listeners = []
+        super(LoopbackClient, self).__init__(client_id, client_type, master_ip, master_port, slave_ip, slave_port, user,
+                                         password, info, **kwargs)
+        self._unit_id = self._local_unit_id = int(unit_id)
+        self._loop = loop
+        self._own_loop = loop is None
+        self._loop_thread_id = None
+        self._global_connect_callback = global_connect_callback
+        self._reconnect_interval = float(reconnect_interval)
+        self._send_buffer_limit = int(send_buffer_limit)
+        self._transport = None
+        self._ready = False
+        self._closing = False
+        self._run_future = None
+        self._invoke_ids = count(1)
+        self._outbox = BatchDispatcher(self._call_soon_threadsafe, self._flush_outbox)
+
+    def _register(self, client_id):
+        pass  # 没有全局实例表
+
+    def topology(self):
+        """这个连接的 `smartbus` 拓扑登记表
+
+        与 :meth:`Client.topology` 不同，每个 :class:`LoopbackClient` 实例各自一个，只接收这个连接上的全局连接事件。
+        连接断开时被清空。
+
+        :rtype: Topology
+        """
+        return self._topology
+
+    def add_global_connect_listener(self, listener):
+        """登记这个连接的全局连接事件监听函数。见 :meth:`Client.add_global_connect_listener`
+
+        :param callable listener: 监听函数
+        """
+        if listener not in self._global_connect_listeners:
+            self._global_connect_listeners.append(listener)
+
+    def remove_global_connect_listener(self, listener):
+        """取消 :meth:`add_global_connect_listener` 登记的监听函数
+
+        :param callable listener: 监听函数
+        """
+        try:
+            self._global_connect_listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def _deliver_global_connect(self, callback, unit_id, client_id, client_type, access_unit_id, status, info):
+        self._apply_global_connect(self, callback, unit_id, client_id, client_type, access_unit_id, status, info)
+
+    @property
+    def loop(self):
+        """进行网络 I/O 的事件循环"""
+        return self._loop
+
+    @property
+    def connected(self):
+        """是否已连接并注册成功"""
+        return self._ready
+
+    def activate(self):
+        """激活客户端
+
+        在事件循环中建立连接，并在连接断开/失败时自动重连。该函数立即返回。
+        """
+        self.logger.info('<%s> connect', self._client_id)
+        if self._run_future is not None:
+            raise RuntimeError('Client already activated')
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self._run_loop,
+                                      name='{}-{}'.format(self.__class__.__name__, self._client_id))
+            thread.daemon = True
+            thread.start()
+        self._run_future = asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+
+    def _run_loop(self):
+        # activate 中新建的事件循环的线程：停止之后关闭事件循环
+        loop = self._loop
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def close(self):
+        """断开连接，停止重连
+
+        如果事件循环是在 :meth:`activate` 中新建的，也将其停止并关闭。
+        默认的事件执行器在连接断开事件之后被关闭。
+        未完成的 :meth:`launch_flow_async` 调用以 :data:`SMARTBUS_ERR_CONNECT_BREAK` 错误结束。
+        """
+        self._closing = True
+        self._shutdown(check(SMARTBUS_ERR_CONNECT_BREAK, False))
+        if self._run_future is None:
+            self._shutdown_executor()
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._close_in_loop)
+        except RuntimeError:
+            pass  # 事件循环已经关闭：已经关闭过
+
+    def _close_in_loop(self):
+        if self._transport is not None:
+            self._transport.close()
+        self._run_future.cancel()
+
+    async def _run(self):
+        addresses = [(self._master_ip, self._master_port)]
+        if self._slave_ip:
+            addresses.append((self._slave_ip, self._slave_port))
+        loop = self._loop
+        try:
+            for i in count():
+                if self._closing:
+                    break
+                host, port = addresses[i % len(addresses)]
+                try:
+                    _, protocol = await loop.create_connection(lambda: _ClientProtocol(self), host, port)
+                except OSError as e:
+                    self.logger.warning('<%s> connect %s:%s failed: %s', self._client_id, host, port, e)
+                    self._deliver_connect(0, SMARTBUS_ERR_ESTABLI_CONNECT)
+                else:
+                    await protocol.closed
+                if not self._closing:
+                    await asyncio.sleep(self._reconnect_interval)
+        finally:
+            if self._closing:
+                # 重连任务结束之后（连接断开事件已经分派），才关闭事件执行器、停止自己的事件循环
+                self._shutdown_executor()
+                if self._own_loop:
+                    loop.stop()
+
+    def _shutdown_executor(self):
+        if self._own_executor:
+            self._event_executor.shutdown(wait=False)
+
+    def _on_transport_made(self, transport):
+        self._loop_thread_id = threading.get_ident()
+        self._transport = transport
+        payload = b'\0'.join(to_bytes(s or '') for s in (self._user, self._password, self._info))
+        transport.writelines((
+            pack_head(WIRE_CMD_REGISTER, SMARTBUS_CMDTYPE_INTERNAL,
+                      self._client_type, self._local_unit_id, self._client_id, 0, 0, 0, len(payload)),
+            payload
+        ))
+
+    def _on_transport_lost(self, exc):
+        self._transport = None
+        self._topology.clear()
+        if self._ready:
+            self._ready = False
+            self._deliver_disconnect()
+
+    def _call_soon_threadsafe(self, fn):
+        self._loop.call_soon_threadsafe(fn)
+
+    def _flush_outbox(self, items):
+        transport = self._transport
+        if transport is None or transport.is_closing():
+            self.logger.warning('connection lost, drop %s packet(s)', len(items))
+            return
+        transport.writelines([chunk for item in items for chunk in item])
+
+    def _send_packet(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        error_code = self._write_packet(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data)
+        if error_code:
+            self._check(error_code)
+
+    def _write_packet(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        transport = self._transport
+        if not self._ready or transport is None:
+            return SMARTBUS_ERR_CONN_NOT_ESTAB
+        if transport.get_write_buffer_size() > self._send_buffer_limit:
+            return SMARTBUS_ERR_BUFF_FULL
+        if data and not isinstance(data, bytes):
+            data = bytes(data)  # 写入传输层之后，调用者仍可能修改可变的缓冲区
+        length = len(data) if data else 0
+        head = pack_head(cmd, cmd_type, self._client_type, self._local_unit_id, self._client_id,
+                         dst_client_type, dst_unit_id, dst_client_id, length)
+        item = (head, data) if length else (head,)
+        if threading.get_ident() == self._loop_thread_id:
+            transport.writelines(item)
+        else:
+            self._outbox.put(item)
+        return SMARTBUS_ERR_OK
+
+    def _on_frame(self, fields, payload):
+        try:
+            self._handle_frame(fields, payload)
+        except Exception:
+            # 只丢弃这个数据包，不影响连接
+            self.logger.exception('<%s> drop packet: head=%s, data=%s',
+                                  self._client_id, fields, self._format_payload(payload))
+
+    def _handle_frame(self, fields, payload):
+        cmd = fields[1]
+        cmd_type = fields[2]
+        if cmd_type == SMARTBUS_CMDTYPE_INTERNAL:
+            if cmd == WIRE_CMD_REGISTER_ACK:
+                ack, access_unit_id = REGISTER_ACK_STRUCT.unpack_from(payload)
+                if ack == 0:
+                    self._ready = True
+                else:
+                    self._transport.close()
+                self._deliver_connect(access_unit_id, ack)
+            elif cmd == WIRE_CMD_GLOBAL_CONNECT:
+                values = GLOBAL_CONNECT_STRUCT.unpack_from(payload)
+                info = to_str(payload[GLOBAL_CONNECT_STRUCT.size:].tobytes())
+                self._deliver_global_connect(self._global_connect_callback, *(values + (info,)))
+            return
+        if cmd_type == SMARTBUS_CMDTYPE_SYSTEM:
+            if cmd == WIRE_SYSCMD_PING:
+                if self._ready:
+                    self._send_packet(0, SMARTBUS_SYSCMD_PING_ACK, fields[4], fields[5], fields[3], payload.tobytes())
+            elif cmd == WIRE_SYSCMD_FLOW_ACK:
+                invoke_id, ack = FLOW_RESULT_STRUCT.unpack_from(payload)
+                project_id, _, msg = payload[FLOW_RESULT_STRUCT.size:].tobytes().partition(b'\0')
+                self._deliver_flow_ack(Head._make(fields[1:]), self._project_id_cache(project_id),
+                                       invoke_id, ack, b2s_recode(msg, 'cp936', 'utf-8'))
+            elif cmd == WIRE_SYSCMD_FLOW_RET:
+                invoke_id, ret = FLOW_RESULT_STRUCT.unpack_from(payload)
+                project_id, _, params = payload[FLOW_RESULT_STRUCT.size:].tobytes().partition(b'\0')
+                py_params = self._json_codec.decode(params) if ret == 1 else None
+                self._deliver_flow_ret(Head._make(fields[1:]), self._project_id_cache(project_id),
+                                       invoke_id, ret, py_params)
+            return
+        if not payload:
+            data = None
+        elif self._buffer_pool is None:
+            data = payload.tobytes()
+        else:
+            data = self._buffer_pool.copy(payload)
+        self._deliver_data(Head._make(fields[1:]), data)
+
+    _send_data = _write_packet
+
+    @staticmethod
+    def _payload_arg(data):
+        if not data:
+            return None, 0
+        if not isinstance(data, bytes):
+            data = bytes(data)  # 只复制一次，所有目标共用
+        return data, len(data)
+
+    def _send_buffer(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, buff, length):
+        return self._write_packet(cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, buff)
+
+    def _ping_buffer(self, dst_unit_id, dst_client_id, dst_client_type, buff, length):
+        return self._write_packet(WIRE_SYSCMD_PING, SMARTBUS_CMDTYPE_SYSTEM,
+                                  dst_unit_id, dst_client_id, dst_client_type, buff)
+
+    def ping(self, dst_unit_id, dst_client_id, dst_client_type, data=None):
+        logger = self._packet_logger()
+        if logger:
+            logger.debug(
+                'ping: '
+                'dst_unit_id=%s, dst_client_id=%s, dst_client_type=%s, data=%s',
+                dst_unit_id, dst_client_id, dst_client_type, self._format_payload(data)
+            )
+        self._send_packet(WIRE_SYSCMD_PING, SMARTBUS_CMDTYPE_SYSTEM, dst_unit_id, dst_client_id, dst_client_type, data)
+
+    def _send_notify(self, server_unit_id, process_index, project_id, title, mode, expires, txt):
+        iid = next(self._invoke_ids) & 0x7fffffff
+        payload = NOTIFY_STRUCT.pack(iid, int(expires * 1000), mode) + b'\0'.join((
+            to_bytes(project_id),
+            to_bytes(title) if title else b'',
+            s2b_recode(txt, 'utf-8', 'cp936') if txt else b''
+        ))
+        self._send_packet(WIRE_SYSCMD_NOTIFY, SMARTBUS_CMDTYPE_SYSTEM,
+                          server_unit_id, process_index, SMARTBUS_NODECLI_TYPE_IPSC, payload)
+        return iid
+
+    def _remote_invoke_flow(self, server_unit_id, process_index, project_id, flow_id, mode, timeout, params,
+                            prepared=None):
+        iid = next(self._invoke_ids) & 0x7fffffff
+        if prepared is None:
+            identifiers = to_bytes(project_id) + b'\0' + to_bytes(flow_id) + b'\0'
+        else:
+            identifiers = prepared.identifiers
+        payload = b''.join((
+            FLOW_INVOKE_STRUCT.pack(iid, int(timeout * 1000), mode),
+            identifiers,
+            self._encode_flow_params(params)
+        ))
+        self._send_packet(WIRE_SYSCMD_FLOW_INVOKE, SMARTBUS_CMDTYPE_SYSTEM,
+                          server_unit_id, process_index, SMARTBUS_NODECLI_TYPE_IPSC, payload)
+        return iid
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from yunhuni.cti.busnetcli.client import Client  # noqa: E402
+from yunhuni.cti.busnetcli.sim import SimBus, FakeLibrary  # noqa: E402
+
+#: 测试所用的本地单元ID
+UNIT_ID = 16
+
+_python2 = []
+
+
+def _find_python2():
+    """查找可用的 Python 2.7 解释器。可由环境变量 ``PYTHON2`` 指定"""
+    if not _python2:
+        candidates = [os.environ['PYTHON2']] if os.environ.get('PYTHON2') else ['python2.7', 'python2']
+        for executable in candidates:
+            try:
+                subprocess.check_call(
+                    [executable, '-c', 'import sys; assert sys.version_info[:2] == (2, 7)'],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+            except (OSError, subprocess.CalledProcessError):
+                continue
+            _python2.append(executable)
+            break
+        else:
+            _python2.append(None)
+    return _python2[0]
+
+
+def run_python2(source):
+    """用 Python 2.7 执行 `source`，返回标准输出。没有可用的解释器时跳过测试"""
+    executable = _find_python2()
+    if executable is None:
+        pytest.skip('Python 2.7 is not available')
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    process = subprocess.Popen(
+        [executable, '-c', source], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
+    )
+    out, err = process.communicate()
+    assert process.returncode == 0, err.decode('utf-8', 'replace')
+    return out.decode('utf-8')
+
+
+def wait_for(predicate, timeout=5.0, interval=0.005):
+    """等待 `predicate()` 为真。超时返回假"""
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+class RecordingClient(Client):
+    """记录所有事件的客户端"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingClient, self).__init__(*args, **kwargs)
+        self.events = []
+        self.connected = False
+
+    def on_connect(self):
+        self.connected = True
+        self.events.append(('connect',))
+
+    def on_disconnect(self):
+        self.connected = False
+        self.events.append(('disconnect',))
+
+    def on_data(self, head, data):
+        self.events.append(('data', head.cmd, head.cmd_type, data if data is None else bytes(data)))
+
+    def on_flow_ack(self, head, project_id, invoke_id, status_code, msg):
+        self.events.append(('ack', invoke_id, status_code))
+
+    def on_flow_resp(self, head, project_id, invoke_id, params):
+        self.events.append(('resp', invoke_id, params))
+
+    def on_flow_timeout(self, head, project_id, invoke_id):
+        self.events.append(('timeout', invoke_id))
+
+    def on_flow_error(self, head, project_id, invoke_id, error_code):
+        self.events.append(('error', invoke_id, error_code))
+
+    def on_send_fail(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data, error_code):
+        self.events.append(('send_fail', cmd, cmd_type, error_code))
+
+    def of(self, kind):
+        return [event for event in self.events if event[0] == kind]
+
+
+@pytest.fixture
+def bus():
+    """已启动的模拟总线。 :class:`Client` 以 :class:`FakeLibrary` 初始化，单元ID是 :data:`UNIT_ID`"""
+    sim_bus = SimBus().start()
+    sim_bus.add_ipsc(0, 0)
+    sim_bus.add_ipsc(0, 1)
+    Client.initialize(UNIT_ID, lib=FakeLibrary(sim_bus))
+    try:
+        yield sim_bus
+    finally:
+        Client.finalize()
+        sim_bus.stop()
+
+
+@pytest.fixture
+def make_client(bus):
+    """建立并激活客户端，等待连接成功"""
+
+    def factory(client_id, client_type=11, cls=RecordingClient, **kwargs):
+        client = cls(client_id, client_type, '127.0.0.1', 8000, **kwargs)
+        client.activate()
+        assert wait_for(lambda: client.connected)
+        return client
+
+    return factory
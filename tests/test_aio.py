@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import asyncio
+import threading
+
+import pytest
+
+from conftest import UNIT_ID, wait_for
+from yunhuni.cti.busnetcli.aio import AsyncClient
+from yunhuni.cti.busnetcli.buffers import BufferPool
+
+
+class AwaitingClient(AsyncClient):
+    """协程 :meth:`on_data` 在让出事件循环之后才读取数据"""
+
+    def __init__(self, *args, **kwargs):
+        super(AwaitingClient, self).__init__(*args, **kwargs)
+        self.received = []
+
+    async def on_data(self, head, data):
+        await asyncio.sleep(0)
+        self.received.append(bytes(data))
+
+
+@pytest.fixture
+def loop():
+    event_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=event_loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield event_loop
+    finally:
+        event_loop.call_soon_threadsafe(event_loop.stop)
+        thread.join(5)
+        event_loop.close()
+
+
+def run(loop, coro, timeout=5):
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+def test_connected_event_created_on_loop(bus, loop):
+    client = AsyncClient(21, 11, '127.0.0.1', 8000, loop=loop)
+    assert not client.connected
+    client.activate()
+    run(loop, asyncio.wait_for(client.wait_connected(), 5))
+    assert client.connected
+
+
+@pytest.mark.parametrize('pooled, batch', [(True, False), (False, True), (True, True)])
+def test_async_on_data_awaited(bus, loop, pooled, batch):
+    client = AwaitingClient(22, 11, '127.0.0.1', 8000, loop=loop, batch_dispatch=batch,
+                            buffer_pool=BufferPool() if pooled else None)
+    client.activate()
+    run(loop, asyncio.wait_for(client.wait_connected(), 5))
+    payloads = [('data-%d' % i).encode() for i in range(20)]
+    for payload in payloads:
+        bus.inject(UNIT_ID, 22, 1, 2, payload)
+    assert wait_for(lambda: len(client.received) == len(payloads))
+    assert sorted(client.received) == sorted(payloads)
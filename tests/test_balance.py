@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from yunhuni.cti.busnetcli.balance import Balancer, STRATEGY_EWMA
+from yunhuni.cti.busnetcli.errors import SmartBusError
+from yunhuni.cti.busnetcli.sim import FlowBehavior
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_DEST_NONEXIST, SMARTBUS_NODECLI_TYPE_IPSC
+
+from conftest import RecordingClient, wait_for
+
+
+class SweepingClient(RecordingClient):
+    sweep_interval = 0.02
+
+
+def _target(balancer, address):
+    for item in balancer.stats():
+        if (item['unit_id'], item['process_index']) == address:
+            return item
+
+
+def test_least_outstanding_spreads_calls():
+    balancer = Balancer([(0, 0), (0, 1)])
+    first = balancer.acquire()
+    second = balancer.acquire()
+    assert {first, second} == {(0, 0), (0, 1)}
+
+
+def test_no_target_available():
+    balancer = Balancer([(0, 0)])
+    balancer.on_global_connect(0, 0, SMARTBUS_NODECLI_TYPE_IPSC, 0, 0, '')
+    with pytest.raises(SmartBusError) as info:
+        balancer.choose()
+    assert info.value.code == SMARTBUS_ERR_DEST_NONEXIST
+
+
+def test_expire_lost_result():
+    balancer = Balancer([(0, 0)], expire_grace=1.0)
+    with balancer.launching():
+        balancer.launched(1, 100, (0, 0), 0, 10.0, timeout=5)
+    assert balancer.expire(now=15.5) == 0
+    assert _target(balancer, (0, 0))['outstanding'] == 1
+    assert balancer.expire(now=16.5) == 1
+    target = _target(balancer, (0, 0))
+    assert target['outstanding'] == 0
+    assert target['failed'] == 1
+    # 过期之后才到达的结果被忽略
+    balancer.returned(1, 100, 1, 17.0)
+    assert _target(balancer, (0, 0))['completed'] == 0
+
+
+def test_target_reset_on_disconnect_and_reconnect():
+    balancer = Balancer([(0, 0)], strategy=STRATEGY_EWMA)
+    with balancer.launching():
+        balancer.launched(1, 100, (0, 0), 0, 0.0, timeout=5)
+        balancer.launched(1, 101, (0, 0), 0, 0.0, timeout=5)
+    balancer.returned(1, 100, 1, 0.5)
+    assert _target(balancer, (0, 0))['ewma_ms'] == 500
+    balancer.on_global_connect(0, 0, SMARTBUS_NODECLI_TYPE_IPSC, 0, 0, '')
+    target = _target(balancer, (0, 0))
+    assert (target['up'], target['outstanding'], target['ewma_ms']) == (False, 0, None)
+    balancer.returned(1, 101, 1, 1.0)
+    assert _target(balancer, (0, 0))['outstanding'] == 0
+    balancer.on_global_connect(0, 0, SMARTBUS_NODECLI_TYPE_IPSC, 0, 1, '')
+    assert _target(balancer, (0, 0))['up']
+
+
+def test_client_sweeper_expires_balancer_entries(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    balancer = Balancer([(0, 0), (0, 1)], expire_grace=0.0)
+    client = make_client(1, cls=SweepingClient, balancer=balancer)
+    client.launch_flow(None, None, 'p', 'lost', 0, 0.05, [])
+    assert sum(item['outstanding'] for item in balancer.stats()) == 1
+    assert wait_for(lambda: sum(item['outstanding'] for item in balancer.stats()) == 0)
+    assert sum(item['failed'] for item in balancer.stats()) == 1
+
+
+def test_ipsc_disconnect_clears_outstanding(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    balancer = Balancer([(0, 0)])
+    client = make_client(1, balancer=balancer)
+    client.launch_flow(None, None, 'p', 'lost', 0, 30, [])
+    assert _target(balancer, (0, 0))['outstanding'] == 1
+    bus.detach(0, 0)
+    assert wait_for(lambda: not _target(balancer, (0, 0))['up'])
+    assert _target(balancer, (0, 0))['outstanding'] == 0
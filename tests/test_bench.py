@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import json
+import os
+import subprocess
+import sys
+
+from yunhuni.cti.busnetcli.bench import BENCHMARKS, percentiles
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def test_percentiles():
+    assert percentiles([]) == {}
+    result = percentiles([i / 1e6 for i in range(1, 101)])
+    assert result['count'] == 100
+    assert result['p50'] == 51.0
+    assert result['p99'] == 100.0
+    assert result['max'] == 100.0
+    assert result['mean'] == 50.5
+
+
+def test_bench_smoke():
+    # Client.initialize 是进程全局的，基准测试在单独的进程中运行
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'yunhuni.cti.busnetcli.bench', '-n', '50', '-s', '0,64', '-o', '-'],
+        env=env, timeout=120
+    )
+    report = json.loads(out.decode('utf-8'))
+    assert report['meta']['count'] == 50
+    assert set(report['results']) == set(BENCHMARKS)
+    assert [item['size'] for item in report['results']['send']] == [0, 64]
+    assert all(item['msgs_per_sec'] > 0 for item in report['results']['send'])
+    assert report['results']['flow']['rtt_us']['count'] == 50
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pickle
+
+import pytest
+
+from yunhuni.cti.busnetcli.buffers import BufferPool
+
+from conftest import UNIT_ID, RecordingClient, run_python2, wait_for
+
+
+def test_copy_and_reuse():
+    pool = BufferPool(min_size=16, max_size=1024)
+    view = pool.copy(b'hello')
+    assert bytes(view) == b'hello'
+    buffer = view.obj
+    pool.release(view)
+    again = pool.copy(b'world')
+    assert again.obj is buffer
+    assert bytes(again) == b'world'
+
+
+def test_release_twice_is_harmless():
+    pool = BufferPool()
+    view = pool.copy(b'x')
+    pool.release(view)
+    pool.release(view)
+
+
+def test_oversized_data_not_pooled():
+    pool = BufferPool(min_size=16, max_size=64)
+    view = pool.copy(b'x' * 100)
+    assert bytes(view) == b'x' * 100
+    pool.release(view)
+
+
+def test_released_view_is_invalidated():
+    pool = BufferPool()
+    view = pool.copy(b'abc')
+    pool.release(view)
+    with pytest.raises(ValueError):
+        bytes(view)
+
+
+def test_only_lent_views_are_released():
+    pool = BufferPool()
+    view = pool.copy(b'abc')
+    # 派生的 memoryview 不是借出的对象，不会归还缓冲区
+    pool.release(view[1:])
+    assert bytes(view) == b'abc'
+    assert not any(pool._free_lists)
+    pool.release(view)
+    assert sum(len(free_list) for free_list in pool._free_lists) == 1
+
+
+def test_exported_buffer_is_not_reused():
+    pool = BufferPool()
+    view = pool.copy(b'abc')
+    buffer = view.obj
+    # PickleBuffer 持有对该 memoryview 的导出，memoryview 无法释放
+    exported = pickle.PickleBuffer(view)
+    pool.release(view)
+    assert not pool._slots
+    assert pool.copy(b'xyz').obj is not buffer
+    assert bytes(exported) == b'abc'
+
+
+def test_copy_and_reuse_python2():
+    out = run_python2(
+        'from yunhuni.cti.busnetcli.buffers import BufferPool\n'
+        'pool = BufferPool(min_size=16, max_size=1024)\n'
+        'view = pool.copy(b"hello")\n'
+        'pool.release(view)\n'
+        'pool.release(view)\n'
+        'again = pool.copy(b"world")\n'
+        'assert len(pool._slots) == 1\n'
+        'print(again.tobytes())\n'
+    )
+    assert out.strip() == 'world'
+
+
+class PooledClient(RecordingClient):
+
+    def __init__(self, *args, **kwargs):
+        super(PooledClient, self).__init__(*args, **kwargs)
+        self.types = []
+
+    def on_data(self, head, data):
+        self.types.append(type(data))
+        super(PooledClient, self).on_data(head, data)
+        self.release_data(data)
+
+
+def test_client_receives_pooled_memoryview(bus, make_client):
+    client = make_client(1, cls=PooledClient, buffer_pool=BufferPool())
+    for i in range(50):
+        bus.inject(UNIT_ID, 1, 1, 2, ('payload-%d' % i).encode())
+    assert wait_for(lambda: len(client.of('data')) == 50)
+    assert set(client.types) == {memoryview}
+    assert sorted(event[3] for event in client.of('data')) == sorted(('payload-%d' % i).encode() for i in range(50))
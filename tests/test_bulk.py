@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from conftest import UNIT_ID, wait_for
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_DEST_NONEXIST, SMARTBUS_ERR_OTHER, SMARTBUS_SYSCMD_PING_ACK
+from yunhuni.cti.busnetcli.ratelimit import OP_SEND_DATA, POLICY_FAIL, RateLimiter
+
+
+def test_send_many(bus, make_client):
+    receivers = [make_client(2), make_client(3)]
+    client = make_client(1, metrics=True)
+    results = client.send_many([
+        (1, 2, UNIT_ID, 2, 11, b'a'),
+        (1, 2, UNIT_ID, 99, 11, b'lost'),
+        (1, 2, UNIT_ID, 3, 11, bytearray(b'b')),
+    ])
+    assert list(results) == [0, SMARTBUS_ERR_DEST_NONEXIST, 0]
+    assert wait_for(lambda: receivers[0].of('data') and receivers[1].of('data'))
+    assert receivers[0].of('data') == [('data', 1, 2, b'a')]
+    assert receivers[1].of('data') == [('data', 1, 2, b'b')]
+    metrics = client.stats()['metrics']
+    assert metrics['errors'] == {SMARTBUS_ERR_DEST_NONEXIST: 1}
+    assert sum(item['packets'] for item in metrics['sent']) == 2
+
+
+def test_broadcast(bus, make_client):
+    receivers = [make_client(client_id) for client_id in (2, 3, 4)]
+    client = make_client(1, metrics=True)
+    targets = [(UNIT_ID, client_id, 11) for client_id in (2, 3, 99, 4)]
+    assert list(client.broadcast(1, 2, targets, memoryview(b'all'))) == [0, 0, SMARTBUS_ERR_DEST_NONEXIST, 0]
+    assert wait_for(lambda: all(receiver.of('data') for receiver in receivers))
+    assert all(receiver.of('data') == [('data', 1, 2, b'all')] for receiver in receivers)
+    assert client.stats()['metrics']['sent'] == [{'cmd': 1, 'cmd_type': 2, 'packets': 3, 'bytes': 9}]
+
+
+def test_broadcast_rate_limited(bus, make_client):
+    make_client(2)
+    limiter = RateLimiter(policy=POLICY_FAIL)
+    limiter.set_limit(OP_SEND_DATA, 0.01, 2)
+    client = make_client(1, rate_limiter=limiter)
+    assert list(client.broadcast(1, 2, [(UNIT_ID, 2, 11)] * 3, b'x')) == [0, 0, SMARTBUS_ERR_OTHER]
+
+
+def test_ping_many(bus, make_client):
+    make_client(2)
+    make_client(3)
+    client = make_client(1)
+    targets = [(UNIT_ID, 2, 11), (UNIT_ID, 99, 11), (UNIT_ID, 3, 11)]
+    assert list(client.ping_many(targets, b'hi')) == [0, SMARTBUS_ERR_DEST_NONEXIST, 0]
+    assert wait_for(lambda: len(client.of('data')) == 2)
+    assert client.of('data') == [('data', 0, SMARTBUS_SYSCMD_PING_ACK, b'hi')] * 2
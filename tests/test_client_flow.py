@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from yunhuni.cti.busnetcli.client import Client
+from yunhuni.cti.busnetcli.errors import SmartBusError, InvocationTableFullError
+from yunhuni.cti.busnetcli.sim import FlowBehavior, FakeLibrary
+from yunhuni.cti.busnetcli._c.mutual import (SMARTBUS_ERR_TIMEOUT, SMARTBUS_ERR_CONNECT_BREAK, SMARTBUS_ERR_NON_INIT,
+                                             SMARTBUS_ERR_CLI_NOTEXIST)
+
+from conftest import UNIT_ID, wait_for
+
+
+class SweepingClient(Client):
+    sweep_interval = 0.02
+
+    connected = False
+
+    def on_connect(self):
+        self.connected = True
+
+
+def test_launch_flow_async_result(bus, make_client):
+    bus.set_flow('p', 'f', FlowBehavior(result=lambda params: [sum(params)]))
+    client = make_client(1)
+    assert client.launch_flow_async(0, 0, 'p', 'f', 0, 5, [1, 2, 3]).result(5) == [6]
+    assert wait_for(lambda: client.of('resp'))
+    invoke_id, params = client.of('resp')[0][1:]
+    assert params == [6]
+    assert client.of('ack') == [('ack', invoke_id, 1)]
+
+
+def test_launch_flow_async_no_return(bus, make_client):
+    client = make_client(1)
+    assert client.launch_flow_async(0, 0, 'p', 'f', 1, 5, []).result(5) is None
+    assert len(client._invocations) == 0
+
+
+def test_launch_flow_async_ack_failure(bus, make_client):
+    bus.set_flow('p', 'bad', FlowBehavior(ack=SMARTBUS_ERR_CLI_NOTEXIST, ack_msg='gone'))
+    client = make_client(1)
+    with pytest.raises(SmartBusError) as info:
+        client.launch_flow_async(0, 0, 'p', 'bad', 0, 5, []).result(5)
+    assert info.value.code == SMARTBUS_ERR_CLI_NOTEXIST
+
+
+def test_launch_flow_async_timeout(bus, make_client):
+    bus.set_flow('p', 'slow', FlowBehavior(ret=SMARTBUS_ERR_TIMEOUT))
+    client = make_client(1)
+    with pytest.raises(SmartBusError) as info:
+        client.launch_flow_async(0, 0, 'p', 'slow', 0, 0.05, []).result(5)
+    assert info.value.code == SMARTBUS_ERR_TIMEOUT
+
+
+def test_max_pending_invocations(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    client = make_client(1, max_pending_invocations=1)
+    client.launch_flow_async(0, 0, 'p', 'lost', 0, 5, [])
+    with pytest.raises(InvocationTableFullError):
+        client.launch_flow_async(0, 0, 'p', 'lost', 0, 5, [])
+
+
+def test_lost_result_expires_without_further_launches(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    client = make_client(1, cls=SweepingClient)
+    client._invocations._expire_grace = 0.0
+    fut = client.launch_flow_async(0, 0, 'p', 'lost', 0, 0.05, [])
+    with pytest.raises(SmartBusError) as info:
+        fut.result(5)
+    assert info.value.code == SMARTBUS_ERR_TIMEOUT
+    assert len(client._invocations) == 0
+
+
+def test_disconnect_cancels_pending(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    client = make_client(1)
+    fut = client.launch_flow_async(0, 0, 'p', 'lost', 0, 5, [])
+    bus.detach(UNIT_ID, 1)
+    with pytest.raises(SmartBusError) as info:
+        fut.result(5)
+    assert info.value.code == SMARTBUS_ERR_CONNECT_BREAK
+    assert len(client._invocations) == 0
+
+
+def test_finalize_cancels_pending(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    client = make_client(1)
+    fut = client.launch_flow_async(0, 0, 'p', 'lost', 0, 5, [])
+    Client.finalize()
+    try:
+        with pytest.raises(SmartBusError) as info:
+            fut.result(5)
+        assert info.value.code == SMARTBUS_ERR_NON_INIT
+        assert client._sweeper_stopped.is_set()
+    finally:
+        Client.initialize(UNIT_ID, lib=FakeLibrary(bus))  # 由 bus 夹具再次释放
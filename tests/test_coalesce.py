@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from yunhuni.cti.busnetcli.coalesce import FlowCoalescer
+from yunhuni.cti.busnetcli.errors import SmartBusError
+from yunhuni.cti.busnetcli.sim import FlowBehavior
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_TIMEOUT
+
+from conftest import RecordingClient, wait_for
+
+
+class SweepingClient(RecordingClient):
+    sweep_interval = 0.02
+
+
+def test_followers_share_leader_result(bus, make_client):
+    bus.set_flow('p', 'cfg', FlowBehavior(result=lambda params: [params[0] * 2], delay=0.2))
+    coalescer = FlowCoalescer()
+    coalescer.coalesce('p', 'cfg')
+    client = make_client(1, flow_coalescer=coalescer)
+    futures = [client.launch_flow_async(0, 0, 'p', 'cfg', 0, 5, [21]) for _ in range(5)]
+    assert [fut.result(5) for fut in futures] == [[42]] * 5
+    assert bus.counters['flow'] == 1
+    assert coalescer.stats() == {'in_flight': 0, 'led': 1, 'coalesced': 4}
+
+
+def test_followers_time_out_when_leader_result_lost(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    coalescer = FlowCoalescer(expire_grace=0.0)
+    coalescer.coalesce('p', 'lost')
+    client = make_client(1, cls=SweepingClient, flow_coalescer=coalescer)
+    client._invocations._expire_grace = 0.0
+    leader = client.launch_flow_async(0, 0, 'p', 'lost', 0, 0.1, [])
+    follower = client.launch_flow_async(0, 0, 'p', 'lost', 0, 0.1, [])
+    follower_invoke_id = client.launch_flow(0, 0, 'p', 'lost', 0, 0.1, [])
+    for fut in (leader, follower):
+        with pytest.raises(SmartBusError) as info:
+            fut.result(5)
+        assert info.value.code == SMARTBUS_ERR_TIMEOUT
+    assert wait_for(lambda: ('timeout', follower_invoke_id) in client.events)
+    assert coalescer.stats()['in_flight'] == 0
+    assert not coalescer._invokes
+
+
+def test_expire_keeps_flights_within_deadline(bus, make_client):
+    bus.set_flow('p', 'lost', FlowBehavior(delay=60))
+    coalescer = FlowCoalescer()
+    coalescer.coalesce('p', 'lost')
+    client = make_client(1, flow_coalescer=coalescer)
+    client.launch_flow_async(0, 0, 'p', 'lost', 0, 30, [])
+    follower = client.launch_flow_async(0, 0, 'p', 'lost', 0, 30, [])
+    assert coalescer.expire() == 0
+    assert not follower.done()
+    assert coalescer.stats()['in_flight'] == 1
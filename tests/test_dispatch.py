@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import threading
+from collections import defaultdict
+
+import pytest
+
+from yunhuni.cti.busnetcli.dispatch import BatchDispatcher, KeyedExecutor
+
+from conftest import UNIT_ID, RecordingClient, wait_for
+
+
+class BatchRecordingClient(RecordingClient):
+
+    def __init__(self, *args, **kwargs):
+        super(BatchRecordingClient, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def on_data_batch(self, items):
+        self.batches.append(len(items))
+        super(BatchRecordingClient, self).on_data_batch(items)
+
+
+def test_batch_dispatcher_submits_once_per_burst():
+    submitted = []
+    batches = []
+    dispatcher = BatchDispatcher(submitted.append, batches.append, max_batch_size=4)
+    for i in range(10):
+        dispatcher.put(i)
+    assert len(submitted) == 1
+    while submitted:
+        submitted.pop(0)()
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert len(dispatcher) == 0
+
+
+def test_batch_dispatcher_returns_handler_result():
+    submitted = []
+    dispatcher = BatchDispatcher(submitted.append, len)
+    dispatcher.put('a')
+    dispatcher.put('b')
+    assert submitted.pop()() == 2
+
+
+def test_client_batch_dispatch_keeps_order(bus, make_client):
+    client = make_client(1, cls=BatchRecordingClient, batch_dispatch=True, max_batch_size=16)
+    payloads = [str(i).encode() for i in range(200)]
+    for payload in payloads:
+        bus.inject(UNIT_ID, 1, 1, 2, payload)
+    assert wait_for(lambda: len(client.of('data')) == len(payloads))
+    assert [event[3] for event in client.of('data')] == payloads
+    assert sum(client.batches) == len(payloads)
+    assert max(client.batches) <= 16
+
+
+def test_keyed_executor_lanes():
+    executor = KeyedExecutor(3)
+    try:
+        assert executor.lanes == 3
+        assert executor.lane_of('a') == executor.lane_of('a')
+        results = [executor.submit_keyed('k', lambda i=i: i) for i in range(5)]
+        assert [fut.result(5) for fut in results] == list(range(5))
+    finally:
+        executor.shutdown()
+    with pytest.raises(ValueError):
+        KeyedExecutor(0)
+
+
+class SourceRecordingClient(RecordingClient):
+    """按来源记录收到的数据。来自 `slow_client_id` 的第一个数据包在 `gate` 打开之前阻塞处理"""
+
+    slow_client_id = 1
+
+    def __init__(self, *args, **kwargs):
+        super(SourceRecordingClient, self).__init__(*args, **kwargs)
+        self.gate = threading.Event()
+        self.by_source = defaultdict(list)
+
+    def on_data(self, head, data):
+        if head.src_unit_client_id == self.slow_client_id and not self.by_source[self.slow_client_id]:
+            self.gate.wait(5)
+        self.by_source[head.src_unit_client_id].append(bytes(data))
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_keyed_executor_orders_per_source(bus, make_client, batch):
+    executor = KeyedExecutor(4)
+    client = make_client(1, cls=SourceRecordingClient, event_executor=executor, batch_dispatch=batch)
+    sources = [1, 2, 3, 4, 5, 6]
+    for i in range(20):
+        for src in sources:
+            bus.inject(UNIT_ID, 1, 1, 2, str(i).encode(), src=(0, src, 11))
+    # 来源单元ID都是 0 ，来源键即来源客户端ID
+    others = [src for src in sources if executor.lane_of(src) != executor.lane_of(1)]
+    assert others
+    # 来源 1 阻塞期间，其它通道中的来源照常处理
+    assert wait_for(lambda: all(len(client.by_source[src]) == 20 for src in others))
+    assert not client.by_source[1]
+    client.gate.set()
+    assert wait_for(lambda: all(len(client.by_source[src]) == 20 for src in sources))
+    expected = [str(i).encode() for i in range(20)]
+    assert all(client.by_source[src] == expected for src in sources)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import multiprocessing
+
+import pytest
+
+from conftest import UNIT_ID, wait_for
+from yunhuni.cti.busnetcli.fanout import FanOut, _Ring
+
+
+def _upper(context, head, data):
+    context.reply(head, head.cmd, head.cmd_type, bytes(data).upper() + str(context.index).encode())
+
+
+@pytest.fixture
+def ring():
+    ring = _Ring.create(4096, multiprocessing.get_context())
+    try:
+        yield ring
+    finally:
+        ring.close(unlink=True)
+
+
+def _drain(ring):
+    records = []
+    ring.consume(lambda head, data: records.append((head.cmd, bytes(data))))
+    return records
+
+
+def test_ring_wraps_around(ring):
+    payload = b'x' * 1000
+    for round_ in range(10):
+        assert ring.put((round_, 0, 0, 0, 0, 0, 0, 0, 0, len(payload)), payload)
+        assert ring.put((round_, 1, 0, 0, 0, 0, 0, 0, 0, 0), None)
+        assert _drain(ring) == [(round_, payload), (round_, b'')]
+    assert ring.used == 0
+    assert ring.dropped == 0
+
+
+def test_ring_drops_when_full(ring):
+    payload = b'x' * 1000
+    while ring.put((1, 0, 0, 0, 0, 0, 0, 0, 0, len(payload)), payload):
+        pass
+    assert ring.dropped == 1
+    assert len(_drain(ring)) == 3
+    assert ring.put((1, 0, 0, 0, 0, 0, 0, 0, 0, len(payload)), payload)
+
+
+def test_fanout_replies_through_client(bus, make_client):
+    fanout = FanOut(_upper, workers=2)
+    try:
+        make_client(1, fanout=fanout)
+        sender = make_client(2)
+        payloads = [('m%d' % i).encode() for i in range(50)]
+        for payload in payloads:
+            sender.send_data(1, 2, UNIT_ID, 1, 11, payload)
+        assert wait_for(lambda: len(sender.of('data')) == len(payloads), timeout=20)
+        replies = [event[3] for event in sender.of('data')]
+        # 同一来源的数据包由同一个工作进程按顺序处理
+        worker = replies[0][-1:]
+        assert replies == [payload.upper() + worker for payload in payloads]
+        assert all(not item['dropped'] and item['alive'] for item in fanout.stats())
+    finally:
+        fanout.stop(5)
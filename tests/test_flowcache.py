@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+
+import pytest
+
+from conftest import wait_for
+from yunhuni.cti.busnetcli.errors import SmartBusError
+from yunhuni.cti.busnetcli.flowcache import FlowCache
+from yunhuni.cti.busnetcli.sim import FlowBehavior
+
+
+def test_key_of_canonical_params():
+    cache = FlowCache()
+    cache.cacheable('p', 'f')
+    assert cache.key_of(0, 'p', 'f', 0, [{'a': 1, 'b': 2}]) == cache.key_of(0, 'p', 'f', 0, [{'b': 2, 'a': 1}])
+    assert cache.key_of(0, 'p', 'f', 1, []) is None
+    assert cache.key_of(0, 'p', 'other', 0, []) is None
+    assert cache.key_of(0, 'p', 'f', 0, [object()]) is None
+
+
+def test_lru_and_ttl():
+    cache = FlowCache(max_entries=2)
+    cache.cacheable('p', 'f')
+    cache.cacheable('p', 'short', ttl=0.01)
+    keys = [cache.key_of(0, 'p', 'f', 0, [i]) for i in range(3)]
+    cache.put(keys[0], None, [0])
+    cache.put(keys[1], None, [1])
+    assert cache.get(keys[0]) == (None, [0])
+    cache.put(keys[2], None, [2])
+    # keys[1] 最久未使用，被淘汰
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == (None, [0])
+    short = cache.key_of(0, 'p', 'short', 0, [])
+    cache.put(short, None, [])
+    time.sleep(0.02)
+    assert cache.get(short) is None
+    stats = cache.stats()
+    assert (stats['evictions'], stats['expirations'], stats['hits'], stats['misses']) == (2, 1, 2, 2)
+
+
+def test_invalidate_and_uncacheable():
+    cache = FlowCache()
+    cache.cacheable('p', 'f')
+    cache.cacheable('p', 'g')
+    cache.put(cache.key_of(0, 'p', 'f', 0, []), None, [])
+    cache.put(cache.key_of(0, 'p', 'g', 0, []), None, [])
+    assert cache.invalidate('p', 'f') == 1
+    cache.uncacheable('p', 'g')
+    assert len(cache) == 0
+    assert cache.key_of(0, 'p', 'g', 0, []) is None
+
+
+def test_early_result_matched_after_launch():
+    cache = FlowCache()
+    cache.cacheable('p', 'f')
+    key = cache.key_of(0, 'p', 'f', 0, [])
+    with cache.launching():
+        cache.complete(1, 9, 'p', None, [42])
+        cache.launched(1, 9, key)
+    assert cache.get(key) == (None, [42])
+
+
+def test_client_serves_repeated_calls_from_cache(bus, make_client):
+    bus.set_flow('p', 'f', FlowBehavior(result=lambda params: [params[0] + 1]))
+    bus.set_flow('p', 'bad', FlowBehavior(ret=-5))
+    cache = FlowCache()
+    cache.cacheable('p', 'f')
+    cache.cacheable('p', 'bad')
+    client = make_client(1, flow_cache=cache)
+    assert client.launch_flow_async(0, 0, 'p', 'f', 0, 5, [1]).result(5) == [2]
+    assert wait_for(lambda: len(cache) == 1)
+    future = client.launch_flow_async(0, 0, 'p', 'f', 0, 5, [1])
+    assert future.done() and future.result() == [2]
+    assert client.launch_flow_async(0, 0, 'p', 'f', 0, 5, [2]).result(5) == [3]
+    assert bus.counters['flow'] == 2
+    # 同步调用命中缓存时，依次触发启动确认与结果返回
+    invoke_id = client.launch_flow(0, 0, 'p', 'f', 0, 5, [1])
+    assert wait_for(lambda: ('resp', invoke_id, [2]) in client.events)
+    assert ('ack', invoke_id, 1) in client.events
+    assert bus.counters['flow'] == 2
+    # 错误的结果不被缓存
+    for _ in range(2):
+        with pytest.raises(SmartBusError):
+            client.launch_flow_async(0, 0, 'p', 'bad', 0, 5, []).result(5)
+    assert bus.counters['flow'] == 4
+    assert cache.stats()['pending'] == 0
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pickle
+from ctypes import addressof, pointer
+
+from conftest import run_python2
+from yunhuni.cti.busnetcli._c.mutual import PacketHeader
+from yunhuni.cti.busnetcli.head import Head
+
+
+def _packet_header():
+    header = PacketHeader()
+    header.head_flag = 0x5b15
+    header.cmd = 3
+    header.cmdtype = 4
+    header.src_unit_client_type = b'\x0b'
+    header.src_unit_id = b'\x01'
+    header.src_unit_client_id = b'\x02'
+    header.dest_unit_client_type = b'\x0c'
+    header.dest_unit_id = b'\x05'
+    header.dest_unit_client_id = b'\x06'
+    header.packet_size = 120
+    header.datalen = 100
+    return header
+
+
+def test_head_from_pointer_and_address():
+    header = _packet_header()
+    expected = (3, 4, 11, 1, 2, 12, 5, 6, 120, 100)
+    assert tuple(Head(pointer(header))) == expected
+    head = Head.from_address(addressof(header))
+    assert tuple(head) == expected
+    assert (head.cmd, head.cmd_type, head.src_unit_id, head.dst_unit_client_id, head.data_length) == (3, 4, 1, 6, 100)
+
+
+def test_head_does_not_keep_the_struct():
+    header = _packet_header()
+    head = Head(pointer(header))
+    header.cmd = 9
+    assert head.cmd == 3
+
+
+def test_head_make_and_pickle():
+    head = Head._make(range(10))
+    assert isinstance(head, tuple)
+    assert head.packet_size == 8
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        clone = pickle.loads(pickle.dumps(head, protocol))
+        assert type(clone) is Head
+        assert clone == head
+    assert 'cmd=0' in repr(head)
+
+
+def test_head_pickle_python2():
+    out = run_python2(
+        'import pickle\n'
+        'from yunhuni.cti.busnetcli.head import Head\n'
+        'head = Head._make(range(10))\n'
+        'for protocol in range(pickle.HIGHEST_PROTOCOL + 1):\n'
+        '    clone = pickle.loads(pickle.dumps(head, protocol))\n'
+        '    assert type(clone) is Head and clone == head\n'
+        'print(clone.packet_size)\n'
+    )
+    assert out.strip() == '8'
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from yunhuni.cti.busnetcli.errors import SmartBusError, InvocationTableFullError
+from yunhuni.cti.busnetcli import invocation
+from yunhuni.cti.busnetcli.invocation import InvocationTable
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_TIMEOUT
+
+
+def test_ack_completes_no_return_call():
+    table = InvocationTable()
+    fut = Future()
+    with table.launching():
+        table.add(1, fut, 1, 1.0)
+    table.ack(1, 1)
+    assert fut.result(0) is None
+    assert len(table) == 0
+
+
+def test_return_completes_call():
+    table = InvocationTable()
+    fut = Future()
+    with table.launching():
+        table.add(1, fut, 0, 1.0)
+    table.ack(1, 1)
+    assert not fut.done()
+    table.complete(1, 1, ['a'])
+    assert fut.result(0) == ['a']
+
+
+def test_early_success_ack_completes_no_return_call():
+    table = InvocationTable()
+    fut = Future()
+    with table.launching():
+        table.ack(5, 1)
+        table.add(5, fut, 1, 1.0)
+    assert fut.result(0) is None
+    assert len(table) == 0
+
+
+def test_early_success_ack_does_not_complete_call_with_return():
+    table = InvocationTable()
+    fut = Future()
+    with table.launching():
+        table.ack(5, 1)
+        table.add(5, fut, 0, 1.0)
+    assert not fut.done()
+    table.complete(5, 1, [1])
+    assert fut.result(0) == [1]
+
+
+def test_early_ack_keeps_early_return():
+    table = InvocationTable()
+    fut = Future()
+    with table.launching():
+        table.complete(5, 1, ['r'])
+        table.ack(5, 1)
+        table.add(5, fut, 0, 1.0)
+    assert fut.result(0) == ['r']
+
+
+def test_early_failure_ack():
+    table = InvocationTable()
+    fut = Future()
+    with table.launching():
+        table.ack(5, -9, 'no such client')
+        table.add(5, fut, 0, 1.0)
+    with pytest.raises(SmartBusError) as info:
+        fut.result(0)
+    assert info.value.code == -9
+
+
+def test_late_result_outside_launching_is_ignored():
+    table = InvocationTable()
+    table.ack(5, 1)
+    table.complete(5, 1, [])
+    fut = Future()
+    with table.launching():
+        table.add(5, fut, 0, 1.0)
+    assert not fut.done()
+
+
+def test_timeout_result():
+    table = InvocationTable()
+    fut = Future()
+    with table.launching():
+        table.add(1, fut, 0, 1.0)
+    table.complete(1, SMARTBUS_ERR_TIMEOUT)
+    with pytest.raises(SmartBusError) as info:
+        fut.result(0)
+    assert info.value.code == SMARTBUS_ERR_TIMEOUT
+
+
+def test_max_pending():
+    table = InvocationTable(max_pending=1)
+    with table.launching():
+        table.add(1, Future(), 0, 1.0)
+    with pytest.raises(InvocationTableFullError):
+        with table.launching():
+            pass
+
+
+def test_deadlines_follow_monotonic_clock(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(invocation, 'monotonic', lambda: clock[0])
+    table = InvocationTable(expire_grace=1.0)
+    fut = Future()
+    with table.launching():
+        table.add(1, fut, 0, 2.0)
+    # 系统时间的跳变不影响超时
+    monkeypatch.setattr(time, 'time', lambda: 1e12)
+    assert table.expire() == 0
+    clock[0] += 3.5
+    assert table.expire() == 1
+    with pytest.raises(SmartBusError) as info:
+        fut.result(0)
+    assert info.value.code == SMARTBUS_ERR_TIMEOUT
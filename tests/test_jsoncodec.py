@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from yunhuni.cti.busnetcli.jsoncodec import JsonCodec, available_backends
+
+
+@pytest.fixture(params=available_backends())
+def codec(request):
+    return JsonCodec(request.param)
+
+
+@pytest.mark.parametrize('value', [
+    [],
+    [1, 'a', None, True, 1.5],
+    [u'中文', {u'k': u'值'}],
+    [u'😀', u'中'],
+])
+def test_round_trip(codec, value):
+    data = codec.encode(value)
+    assert isinstance(data, bytes)
+    assert codec.decode(data) == value
+    assert codec.decode(b' ' + data + b'\x00\x00') == value
+
+
+def test_encodes_cp936(codec):
+    assert codec.encode([u'中']) == u'["中"]'.encode('cp936')
+
+
+def test_unencodable_characters_escaped(codec):
+    data = codec.encode([u'😀'])
+    data.decode('ascii')
+    assert codec.decode(data) == [u'😀']
+
+
+def test_empty_input(codec):
+    assert codec.decode(b'') == []
+    assert codec.decode(b'\x00') == []
+
+
+def test_not_serializable(codec):
+    with pytest.raises(TypeError):
+        codec.encode([object()])
+
+
+def test_utf8_encoding():
+    assert JsonCodec('json', 'utf-8').encode([u'中']) == u'["中"]'.encode('utf-8')
+
+
+def test_unavailable_backend():
+    with pytest.raises(ValueError):
+        JsonCodec('no-such-json')
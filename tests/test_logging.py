@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import logging
+
+import pytest
+
+from conftest import UNIT_ID, RecordingClient, wait_for
+from yunhuni.cti.busnetcli.utils import hex_preview
+
+
+class PayloadCountingClient(RecordingClient):
+    """记录 :meth:`_format_payload` 调用次数的客户端"""
+
+    formatted = 0
+
+    @classmethod
+    def _format_payload(cls, data, size=None):
+        PayloadCountingClient.formatted += 1
+        return super(PayloadCountingClient, cls)._format_payload(data, size)
+
+
+class PreviewClient(RecordingClient):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def reset_counter():
+    PayloadCountingClient.formatted = 0
+
+
+def test_hex_preview():
+    assert hex_preview(b'hello') == '68656c6c6f'
+    assert hex_preview(b'hello', 2) == '6865...(+3 bytes)'
+    assert hex_preview(memoryview(b'hello'), 2, 100) == '6865...(+98 bytes)'
+
+
+def test_logger_cached_per_class():
+    assert RecordingClient.get_logger() is RecordingClient.get_logger()
+    assert RecordingClient.get_logger().name.endswith('.RecordingClient')
+    assert PreviewClient.get_logger().name.endswith('.PreviewClient')
+
+
+def test_payload_not_formatted_when_debug_disabled(bus, make_client, caplog):
+    caplog.set_level(logging.INFO)
+    receiver = make_client(2)
+    sender = make_client(1, cls=PayloadCountingClient)
+    sender.send_data(1, 2, UNIT_ID, 2, 11, b'x' * 1024)
+    assert wait_for(lambda: receiver.of('data'))
+    assert PayloadCountingClient.formatted == 0
+    assert not [record for record in caplog.records if record.levelno < logging.INFO]
+
+
+def test_payload_preview_logged_when_debug_enabled(bus, make_client, caplog):
+    caplog.set_level(logging.DEBUG)
+    receiver = make_client(2)
+    sender = make_client(1, cls=PreviewClient)
+    PreviewClient.configure_packet_logging(mode='preview', preview_size=2)
+    sender.send_data(1, 2, UNIT_ID, 2, 11, b'hello')
+    assert wait_for(lambda: receiver.of('data'))
+    messages = [record.getMessage() for record in caplog.records if record.name == PreviewClient.get_logger().name]
+    assert any('send_data' in message and 'data=6865...(+3 bytes)' in message for message in messages)
+
+
+def test_format_payload_modes():
+    class Formatter(RecordingClient):
+        pass
+
+    Formatter.configure_packet_logging(mode='size')
+    assert Formatter._format_payload(b'hello') == '<5 bytes>'
+    Formatter.configure_packet_logging(mode='full')
+    assert Formatter._format_payload(b'hello') == b'hello'
+    Formatter.configure_packet_logging(mode='preview', preview_size=4)
+    assert Formatter._format_payload(b'hello') == '68656c6c...(+1 bytes)'
+    assert Formatter._format_payload(None) is None
+    with pytest.raises(ValueError):
+        Formatter.configure_packet_logging(mode='verbose')
+    with pytest.raises(ValueError):
+        Formatter.configure_packet_logging(sample_rate=0)
+
+
+def test_packet_logger_sampling(caplog):
+    class Sampled(RecordingClient):
+        pass
+
+    caplog.set_level(logging.DEBUG)
+    Sampled.configure_packet_logging(sample_rate=4)
+    hits = sum(1 for _ in range(40) if Sampled._packet_logger() is not None)
+    assert hits == 10
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import struct
+from ctypes import Structure, c_int32, c_uint16
+
+import pytest
+
+from conftest import UNIT_ID, RecordingClient, run_python2, wait_for
+from yunhuni.cti.busnetcli.buffers import BufferPool
+from yunhuni.cti.busnetcli.messages import MessageRegistry, struct_message
+
+AgentState = struct_message('AgentState', 10, 1, '<HBi', 'agent_id, state, since')
+Tick = struct_message('Tick', 10, 3, '<i', ['value'])
+
+
+class CallInfo(Structure):
+    _pack_ = 1
+    _fields_ = [('call_id', c_int32), ('line', c_uint16)]
+
+
+class MessageRecordingClient(RecordingClient):
+    """原样记录 :meth:`on_data` 收到的消息对象。缓冲区池的 :class:`memoryview` 复制为 :class:`bytes`"""
+
+    def on_data(self, head, data):
+        self.events.append(('data', head.cmd, head.cmd_type, bytes(data) if isinstance(data, memoryview) else data))
+
+
+def test_struct_message_codec():
+    message = AgentState(1001, 2, since=-5)
+    assert message.size == 7
+    assert AgentState.unpack(message.pack()) == message
+    assert message._asdict() == {'agent_id': 1001, 'state': 2, 'since': -5}
+    assert repr(message) == 'AgentState(agent_id=1001, state=2, since=-5)'
+    assert Tick(7).pack() == struct.pack('<i', 7)
+    with pytest.raises(TypeError):
+        AgentState(1, 2)
+    with pytest.raises(ValueError):
+        struct_message('Bad', 1, 1, '<HB', ['a'])
+
+
+def test_unpack_many_and_columns():
+    data = b''.join(AgentState(i, i % 3, i * 10).pack() for i in range(4))
+    assert AgentState.unpack_many(data) == [AgentState(i, i % 3, i * 10) for i in range(4)]
+    columns = AgentState.unpack_columns(memoryview(data))
+    assert columns['agent_id'].typecode == 'H'
+    assert list(columns['since']) == [0, 10, 20, 30]
+    assert AgentState.unpack_many(b'') == []
+    with pytest.raises(struct.error):
+        AgentState.unpack_many(data[:-1])
+    with pytest.raises(struct.error):
+        AgentState.unpack_columns(data + b'\0')
+
+
+def test_unpack_many_python2():
+    out = run_python2(
+        'from yunhuni.cti.busnetcli.messages import struct_message\n'
+        'Tick = struct_message("Tick", 10, 3, "<i", ["value"])\n'
+        'data = b"".join(Tick(i).pack() for i in range(3))\n'
+        'assert Tick.unpack_many(bytearray(data)) == [Tick(0), Tick(1), Tick(2)]\n'
+        'print(list(Tick.unpack_columns(memoryview(data))["value"]))\n'
+    )
+    assert out.strip() == '[0, 1, 2]'
+
+
+def test_registry():
+    registry = MessageRegistry()
+    registry.register(AgentState)
+    registry.register(CallInfo, 10, 2)
+    with pytest.raises(ValueError):
+        registry.register(CallInfo)
+    with pytest.raises(TypeError):
+        registry.register(dict, 1, 1)
+    assert registry.key_of(CallInfo()) == (10, 2)
+    call = registry.decode(10, 2, bytes(CallInfo(5, 6)))
+    assert (call.call_id, call.line) == (5, 6)
+    assert registry.decode(9, 9, b'raw') == b'raw'
+    assert registry.unregister(10, 2) is CallInfo
+    assert registry.message_type(10, 2) is None
+    with pytest.raises(KeyError):
+        registry.key_of(CallInfo())
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_client_sends_and_decodes_messages(bus, make_client, pooled):
+    registry = MessageRegistry()
+    registry.register(AgentState)
+    registry.register(CallInfo, 10, 2)
+    pool = BufferPool() if pooled else None
+    receiver = make_client(2, cls=MessageRecordingClient, message_registry=registry, buffer_pool=pool)
+    client = make_client(1, message_registry=registry)
+    client.send_message(AgentState(1, 2, 3), UNIT_ID, 2, 11)
+    client.send_message(CallInfo(7, 8), UNIT_ID, 2, 11)
+    client.send_data(10, 1, UNIT_ID, 2, 11, b'short')
+    client.send_data(9, 9, UNIT_ID, 2, 11, b'raw')
+    assert wait_for(lambda: len(receiver.of('data')) == 3)
+    first, second, third = receiver.of('data')
+    assert first == ('data', 10, 1, AgentState(1, 2, 3))
+    assert (second[3].call_id, second[3].line) == (7, 8)
+    assert third == ('data', 9, 9, b'raw')
+    # 长度不足的数据包解码失败，被丢弃
+    assert receiver.stats()['messages'] == {'types': 2, 'errors': 1}
+
+
+def test_struct_message_as_payload(bus, make_client):
+    receiver = make_client(2)
+    client = make_client(1)
+    client.send_data(10, 3, UNIT_ID, 2, 11, Tick(1))
+    client.send_many([(10, 3, UNIT_ID, 2, 11, Tick(2))])
+    client.broadcast(10, 3, [(UNIT_ID, 2, 11)], Tick(3))
+    assert wait_for(lambda: len(receiver.of('data')) == 3)
+    assert [event[3] for event in receiver.of('data')] == [Tick(i).pack() for i in (1, 2, 3)]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from conftest import UNIT_ID, wait_for
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_DEST_NONEXIST
+from yunhuni.cti.busnetcli.errors import SmartBusError
+from yunhuni.cti.busnetcli.metrics import Histogram, Metrics, render_prometheus
+from yunhuni.cti.busnetcli.sim import FlowBehavior
+
+
+def test_histogram_exact_and_bucketed_values():
+    histogram = Histogram()
+    for value in range(1, 101):
+        histogram.record(value)
+    histogram.record(-5)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 101
+    assert snapshot['sum'] == 5050
+    assert snapshot['max'] == 100
+    assert snapshot['p50'] == 50
+    assert snapshot['p999'] == 100
+    # 大的值按相对误差不超过 1/32 分桶
+    histogram = Histogram()
+    histogram.record(1000000)
+    assert 1000000 <= histogram.percentiles([0.5])[0] <= 1000000 * (1 + 1.0 / 32)
+    assert Histogram().percentiles([0.5, 0.99]) == [0, 0]
+
+
+def test_flow_rtt_tolerates_result_before_launch():
+    metrics = Metrics()
+    metrics.flow_finished(7, 2.0)
+    metrics.flow_launched(7, 0, 1.5)
+    metrics.flow_launched(8, 0, 1.0)
+    metrics.flow_acked(8, 1, 1.1)
+    assert metrics.snapshot()['tracked_flows'] == 1
+    metrics.flow_finished(8, 1.25)
+    assert metrics.flow_rtt.snapshot()['count'] == 2
+    assert metrics.flow_rtt.snapshot()['max'] == 500000
+    assert metrics.snapshot()['tracked_flows'] == 0
+
+
+def test_client_metrics(bus, make_client):
+    bus.set_flow('p', 'f', FlowBehavior(result=[1]))
+    receiver = make_client(2, metrics=True)
+    client = make_client(1, metrics=True)
+    for _ in range(3):
+        client.send_data(1, 2, UNIT_ID, 2, 11, b'abcd')
+    with pytest.raises(SmartBusError):
+        client.send_data(1, 2, UNIT_ID, 99, 11, b'abcd')
+    assert client.launch_flow_async(0, 0, 'p', 'f', 0, 5, []).result(5) == [1]
+    assert wait_for(lambda: len(receiver.of('data')) == 3)
+    sent = client.stats()['metrics']
+    assert sent['sent'] == [{'cmd': 1, 'cmd_type': 2, 'packets': 3, 'bytes': 12}]
+    assert sent['errors'] == {SMARTBUS_ERR_DEST_NONEXIST: 1}
+    assert sent['connects'] == 1
+    assert sent['flow_rtt_us']['count'] == 1
+    received = receiver.stats()['metrics']
+    assert received['received'] == [{'cmd': 1, 'cmd_type': 2, 'packets': 3, 'bytes': 12}]
+    assert received['dispatch_latency_us']['count'] >= 3
+
+
+def test_render_prometheus(bus, make_client):
+    receiver = make_client(2, metrics=True)
+    plain = make_client(3)
+    receiver.ping(UNIT_ID, 3, 11, b'x')
+    assert wait_for(lambda: receiver.of('data'))
+    text = render_prometheus([receiver, plain])
+    assert '# TYPE smartbus_received_packets_total counter' in text
+    assert 'smartbus_connects_total{client_id="2"} 1' in text
+    assert 'smartbus_dispatch_latency_seconds_count{client_id="2"}' in text
+    # 未启用指标的客户端只输出队列深度
+    assert all(line.startswith('smartbus_queue_depth') for line in text.splitlines() if 'client_id="3"' in line)
+    assert text.endswith('\n')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import itertools
+import threading
+import time
+
+import pytest
+
+from conftest import UNIT_ID, RecordingClient, wait_for
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_BUFF_FULL, SMARTBUS_ERR_OTHER
+from yunhuni.cti.busnetcli.errors import OutboundQueueFullError
+from yunhuni.cti.busnetcli import outbound
+from yunhuni.cti.busnetcli.outbound import (
+    OVERFLOW_DROP_OLDEST, OVERFLOW_NONBLOCK, ITEM_OVERHEAD, OutboundQueue
+)
+
+
+class FakeSender(object):
+    """按预设的结果序列返回错误码的发送函数。序列用完后总是成功"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.sent = []
+        self.calls = 0
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def send(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data):
+        with self.lock:
+            self.calls += 1
+            result = self.results.pop(0) if self.results else 0
+        if isinstance(result, Exception):
+            raise result
+        if result == 0:
+            self.sent.append(data)
+        return result
+
+    def on_fail(self, cmd, cmd_type, dst_unit_id, dst_client_id, dst_client_type, data, error_code):
+        self.failed.append((data, error_code))
+
+
+def make_queue(sender, **kwargs):
+    queue = OutboundQueue(**kwargs)
+    queue.bind(sender.send, sender.on_fail)
+    return queue
+
+
+def test_direct_send_when_empty():
+    sender = FakeSender()
+    queue = make_queue(sender)
+    queue.send(1, 1, 0, 0, 0, b'a')
+    assert sender.sent == [b'a']
+    assert queue.depth == 0
+
+
+def test_buff_full_queued_and_retried_in_order():
+    sender = FakeSender([SMARTBUS_ERR_BUFF_FULL] * 3)
+    queue = make_queue(sender, min_backoff=0.001, max_backoff=0.01)
+    for i in range(5):
+        queue.send(1, 1, 0, 0, 0, str(i).encode())
+    assert queue.flush(5)
+    assert sender.sent == [b'0', b'1', b'2', b'3', b'4']
+    assert queue.stats()['retries'] >= 2
+    queue.close()
+
+
+def test_retry_waits_full_backoff_while_producers_put():
+    sender = FakeSender([SMARTBUS_ERR_BUFF_FULL] * 1000)
+    queue = make_queue(sender, min_backoff=0.3, max_backoff=0.3)
+    queue.send(1, 1, 0, 0, 0, b'first')
+    deadline = time.time() + 0.2
+    while time.time() < deadline:
+        queue.send(1, 1, 0, 0, 0, b'more')
+        time.sleep(0.001)
+    # 直接发送一次，后台线程重试一次；放入数据不应提前唤醒退避等待
+    assert sender.calls <= 2
+    queue.close(drain=False)
+
+
+def test_send_exception_reported_as_other_error():
+    sender = FakeSender([SMARTBUS_ERR_BUFF_FULL, RuntimeError('boom')])
+    queue = make_queue(sender, min_backoff=0.001)
+    queue.send(1, 1, 0, 0, 0, b'x')
+    assert wait_for(lambda: sender.failed)
+    assert sender.failed == [(b'x', SMARTBUS_ERR_OTHER)]
+    assert queue.stats()['failed'] == 1
+    queue.close()
+
+
+def test_overflow_policies():
+    size = 10 + ITEM_OVERHEAD
+    sender = FakeSender([SMARTBUS_ERR_BUFF_FULL] * 1000)
+    queue = make_queue(sender, max_bytes=size * 2, overflow=OVERFLOW_NONBLOCK, min_backoff=1, max_backoff=1)
+    queue.send(1, 1, 0, 0, 0, b'0123456789')
+    queue.send(1, 1, 0, 0, 0, b'0123456789')
+    with pytest.raises(OutboundQueueFullError):
+        for _ in range(3):
+            queue.send(1, 1, 0, 0, 0, b'0123456789')
+    queue.close(drain=False)
+
+    sender = FakeSender([SMARTBUS_ERR_BUFF_FULL] * 1000)
+    queue = make_queue(sender, max_bytes=size * 2, overflow=OVERFLOW_DROP_OLDEST, min_backoff=1, max_backoff=1)
+    for i in range(5):
+        queue.send(1, 1, 0, 0, 0, str(i).encode() * 10)
+    assert queue.stats()['dropped'] >= 2
+    assert all(code == SMARTBUS_ERR_BUFF_FULL for _, code in sender.failed)
+    queue.close(drain=False)
+
+
+def test_timeouts_follow_monotonic_clock(monkeypatch):
+    sender = FakeSender([SMARTBUS_ERR_BUFF_FULL] * 1000)
+    size = 1 + ITEM_OVERHEAD
+    queue = make_queue(sender, max_bytes=size * 2, block_timeout=0.5, min_backoff=100, max_backoff=100)
+    queue.send(1, 1, 0, 0, 0, b'x')
+    queue.send(1, 1, 0, 0, 0, b'y')
+    clock = itertools.count(0, 0.3)
+    monkeypatch.setattr(outbound, 'monotonic', lambda: next(clock))
+    # 系统时间停止不影响超时：超时按单调时钟计算
+    monkeypatch.setattr(time, 'time', lambda: 0.0)
+    assert not queue.flush(0.5)
+    with pytest.raises(OutboundQueueFullError):
+        queue.send(1, 1, 0, 0, 0, b'z')
+    monkeypatch.undo()
+    queue.close(drain=False)
+
+
+class CongestedClient(RecordingClient):
+    """在 `gate` 打开之前，发送总是返回 :data:`SMARTBUS_ERR_BUFF_FULL`"""
+
+    def __init__(self, *args, **kwargs):
+        super(CongestedClient, self).__init__(*args, **kwargs)
+        self.gate = threading.Event()
+
+    def _send_data(self, *args):
+        if not self.gate.is_set():
+            return SMARTBUS_ERR_BUFF_FULL
+        return super(CongestedClient, self)._send_data(*args)
+
+
+def _sent_packets(client):
+    return sum(item['packets'] for item in client.stats()['metrics']['sent'])
+
+
+def test_client_counts_queued_packets_when_actually_sent(make_client):
+    make_client(31)
+    queue = OutboundQueue(min_backoff=0.005, max_backoff=0.01)
+    client = make_client(32, cls=CongestedClient, outbound_queue=queue, metrics=True)
+    for i in range(3):
+        client.send_data(1, 2, UNIT_ID, 31, 11, str(i).encode())
+    assert queue.depth == 3
+    assert _sent_packets(client) == 0
+    client.gate.set()
+    assert queue.flush(5)
+    assert _sent_packets(client) == 3
+    queue.close()
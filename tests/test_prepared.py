@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from conftest import wait_for
+from yunhuni.cti.busnetcli.balance import Balancer
+from yunhuni.cti.busnetcli.flowcache import FlowCache
+from yunhuni.cti.busnetcli.sim import FlowBehavior
+
+
+def test_prepared_flow_launches(bus, make_client):
+    bus.set_flow('p', u'流程', FlowBehavior(result=lambda params: [sum(params)]))
+    client = make_client(1)
+    flow = client.prepare_flow(0, 0, 'p', u'流程', 0, 5)
+    assert flow.identifiers == b'p\0' + u'流程'.encode('utf-8') + b'\0'
+    assert [flow.launch_async([i, 1]).result(5) for i in range(3)] == [[1], [2], [3]]
+    invoke_id = flow.launch([5, 5])
+    assert wait_for(lambda: ('resp', invoke_id, [10]) in client.events)
+    assert ('ack', invoke_id, 1) in client.events
+
+
+def test_prepared_flow_requires_target_without_balancer(bus, make_client):
+    client = make_client(1)
+    with pytest.raises(ValueError):
+        client.prepare_flow(None, None, 'p', 'f', 0, 5)
+
+
+def test_prepared_flow_balanced_targets(bus, make_client):
+    bus.set_flow('p', 'f', FlowBehavior(result=[1]))
+    client = make_client(1, balancer=Balancer([(0, 0), (0, 1)]))
+    flow = client.prepare_flow(None, None, 'p', 'f', 0, 5)
+    assert [flow.launch_async([]).result(5) for _ in range(4)] == [[1]] * 4
+    # 每个目标的 ctypes 参数只构造一次
+    assert flow.c_target(0, 0) is flow.c_target(0, 0)
+    assert set(flow._c_targets) == {(0, 0), (0, 1)}
+
+
+def test_prepared_flow_uses_cache(bus, make_client):
+    bus.set_flow('p', 'f', FlowBehavior(result=[1]))
+    cache = FlowCache()
+    cache.cacheable('p', 'f')
+    client = make_client(1, flow_cache=cache)
+    flow = client.prepare_flow(0, 0, 'p', 'f', 0, 5)
+    assert flow.launch_async(['x']).result(5) == [1]
+    assert wait_for(lambda: len(cache) == 1)
+    assert flow.launch_async(['x']).result(5) == [1]
+    assert bus.counters['flow'] == 1
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from yunhuni.cti.busnetcli.errors import RateLimitedError
+from yunhuni.cti.busnetcli.ratelimit import (
+    ANY_DESTINATION, OP_NOTIFY, OP_SEND_DATA, POLICY_FAIL, POLICY_QUEUE, RateLimiter, TokenBucket
+)
+
+from conftest import UNIT_ID, wait_for
+
+
+def test_bucket_starts_full():
+    bucket = TokenBucket(0.01, 1)
+    # 早于桶的创建时刻的 `now` 不应扣减令牌
+    assert bucket.delay(bucket._updated - 1) == 0.0
+    bucket.take()
+    assert bucket.delay(bucket._updated) > 0
+
+
+def test_fail_policy_allows_burst_then_rejects():
+    limiter = RateLimiter(policy=POLICY_FAIL)
+    limiter.set_limit(OP_NOTIFY, 0.01, 2)
+    assert limiter.reserve(OP_NOTIFY, (0, 0)) == 0.0
+    assert limiter.reserve(OP_NOTIFY, (0, 0)) == 0.0
+    with pytest.raises(RateLimitedError):
+        limiter.reserve(OP_NOTIFY, (0, 0))
+    # 每个目标各自一个令牌桶
+    assert limiter.reserve(OP_NOTIFY, (0, 1)) == 0.0
+
+
+def test_any_destination_limit_is_shared():
+    limiter = RateLimiter(policy=POLICY_FAIL)
+    limiter.set_limit(OP_SEND_DATA, 0.01, 1, destination=ANY_DESTINATION)
+    limiter.reserve(OP_SEND_DATA, (0, 0))
+    with pytest.raises(RateLimitedError):
+        limiter.reserve(OP_SEND_DATA, (0, 1))
+
+
+def test_queue_policy_defers_send_data(bus, make_client):
+    receiver = make_client(31)
+    limiter = RateLimiter(policy=POLICY_QUEUE)
+    limiter.set_limit(OP_SEND_DATA, 20, 1)
+    client = make_client(32, rate_limiter=limiter)
+    for i in range(3):
+        client.send_data(1, 2, UNIT_ID, 31, 11, str(i).encode())
+    assert limiter.queued >= 1
+    assert wait_for(lambda: len(receiver.of('data')) == 3)
+    assert [event[3] for event in receiver.of('data')] == [b'0', b'1', b'2']
+    limiter.close()
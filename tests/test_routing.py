@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import UNIT_ID, wait_for
+from yunhuni.cti.busnetcli.buffers import BufferPool
+from yunhuni.cti.busnetcli.routing import ANY, Router
+
+
+def test_router_match_priority():
+    router = Router()
+    router.add(ANY, ANY, 'any')
+    router.add(ANY, 2, 'cmd_type')
+    router.add(1, ANY, 'cmd')
+    router.add(1, 2, 'exact')
+    assert router.lookup(1, 2) == ('exact', None)
+    assert router.lookup(1, 3) == ('cmd', None)
+    assert router.lookup(9, 2) == ('cmd_type', None)
+    assert router.lookup(9, 9) == ('any', None)
+    # 与 C 库一致，只比较低 8 位
+    assert router.lookup(0x101, 0x102) == ('exact', None)
+    assert router.remove(1, 2)
+    assert not router.remove(1, 2)
+    assert router.lookup(1, 2) == ('cmd', None)
+    router.remove(ANY, ANY)
+    assert router.lookup(9, 9) is None
+    assert len(router) == 2
+
+
+def test_client_routes_data(bus, make_client):
+    client = make_client(1)
+    exact, fallback = [], []
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        client.route(1, 2)(lambda head, data: exact.append(bytes(data)))
+        client.route(cmd_type=3, executor=executor)(lambda head, data: fallback.append((head.cmd, bytes(data))))
+        bus.inject(UNIT_ID, 1, 1, 2, b'a')
+        bus.inject(UNIT_ID, 1, 7, 3, b'b')
+        bus.inject(UNIT_ID, 1, 7, 4, b'dropped')
+        assert wait_for(lambda: exact and fallback)
+        assert exact == [b'a']
+        assert fallback == [(7, b'b')]
+        assert wait_for(lambda: client.stats()['router'] == {'routes': 2, 'unmatched': 1})
+        # 登记了处理函数之后，不再触发 on_data
+        assert not client.of('data')
+        assert client.unroute(1, 2)
+        assert not client.unroute(1, 2)
+    finally:
+        executor.shutdown()
+
+
+def test_routed_pooled_buffers_released(bus, make_client):
+    pool = BufferPool()
+    client = make_client(1, buffer_pool=pool)
+    received = []
+    client.route(1, 2)(lambda head, data: received.append(bytes(data)))
+    for _ in range(10):
+        bus.inject(UNIT_ID, 1, 1, 2, b'x' * 100)
+        bus.inject(UNIT_ID, 1, 9, 9, b'y' * 100)
+    assert wait_for(lambda: len(received) == 10 and client.router.unmatched == 10)
+    assert pool._slots
+    # 匹配与丢弃的数据包所用的缓冲区都已归还
+    assert wait_for(lambda: sum(len(free_list) for free_list in pool._free_lists) == len(pool._slots))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_DEST_NONEXIST, SMARTBUS_SYSCMD_PING_ACK
+from yunhuni.cti.busnetcli.client import _buffer_arg
+from yunhuni.cti.busnetcli.errors import SmartBusError
+
+from conftest import UNIT_ID, wait_for
+
+
+def test_buffer_arg_avoids_copies():
+    assert _buffer_arg(None) == (None, 0)
+    data = b'abc'
+    assert _buffer_arg(data) == (data, 3)
+    buff, length = _buffer_arg(bytearray(b'abcd'))
+    assert (bytes(buff), length) == (b'abcd', 4)
+    buff, length = _buffer_arg(memoryview(b'abcde')[1:])  # 只读的，复制一次
+    assert (buff, length) == (b'bcde', 4)
+
+
+@pytest.mark.parametrize('data', [b'bytes', bytearray(b'bytearray'), memoryview(b'memoryview'), None])
+def test_send_data_payload_types(make_client, data):
+    receiver = make_client(2)
+    sender = make_client(1)
+    sender.send_data(1, 2, UNIT_ID, 2, 11, data)
+    assert wait_for(lambda: receiver.of('data'))
+    assert receiver.of('data')[0] == ('data', 1, 2, None if data is None else bytes(data))
+
+
+def test_send_data_to_missing_destination(make_client):
+    sender = make_client(1)
+    with pytest.raises(SmartBusError) as info:
+        sender.send_data(1, 2, UNIT_ID, 99, 11, b'x')
+    assert info.value.code == SMARTBUS_ERR_DEST_NONEXIST
+
+
+def test_ping_returns_ack(make_client):
+    make_client(2)
+    sender = make_client(1)
+    sender.ping(UNIT_ID, 2, 11, b'hi')
+    assert wait_for(lambda: sender.of('data'))
+    assert sender.of('data')[0][1:] == (0, SMARTBUS_SYSCMD_PING_ACK, b'hi')
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from conftest import UNIT_ID, wait_for
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_DEST_NONEXIST, SMARTBUS_ERR_OK, SMARTBUS_ERR_TIMEOUT
+from yunhuni.cti.busnetcli.client import Client
+from yunhuni.cti.busnetcli.sim import FlowBehavior
+
+
+def test_flow_ack_failure(bus, make_client):
+    bus.set_flow('p', 'f', FlowBehavior(ack=-1, ack_msg=u'忙'))
+    client = make_client(1)
+    invoke_id = client.launch_flow(0, 0, 'p', 'f', 0, 5, [])
+    assert wait_for(lambda: client.of('ack'))
+    assert client.of('ack') == [('ack', invoke_id, -1)]
+    assert not client.of('resp')
+
+
+def test_flow_error_and_timeout(bus, make_client):
+    bus.set_flow('p', 'bad', FlowBehavior(ret=-5))
+    bus.set_flow('p', 'slow', FlowBehavior(ret=SMARTBUS_ERR_TIMEOUT))
+    client = make_client(1)
+    bad_id = client.launch_flow(0, 0, 'p', 'bad', 0, 5, [])
+    slow_id = client.launch_flow(0, 0, 'p', 'slow', 0, 0.05, [])
+    assert wait_for(lambda: client.of('error') and client.of('timeout'))
+    assert client.of('error') == [('error', bad_id, -5)]
+    assert client.of('timeout') == [('timeout', slow_id)]
+
+
+def test_inject_and_counters(bus, make_client):
+    client = make_client(1)
+    assert bus.inject(UNIT_ID, 1, 1, 2, b'x') == SMARTBUS_ERR_OK
+    assert bus.inject(UNIT_ID, 99, 1, 2, b'x') == SMARTBUS_ERR_DEST_NONEXIST
+    assert wait_for(lambda: client.of('data'))
+    assert bus.counters['data'] == 1
+    assert bus.counters['dropped'] == 1
+
+
+def test_global_connect_events(bus, make_client):
+    events = []
+    listener = lambda unit_id, client_id, client_type, access_unit_id, status, info: events.append(
+        (unit_id, client_id, status))
+    Client.add_global_connect_listener(listener)
+    try:
+        make_client(1)
+        assert wait_for(lambda: (0, 0, 2) in events and (0, 1, 2) in events)
+        make_client(2)
+        assert wait_for(lambda: (UNIT_ID, 2, 1) in events)
+        bus.detach(UNIT_ID, 2)
+        assert wait_for(lambda: (UNIT_ID, 2, 0) in events)
+    finally:
+        Client.remove_global_connect_listener(listener)
+
+
+def test_detach_with_reconnect(bus, make_client):
+    client = make_client(1)
+    bus.detach(UNIT_ID, 1, reconnect_delay=0.01)
+    assert wait_for(lambda: len(client.of('connect')) == 2)
+    assert client.of('disconnect') == [('disconnect',)]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from conftest import UNIT_ID, wait_for
+from yunhuni.cti.busnetcli._c.mutual import MAX_SMARTBUS_NODE_CLI_NUM, SMARTBUS_NODECLI_TYPE_IPSC
+from yunhuni.cti.busnetcli.client import Client
+from yunhuni.cti.busnetcli.topology import CHANGE_DOWN, CHANGE_UP, CHANGE_UPDATE, Node, Topology
+
+
+def test_put_get_and_type_index():
+    topology = Topology()
+    changes = []
+    topology.subscribe(lambda change, node, version: changes.append((change, node.client_id, version)))
+    assert topology.put(Node(0, 1, SMARTBUS_NODECLI_TYPE_IPSC, 0, ''))
+    assert topology.put(Node(0, 0, SMARTBUS_NODECLI_TYPE_IPSC, 0, ''))
+    assert not topology.put(Node(0, 0, SMARTBUS_NODECLI_TYPE_IPSC, 0, ''))
+    ipsc = topology.by_type(SMARTBUS_NODECLI_TYPE_IPSC)
+    assert [node.client_id for node in ipsc] == [0, 1]
+    assert topology.by_type(SMARTBUS_NODECLI_TYPE_IPSC) is ipsc
+    # 类型变化时，从原类型的分组中移除
+    assert topology.put(Node(0, 1, 11, 0, 'moved'))
+    assert [node.client_id for node in topology.by_type(SMARTBUS_NODECLI_TYPE_IPSC)] == [0]
+    assert topology.get(0, 1).info == 'moved'
+    assert (0, 1) in topology
+    assert topology.get(0, 5) is None
+    assert changes == [(CHANGE_UP, 1, 1), (CHANGE_UP, 0, 2), (CHANGE_UPDATE, 1, 3)]
+    assert topology.unit_version(0) == 3
+    assert topology.stats() == {'nodes': 2, 'version': 3, 'by_type': {SMARTBUS_NODECLI_TYPE_IPSC: 1, 11: 1}}
+
+
+def test_overflow_addresses_and_remove():
+    topology = Topology()
+    big = Node(3, MAX_SMARTBUS_NODE_CLI_NUM + 5, 11, 3, '')
+    topology.put(Node(3, 2, 11, 3, ''))
+    topology.put(big)
+    assert topology.get(3, MAX_SMARTBUS_NODE_CLI_NUM + 5) == big
+    assert [node.client_id for node in topology.unit(3)] == [2, MAX_SMARTBUS_NODE_CLI_NUM + 5]
+    assert topology.remove(3, MAX_SMARTBUS_NODE_CLI_NUM + 5) == big
+    assert topology.remove(3, MAX_SMARTBUS_NODE_CLI_NUM + 5) is None
+    assert len(topology) == 1
+
+
+def test_clear_and_failing_subscriber():
+    topology = Topology()
+    changes = []
+
+    def failing(change, node, version):
+        raise RuntimeError('boom')
+
+    topology.subscribe(failing)
+    topology.subscribe(lambda change, node, version: changes.append(change))
+    topology.put(Node(0, 0, 2, 0, ''))
+    topology.put(Node(1, 0, 2, 1, ''))
+    topology.clear()
+    assert len(topology) == 0
+    assert changes == [CHANGE_UP, CHANGE_UP, CHANGE_DOWN, CHANGE_DOWN]
+    topology.unsubscribe(failing)
+
+
+def test_client_topology_follows_global_connect(bus, make_client):
+    topology = Client.topology()
+    make_client(1)
+    assert wait_for(lambda: (0, 0) in topology and (0, 1) in topology)
+    assert [(node.unit_id, node.client_id) for node in topology.by_type(SMARTBUS_NODECLI_TYPE_IPSC)] == [(0, 0), (0, 1)]
+    make_client(2)
+    assert wait_for(lambda: (UNIT_ID, 2) in topology)
+    bus.detach(0, 1)
+    assert wait_for(lambda: (0, 1) not in topology)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import io
+import json
+
+from conftest import wait_for
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_ERR_TIMEOUT
+from yunhuni.cti.busnetcli.sim import FlowBehavior
+from yunhuni.cti.busnetcli.tracing import (
+    EVENT_ACK, EVENT_RETURN, PHASES, FlowTracer, JsonLinesExporter, RingExporter
+)
+
+
+def test_span_lifecycle_out_of_order():
+    ring = RingExporter()
+    tracer = FlowTracer(ring)
+    # 回调先于 launched 到达
+    tracer.acked(1, 7, 1, 10.002)
+    tracer.returned(1, 7, 1, 10.010)
+    tracer.launched(1, 7, 0, 0, 'p', 'f', 0, 10.000, 10.001)
+    assert not len(ring)
+    tracer.handled(1, 7, EVENT_ACK, 10.003)
+    assert not len(ring)
+    tracer.handled(1, 7, EVENT_RETURN, 10.011)
+    span, = ring.spans()
+    assert span.outcome == 'ok'
+    d = span.to_dict()
+    assert round(d['launch_ms'], 3) == 1.0
+    assert round(d['ack_ms'], 3) == 1.0
+    assert round(d['execute_ms'], 3) == 8.0
+    assert round(d['dispatch_ms'], 3) == 1.0
+    assert round(d['total_ms'], 3) == 11.0
+    assert tracer.stats() == {'pending': 0, 'exported': 1, 'evicted': 0}
+
+
+def test_evicts_oldest_pending_span():
+    ring = RingExporter()
+    tracer = FlowTracer(ring, max_pending=2)
+    for invoke_id in range(3):
+        tracer.launched(1, invoke_id, 0, 0, 'p', 'f', 0, 1.0, 1.0)
+    assert [span.invoke_id for span in ring.spans()] == [0]
+    assert ring.spans()[0].outcome == 'incomplete'
+    assert tracer.stats() == {'pending': 2, 'exported': 0, 'evicted': 1}
+
+
+def test_json_lines_exporter():
+    out = io.StringIO()
+    tracer = FlowTracer(JsonLinesExporter(out))
+    tracer.launched(1, 3, 0, 1, u'项目', 'f', 1, 1.0, 1.0)
+    tracer.acked(1, 3, 1, 1.5)
+    tracer.handled(1, 3, EVENT_ACK, 1.5)
+    tracer.close()
+    record = json.loads(out.getvalue())
+    assert record['project_id'] == u'项目'
+    assert record['outcome'] == 'ok'
+    assert record['execute_ms'] is None
+
+
+def test_client_traces_flows(bus, make_client):
+    bus.set_flow('p', 'ok', FlowBehavior(result=[1], delay=0.01))
+    bus.set_flow('p', 'slow', FlowBehavior(ret=SMARTBUS_ERR_TIMEOUT))
+    bus.set_flow('p', 'busy', FlowBehavior(ack=-1))
+    ring = RingExporter()
+    client = make_client(1, flow_tracer=FlowTracer(ring))
+    client.launch_flow(0, 0, 'p', 'ok', 0, 5, [])
+    client.launch_flow(0, 1, 'p', 'slow', 0, 0.05, [])
+    client.launch_flow(0, 0, 'p', 'busy', 0, 5, [])
+    assert wait_for(lambda: len(ring) == 3)
+    outcomes = dict((span.flow_id, span.outcome) for span in ring.spans())
+    assert outcomes == {'ok': 'ok', 'slow': 'timeout', 'busy': 'ack_error'}
+    summary = ring.summary()
+    assert summary[('p', 0, 0)]['outcomes'] == {'ok': 1, 'ack_error': 1}
+    assert summary[('p', 0, 1)]['outcomes'] == {'timeout': 1}
+    assert all(summary[('p', 0, 0)][phase] is not None for phase in PHASES)
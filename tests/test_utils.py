@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from yunhuni.cti.busnetcli.utils import DecodeCache, b2s_recode, hex_preview
+
+
+def test_decode_cache_matches_b2s_recode():
+    cache = DecodeCache('cp936')
+    raw = u' 项目\x00\x00'.encode('cp936')
+    expected = b2s_recode(raw.strip(b'\x00'), 'cp936', 'utf-8').strip()
+    assert cache(raw) == expected
+    assert cache(raw) is cache(raw)
+    assert len(cache) == 1
+
+
+def test_decode_cache_capacity():
+    cache = DecodeCache(capacity=2)
+    for name in (b'a', b'b', b'c'):
+        cache(name)
+    assert len(cache) <= 2
+
+
+def test_hex_preview():
+    assert hex_preview(b'hello') == '68656c6c6f'
+    assert hex_preview(b'hello', limit=2) == '6865...(+3 bytes)'
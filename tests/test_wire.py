@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from yunhuni.cti.busnetcli.balance import Balancer
+from yunhuni.cti.busnetcli.errors import RateLimitedError
+from yunhuni.cti.busnetcli.ratelimit import OP_NOTIFY, POLICY_FAIL, RateLimiter
+from yunhuni.cti.busnetcli.client import Client
+from yunhuni.cti.busnetcli.sim import FlowBehavior, SimBus, SimServer
+from yunhuni.cti.busnetcli.wire import (
+    FLOW_RESULT_STRUCT, WIRE_HEAD_SIZE, WIRE_SYSCMD_FLOW_RET, FrameDecoder, LoopbackClient, ProtocolError, pack_head
+)
+from yunhuni.cti.busnetcli._c.mutual import SMARTBUS_CMDTYPE_SYSTEM, SMARTBUS_SYSCMD_PING_ACK
+
+from conftest import UNIT_ID, RecordingClient, wait_for
+
+#: LoopbackClient 所用的本地单元ID
+LOOPBACK_UNIT_ID = 20
+
+
+class RecordingLoopbackClient(RecordingClient, LoopbackClient):
+    # 以 RecordingClient 记录的连接状态代替 LoopbackClient.connected 属性
+    connected = False
+
+
+@pytest.fixture
+def server(bus):
+    sim_server = SimServer(bus).start_in_thread()
+    try:
+        yield sim_server
+    finally:
+        sim_server.close()
+
+
+@pytest.fixture
+def make_loopback_client(server):
+    clients = []
+
+    def factory(client_id, client_type=11, **kwargs):
+        client = RecordingLoopbackClient(client_id, client_type, '127.0.0.1', server.port, unit_id=LOOPBACK_UNIT_ID, **kwargs)
+        clients.append(client)
+        client.activate()
+        assert wait_for(lambda: client.connected)
+        return client
+
+    try:
+        yield factory
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_wire_launch_flow(bus, make_loopback_client):
+    bus.set_flow('p', 'f', FlowBehavior(result=lambda params: params[::-1]))
+    client = make_loopback_client(5)
+    assert client.launch_flow_async(0, 0, 'p', 'f', 0, 5, ['a', u'中']).result(5) == [u'中', 'a']
+
+
+def test_wire_notify_is_rate_limited(bus, make_loopback_client):
+    limiter = RateLimiter(policy=POLICY_FAIL)
+    limiter.set_limit(OP_NOTIFY, 0.01, 1)
+    client = make_loopback_client(5, rate_limiter=limiter)
+    client.notify(0, 0, 'p', 'title', 0, 10, 'hello')
+    with pytest.raises(RateLimitedError):
+        client.notify(0, 0, 'p', 'title', 0, 10, 'hello')
+    assert wait_for(lambda: bus.counters['notify'] == 1)
+
+
+def test_wire_notify_balanced_target(bus, make_loopback_client):
+    balancer = Balancer([(0, 0), (0, 1)])
+    client = make_loopback_client(5, balancer=balancer)
+    client.notify(None, None, 'p', 'title', 0, 10, 'hello')
+    assert wait_for(lambda: bus.counters['notify'] == 1)
+
+
+def test_wire_topology_per_instance(bus, make_loopback_client):
+    other_bus = SimBus(unit_id=1).start()
+    other_bus.add_ipsc(1, 7)
+    other_server = SimServer(other_bus).start_in_thread()
+    try:
+        client = make_loopback_client(5)
+        other = RecordingLoopbackClient(6, 11, '127.0.0.1', other_server.port, unit_id=LOOPBACK_UNIT_ID)
+        other.activate()
+        try:
+            assert wait_for(lambda: other.connected)
+            assert wait_for(lambda: (0, 0) in client.topology() and (0, 1) in client.topology())
+            assert wait_for(lambda: (1, 7) in other.topology())
+            assert (1, 7) not in client.topology()
+            assert (0, 0) not in other.topology()
+            assert (1, 7) not in Client.topology()
+        finally:
+            other.close()
+    finally:
+        other_server.close()
+        other_bus.stop()
+
+
+def test_wire_topology_cleared_on_disconnect(bus, make_loopback_client):
+    client = make_loopback_client(5)
+    assert wait_for(lambda: (0, 0) in client.topology())
+    bus.detach(LOOPBACK_UNIT_ID, 5)
+    assert wait_for(lambda: not client.connected)
+    assert len(client.topology()) == 0
+
+
+def _frame(cmd, cmd_type, payload):
+    return pack_head(cmd, cmd_type, 11, 0, 1, 11, 0, 2, len(payload)) + payload
+
+
+def test_frame_decoder_splits_partial_stream():
+    frames = []
+    decoder = FrameDecoder(lambda fields, payload: frames.append((fields[1], fields[2], bytes(payload))))
+    stream = _frame(1, 2, b'hello') + _frame(3, 4, b'') + _frame(5, 6, b'world')
+    for i in range(len(stream)):
+        decoder.feed(stream[i:i + 1])
+    assert frames == [(1, 2, b'hello'), (3, 4, b''), (5, 6, b'world')]
+
+
+def test_frame_decoder_rejects_bad_packets():
+    with pytest.raises(ProtocolError):
+        FrameDecoder(lambda *args: None).feed(b'\x00' * WIRE_HEAD_SIZE)
+    with pytest.raises(ProtocolError):
+        FrameDecoder(lambda *args: None, max_packet_size=64).feed(_frame(1, 2, b'x' * 100))
+
+
+def test_wire_exchanges_data_with_library_client(bus, make_client, make_loopback_client):
+    lib_client = make_client(2)
+    client = make_loopback_client(5)
+    client.send_data(1, 2, UNIT_ID, 2, 11, b'over-the-wire')
+    assert wait_for(lambda: lib_client.of('data'))
+    assert lib_client.of('data') == [('data', 1, 2, b'over-the-wire')]
+    bus.inject(LOOPBACK_UNIT_ID, 5, 3, 4, b'inbound')
+    assert wait_for(lambda: client.of('data'))
+    assert client.of('data') == [('data', 3, 4, b'inbound')]
+
+
+def test_wire_ping_ack(bus, make_client, make_loopback_client):
+    make_client(2)
+    client = make_loopback_client(5)
+    client.ping(UNIT_ID, 2, 11, b'hi')
+    assert wait_for(lambda: client.of('data'))
+    assert client.of('data')[0] == ('data', 0, SMARTBUS_SYSCMD_PING_ACK, b'hi')
+
+
+def test_wire_reconnects_after_disconnect(bus, make_loopback_client):
+    client = make_loopback_client(5, reconnect_interval=0.01)
+    bus.detach(LOOPBACK_UNIT_ID, 5)
+    assert wait_for(lambda: client.of('disconnect'))
+    assert wait_for(lambda: len(client.of('connect')) == 2)
+
+
+def test_wire_prepared_flow(bus, make_loopback_client):
+    bus.set_flow('p', 'f', FlowBehavior(result=lambda params: params * 2))
+    client = make_loopback_client(5)
+    flow = client.prepare_flow(0, 0, 'p', 'f', 0, 5)
+    assert flow.launch_async(['a']).result(5) == ['a', 'a']
+
+
+def test_bad_packet_dropped_without_closing_connection(bus, make_loopback_client):
+    client = make_loopback_client(5)
+    stream = b''.join((
+        # 包体过短
+        _frame(WIRE_SYSCMD_FLOW_RET, SMARTBUS_CMDTYPE_SYSTEM, b'\x01'),
+        # 流程返回值不是 JSON
+        _frame(WIRE_SYSCMD_FLOW_RET, SMARTBUS_CMDTYPE_SYSTEM, FLOW_RESULT_STRUCT.pack(1, 1) + b'p\0not json'),
+        _frame(1, 2, b'still alive'),
+    ))
+    protocol = client._transport.get_protocol()
+    client.loop.call_soon_threadsafe(protocol.data_received, stream)
+    assert wait_for(lambda: client.of('data'))
+    assert client.of('data') == [('data', 1, 2, b'still alive')]
+    assert client.connected and not client.of('disconnect')
+
+
+def test_close_releases_owned_loop_and_executor(bus, server):
+    client = RecordingLoopbackClient(7, 11, '127.0.0.1', server.port, unit_id=LOOPBACK_UNIT_ID)
+    client.activate()
+    assert wait_for(lambda: client.connected)
+    client.close()
+    assert wait_for(lambda: client.loop.is_closed())
+    assert client.of('disconnect')
+    with pytest.raises(RuntimeError):
+        client._event_executor.submit(lambda: None)
+    client.close()
+
+
+def test_close_keeps_given_executor(bus, server):
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        client = RecordingLoopbackClient(7, 11, '127.0.0.1', server.port, unit_id=LOOPBACK_UNIT_ID,
+                                         event_executor=executor)
+        client.activate()
+        assert wait_for(lambda: client.connected)
+        client.close()
+        assert wait_for(lambda: client.loop.is_closed())
+        assert executor.submit(lambda: 1).result(5) == 1
+    finally:
+        executor.shutdown()